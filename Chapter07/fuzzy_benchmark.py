@@ -0,0 +1,292 @@
+"""Benchmark the rolling hash and scoring of the fuzzy hasher."""
+import argparse
+import os
+import timeit
+
+# The ssdeep C extension is only timed when it is installed
+try:
+    import ssdeep
+except ImportError:
+    ssdeep = None
+
+import fuzzy_hasher
+
+"""
+MIT License
+Copyright (c) 2018 Chapin Bryce, Preston Miller
+Please share comments and questions at:
+  https://github.com/PythonForensics/Learning-Python-for-Forensics
+  or email pyforcookbook@gmail.com
+
+Permission is hereby granted, free of charge, to any person
+obtaining a copy of this software and associated documentation
+files (the "Software"), to deal in the Software without
+restriction, including without limitation the rights to use,
+copy, modify, merge, publish, distribute, sublicense, and/or
+sell copies of the Software, and to permit persons to whom the
+Software is furnished to do so, subject to the following
+conditions:
+
+The above copyright notice and this permission notice shall be
+included in all copies or substantial portions of the Software.
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+OTHER DEALINGS IN THE SOFTWARE.
+"""
+
+__authors__ = ["Chapin Bryce", "Preston Miller"]
+__date__ = 20181027
+__description__ = '''Measure the throughput of the spamsum rolling
+    hash implementations and of signature comparison over a fixed
+    corpus of files.'''
+
+# Corpus shipped next to this script
+CORPUS = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                      'test_data')
+
+# Number of times every pair of signatures is compared per repeat
+COMPARE_ROUNDS = 200
+
+
+def main(corpus, repeat):
+    """
+    The main function times each rolling hash implementation and
+    fuzz_file over every file of the corpus, and each comparison
+    implementation over every pair of their signatures
+    :param corpus: folder of files to hash
+    :param repeat: number of times to hash the corpus
+    :return: None
+    """
+    files = [os.path.join(root, f)
+             for root, _, names in os.walk(corpus)
+             for f in sorted(names)]
+    data = []
+    for file_entry in files:
+        with open(file_entry, 'rb') as open_file:
+            data.append(open_file.read())
+    megabytes = sum(len(d) for d in data) * repeat / 1048576.0
+    print("Corpus of {} files, {:.2f} MB hashed {} time(s)".format(
+        len(data), megabytes / repeat, repeat))
+
+    # Make sure every implementation agrees before timing them
+    for chunk in data:
+        expected = dict_rolling_hash(chunk)
+        if slot_rolling_hash(chunk) != expected or \
+                block_rolling_hash(chunk) != expected:
+            raise ValueError("Rolling hash implementations disagree")
+        if fuzzy_hasher.numpy is not None and \
+                numpy_rolling_hash(chunk) != expected:
+            raise ValueError("Rolling hash implementations disagree")
+
+    print("{:<24}{:>10}{:>10}".format('Implementation', 'Seconds',
+                                      'MB/s'))
+    timings = [('dict (per byte)', dict_rolling_hash),
+               ('slots (per byte)', slot_rolling_hash),
+               ('slots (per block)', block_rolling_hash)]
+    if fuzzy_hasher.numpy is not None:
+        timings.append(('numpy (per block)', numpy_rolling_hash))
+    for name, function in timings:
+        elapsed = time_function(function, data, repeat)
+        print("{:<24}{:>10.3f}{:>10.2f}".format(
+            name, elapsed, megabytes / elapsed))
+
+    elapsed = time_function(fuzzy_hasher.fuzz_file, files, repeat)
+    print("{:<24}{:>10.3f}{:>10.2f}".format(
+        'fuzz_file', elapsed, megabytes / elapsed))
+    if fuzzy_hasher.numpy is not None:
+        elapsed = time_function(
+            lambda file_entry: fuzzy_hasher.fuzz_file(file_entry, True),
+            files, repeat)
+        print("{:<24}{:>10.3f}{:>10.2f}".format(
+            'fuzz_file (numpy)', elapsed, megabytes / elapsed))
+
+    # Compare every pair of signatures of the corpus, including
+    # each signature with itself
+    hashes = [fuzzy_hasher.fuzz_file(file_entry) for file_entry in files]
+    pairs = [(hash1, hash2) for hash1 in hashes for hash2 in hashes]
+    signatures = dict((sigval, fuzzy_hasher.Signature(sigval))
+                      for sigval in hashes)
+    parsed = [(signatures[hash1], signatures[hash2])
+              for hash1, hash2 in pairs]
+    for hash1, hash2 in pairs:
+        expected = dp_compare(hash1, hash2)
+        if fuzzy_hasher.compare(hash1, hash2) != expected:
+            raise ValueError("Comparison implementations disagree")
+        if ssdeep is not None and ssdeep.compare(hash1, hash2) != expected:
+            raise ValueError("Comparison implementations disagree")
+
+    compares = len(pairs) * COMPARE_ROUNDS * repeat
+    print("{:<24}{:>10}{:>12}".format('Comparison', 'Seconds',
+                                      'Compares/s'))
+    timings = [('dynamic programming', pairs, dp_compare),
+               ('compare', pairs, fuzzy_hasher.compare),
+               ('compare_signatures', parsed,
+                fuzzy_hasher.compare_signatures)]
+    if ssdeep is not None:
+        timings.append(('ssdeep.compare', pairs, ssdeep.compare))
+    for name, arguments, function in timings:
+        elapsed = time_function(lambda pair: function(*pair),
+                                arguments, repeat * COMPARE_ROUNDS)
+        print("{:<24}{:>10.3f}{:>12,.0f}".format(
+            name, elapsed, compares / elapsed))
+
+
+def time_function(function, arguments, repeat):
+    """
+    Time a function over every argument
+    :param function: function to call
+    :param arguments (list): argument of each call
+    :param repeat (int): number of times to call it on each argument
+    :return (float): elapsed seconds
+    """
+    start = timeit.default_timer()
+    for _ in range(repeat):
+        for argument in arguments:
+            function(argument)
+    return timeit.default_timer() - start
+
+
+def dp_compare(sigval1, sigval2):
+    """
+    Score two hashes as compare does, filling the full edit
+    distance table and searching for a common substring on every
+    call
+    :param sigval1 (str): ssdeep hash
+    :param sigval2 (str): ssdeep hash
+    :return (int): similarity from 0 to 100
+    """
+    def score(part1, part2, block_size):
+        window = fuzzy_hasher.CONTEXT_WINDOW
+        if not any(part1[i:i + window] in part2
+                   for i in range(len(part1) - window + 1)):
+            return 0
+        # Changing a character costs a removal and an insertion
+        row = list(range(len(part2) + 1))
+        for i, char1 in enumerate(part1, 1):
+            previous, row[0] = row[0], i
+            for j, char2 in enumerate(part2, 1):
+                cost = previous if char1 == char2 else previous + 2
+                previous, row[j] = row[j], min(row[j] + 1,
+                                               row[j - 1] + 1, cost)
+        total = len(part1) + len(part2)
+        value = (row[-1] * fuzzy_hasher.SIGNATURE_LEN) // total
+        value = 100 - (100 * value) // fuzzy_hasher.SIGNATURE_LEN
+        if block_size >= fuzzy_hasher.CAP_BLOCK_SIZE:
+            return value
+        return min(value, block_size // fuzzy_hasher.MIN_BLOCK_SIZE *
+                   min(len(part1), len(part2)))
+
+    block_size1, part11, part12 = sigval1.split(':')
+    block_size2, part21, part22 = sigval2.split(':')
+    block_size1 = int(block_size1)
+    block_size2 = int(block_size2)
+    part11, part12, part21, part22 = [
+        fuzzy_hasher.eliminate_sequences(part)
+        for part in (part11, part12, part21, part22)]
+    if block_size1 == block_size2:
+        if (part11, part12) == (part21, part22):
+            return 100
+        return max(score(part11, part21, block_size1),
+                   score(part12, part22, block_size1 * 2))
+    elif block_size1 == block_size2 * 2:
+        return score(part11, part22, block_size1)
+    elif block_size2 == block_size1 * 2:
+        return score(part12, part21, block_size2)
+    return 0
+
+
+def dict_rolling_hash(data):
+    """
+    The rolling hash as originally implemented in fuzz_file, with
+    its state in a dictionary
+    :param data (bytes): data to hash
+    :return (list): computed hash value after each byte
+    """
+    def update_rolling_hash(nb, rh):
+        # Calculate R2
+        rh['r2'] -= rh['r1']
+        rh['r2'] += (fuzzy_hasher.CONTEXT_WINDOW * nb)
+
+        # Calculate R1
+        rh['r1'] += nb
+        rh['r1'] -= rh['rw'][rh['rn'] % fuzzy_hasher.CONTEXT_WINDOW]
+
+        # Update RW and RN
+        rh['rw'][rh['rn'] % fuzzy_hasher.CONTEXT_WINDOW] = nb
+        rh['rn'] += 1
+
+        # Calculate R3
+        rh['r3'] = (rh['r3'] << 5) & 0xFFFFFFFF
+        rh['r3'] = rh['r3'] ^ nb
+
+        # Return the sum of R1 + R2 + R3
+        return (rh['r1'] + rh['r2'] + rh['r3']) & 0xFFFFFFFF
+
+    rolling_hash = {
+        'r1': 0,
+        'r2': 0,
+        'r3': 0,
+        'rn': 0,
+        'rw': [0 for _ in range(fuzzy_hasher.CONTEXT_WINDOW)]
+    }
+    return [update_rolling_hash(new_byte, rolling_hash)
+            for new_byte in bytearray(data)]
+
+
+def slot_rolling_hash(data):
+    """
+    The RollingHash class updated one byte at a time
+    :param data (bytes): data to hash
+    :return (list): computed hash value after each byte
+    """
+    rolling_hash = fuzzy_hasher.RollingHash()
+    return [rolling_hash.update(new_byte) for new_byte in data]
+
+
+def block_rolling_hash(data):
+    """
+    The RollingHash class updated a READ_SIZE chunk at a time
+    :param data (bytes): data to hash
+    :return (list): computed hash value after each byte
+    """
+    rolling_hash = fuzzy_hasher.RollingHash()
+    values = []
+    for offset in range(0, len(data), fuzzy_hasher.READ_SIZE):
+        values.extend(rolling_hash.update_block(
+            data[offset:offset + fuzzy_hasher.READ_SIZE]))
+    return values
+
+
+def numpy_rolling_hash(data):
+    """
+    The NumpyRollingHash class updated a READ_SIZE chunk at a time
+    :param data (bytes): data to hash
+    :return (list): computed hash value after each byte
+    """
+    rolling_hash = fuzzy_hasher.NumpyRollingHash()
+    values = []
+    for offset in range(0, len(data), fuzzy_hasher.READ_SIZE):
+        values.extend(rolling_hash.update_block(
+            data[offset:offset + fuzzy_hasher.READ_SIZE]).tolist())
+    return values
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description=__description__,
+        epilog='Built by {}. Version {}'.format(
+            ", ".join(__authors__), __date__),
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+    parser.add_argument('PATH', nargs='?', default=CORPUS,
+        help='Folder of files to use as the corpus.')
+    parser.add_argument('-r', '--repeat', type=int, default=3,
+        help='Number of times to hash and compare the corpus.')
+    args = parser.parse_args()
+
+    main(args.PATH, args.repeat)
@@ -1,10 +1,22 @@
-"""Spamsum hash generator."""
+"""Spamsum hash generator and comparison."""
 import argparse
+import collections
+import concurrent.futures
+import functools
+import itertools
 import logging
 import json
 import os
 import sys
 
+import signature_cache
+
+# NumPy is only needed to find reset points with --numpy
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 """
 Copyright (C) 2002 Andrew Tridgell <tridge@samba.org>
 
@@ -30,8 +42,8 @@ Preston Miller
 
 __authors__ = ["Chapin Bryce", "Preston Miller"]
 __date__ = 20181027
-__description__ = '''Generate file signatures using
-    the spamsum algorithm.'''
+__description__ = '''Generate ssdeep compatible file signatures
+    using the spamsum algorithm.'''
 
 # Base64 Alphabet
 ALPHABET = 'ABCDEFGHIJKLMNOPQRSTUVWXYZ'
@@ -42,17 +54,46 @@ CONTEXT_WINDOW = 7
 FNV_PRIME = 0x01000193
 HASH_INIT = 0x28021967
 SIGNATURE_LEN = 64
+MIN_BLOCK_SIZE = 3
+
+# FNV hash transitions. Only the low six bits of the hash reach the
+# signature, so it is tracked modulo 64 and shifted left by 8 bits
+# to index the table together with the next byte
+FNV_TABLE = [(((h * FNV_PRIME) ^ b) & 0x3F) << 8
+             for h in range(64) for b in range(256)]
+FNV_INIT = (HASH_INIT & 0x3F) << 8
+
+# Scores of block sizes below this are capped by the length of
+# the signature parts, so short signatures do not exaggerate a match
+CAP_BLOCK_SIZE = (99 + CONTEXT_WINDOW) // CONTEXT_WINDOW * MIN_BLOCK_SIZE
+
+# Number of parsed signatures kept by compare
+SIGNATURE_CACHE_SIZE = 4096
+
+# Number of bytes read from a file at a time
+READ_SIZE = 1024 * 1024
 
 # Argument handling constants
 OUTPUT_OPTS = ['txt', 'json', 'csv']
+
+# Number of files hashed by a worker process per task, and number
+# of tasks queued per worker process
+FILES_PER_TASK = 64
+TASKS_PER_JOB = 4
 logger = logging.getLogger(__file__)
 
 
-def main(file_path, output_type):
+def main(file_path, output_type, jobs=1, ordered=True,
+         use_numpy=False, cache_path=None):
     """
     The main function handles the main operations of the script
     :param file_path: path to generate signatures for
     :param output_type: type of output to provide
+    :param jobs: number of processes hashing a directory
+    :param ordered: print directory results in walk order rather
+        than as they complete
+    :param use_numpy: find reset points with NumPy
+    :param cache_path: SQLite file to cache signatures in
     :return: None
     """
 
@@ -64,127 +105,564 @@ def main(file_path, output_type):
                 output_type, ", ".join(OUTPUT_OPTS)))
         sys.exit(2)
 
-    # Check provided file path
-    file_path = os.path.abspath(file_path)
-    if os.path.isdir(file_path):
-        # Process files in folders
-        for root, _, files in os.walk(file_path):
-            for f in files:
-                file_entry = os.path.join(root, f)
-                sigval = fuzz_file(file_entry)
+    if use_numpy and numpy is None:
+        logger.warning("NumPy is not installed. Falling back to "
+                       "pure Python")
+
+    cache = None
+    if cache_path:
+        cache = signature_cache.SignatureCache(cache_path, 'ssdeep')
+
+    try:
+        # Check provided file path
+        file_path = os.path.abspath(file_path)
+        if os.path.isdir(file_path):
+            # Process files in folders
+            file_entries = (os.path.join(root, f)
+                            for root, _, files in os.walk(file_path)
+                            for f in files)
+            if jobs > 1:
+                results = parallel_fuzz(file_entries, jobs, ordered,
+                                        use_numpy, cache)
+            else:
+                results = ((file_entry,
+                            cached_fuzz(file_entry, use_numpy, cache))
+                           for file_entry in file_entries)
+            for file_entry, sigval in results:
                 output(sigval, file_entry, output_type)
-    elif os.path.isfile(file_path):
-        # Process a single file
-        sigval = fuzz_file(file_path)
-        output(sigval, file_path, output_type)
-    else:
-        # Handle an error
-        logger.error("Error - path {} not found".format(
-            file_path))
-        sys.exit(1)
+        elif os.path.isfile(file_path):
+            # Process a single file
+            sigval = cached_fuzz(file_path, use_numpy, cache)
+            output(sigval, file_path, output_type)
+        else:
+            # Handle an error
+            logger.error("Error - path {} not found".format(
+                file_path))
+            sys.exit(1)
+    finally:
+        if cache is not None:
+            cache.close()
 
 
-def fuzz_file(file_path):
+def parallel_fuzz(file_entries, jobs, ordered=True, use_numpy=False,
+                  cache=None):
     """
-    The fuzz_file function creates a fuzzy hash of a file
+    The parallel_fuzz function hashes files in a process pool.
+    Files are submitted in chunks, and only a few chunks per
+    process are queued at a time so very large directories are
+    not listed into memory up front. Cached files are looked up
+    before a chunk is submitted, so only changed files are sent to
+    the pool.
+    :param file_entries (iterable): paths of the files to hash
+    :param jobs (int): number of worker processes
+    :param ordered (bool): yield results in submission order
+        rather than as they complete
+    :param use_numpy (bool): find reset points with NumPy
+    :param cache (SignatureCache): signature cache, or None
+    :return: generator of (file path, signature) tuples
+    """
+    chunks = iter(lambda: list(itertools.islice(
+        file_entries, FILES_PER_TASK)), [])
+    with concurrent.futures.ProcessPoolExecutor(jobs) as executor:
+        def submit(chunk):
+            hits = {}
+            keys = {}
+            if cache is not None:
+                for file_entry in chunk:
+                    keys[file_entry] = cache.key(file_entry)
+                    sigval = cache.get(keys[file_entry])
+                    if sigval is not None:
+                        hits[file_entry] = sigval
+            misses = [f for f in chunk if f not in hits]
+            return (chunk, hits, keys,
+                    executor.submit(fuzz_files, misses, use_numpy))
+
+        pending = collections.deque(
+            submit(chunk)
+            for chunk in itertools.islice(chunks, jobs * TASKS_PER_JOB))
+        while pending:
+            if ordered:
+                done = [pending.popleft()]
+            else:
+                finished, _ = concurrent.futures.wait(
+                    [task[-1] for task in pending],
+                    return_when=concurrent.futures.FIRST_COMPLETED)
+                done = [task for task in pending if task[-1] in finished]
+                for task in done:
+                    pending.remove(task)
+
+            for chunk, hits, keys, future in done:
+                # Queue the next chunk before handing back results
+                for next_chunk in itertools.islice(chunks, 1):
+                    pending.append(submit(next_chunk))
+                for file_entry, sigval in future.result():
+                    if cache is not None:
+                        cache.put(keys[file_entry], sigval)
+                    hits[file_entry] = sigval
+                for file_entry in chunk:
+                    yield file_entry, hits[file_entry]
+
+
+def cached_fuzz(file_path, use_numpy=False, cache=None):
+    """
+    The cached_fuzz function returns the cached signature of a file
+    when it has not changed, and otherwise hashes and caches it
     :param file_path (str): file to read.
+    :param use_numpy (bool): find reset points with NumPy
+    :param cache (SignatureCache): signature cache, or None
     :return (str): spamsum hash
     """
+    if cache is None:
+        return fuzz_file(file_path, use_numpy)
+    key = cache.key(file_path)
+    sigval = cache.get(key)
+    if sigval is None:
+        sigval = fuzz_file(file_path, use_numpy)
+        cache.put(key, sigval)
+    return sigval
+
 
-    # Define our rolling hash function
-    def update_rolling_hash(nb, rh):
+def fuzz_files(file_entries, use_numpy=False):
+    """
+    The fuzz_files function hashes a chunk of files in a worker
+    process
+    :param file_entries (list): paths of the files to hash
+    :param use_numpy (bool): find reset points with NumPy
+    :return (list): (file path, signature) tuples
+    """
+    return [(file_entry, fuzz_file(file_entry, use_numpy))
+            for file_entry in file_entries]
+
+
+class RollingHash(object):
+    """
+    The RollingHash class tracks the spamsum rolling hash over the
+    last CONTEXT_WINDOW bytes read
+    """
+    __slots__ = ('r1', 'r2', 'r3', 'rn', 'window')
+
+    def __init__(self):
+        self.r1 = 0
+        self.r2 = 0
+        self.r3 = 0
+        self.rn = 0
+        self.window = [0] * CONTEXT_WINDOW
+
+    def update(self, new_byte):
         """
         Update the rolling hash value with the new byte
-        :param nb (int): new_byte as read from file
-        :param rh (dict): rolling hash tracking dictionary
-        :return: computed hash value to compare to reset_point
+        :param new_byte (int): byte as read from file
+        :return (int): computed hash value to compare to reset_point
+        """
+        position = self.rn % CONTEXT_WINDOW
+        self.r2 += CONTEXT_WINDOW * new_byte - self.r1
+        self.r1 += new_byte - self.window[position]
+        self.window[position] = new_byte
+        self.rn += 1
+        self.r3 = ((self.r3 << 5) & 0xFFFFFFFF) ^ new_byte
+        return (self.r1 + self.r2 + self.r3) & 0xFFFFFFFF
+
+    def update_block(self, data):
+        """
+        Update the rolling hash value with every byte of a chunk.
+        The state is held in local variables while the chunk is
+        processed and stored back once at the end
+        :param data (bytes): chunk as read from file
+        :return (list): computed hash value after each byte
+        """
+        r1 = self.r1
+        r2 = self.r2
+        r3 = self.r3
+        window = self.window
+        position = self.rn % CONTEXT_WINDOW
+        values = []
+        append = values.append
+        for new_byte in data:
+            # Calculate R2 and R1
+            r2 += CONTEXT_WINDOW * new_byte - r1
+            r1 += new_byte - window[position]
+
+            # Update the window
+            window[position] = new_byte
+            position += 1
+            if position == CONTEXT_WINDOW:
+                position = 0
+
+            # Calculate R3
+            r3 = ((r3 << 5) & 0xFFFFFFFF) ^ new_byte
+
+            # Store the sum of R1 + R2 + R3 as a 32 bit value
+            append((r1 + r2 + r3) & 0xFFFFFFFF)
+
+        self.r1 = r1
+        self.r2 = r2
+        self.r3 = r3
+        self.rn += len(values)
+        return values
+
+    @staticmethod
+    def reset_points(values, block_size):
         """
-        # Calculate R2
-        rh['r2'] -= rh['r1']
-        rh['r2'] += (CONTEXT_WINDOW * nb)
+        Find where the rolling hash reaches a reset point
+        :param values (list): hash values from update_block
+        :param block_size (int): block size to find reset points of
+        :return (list): (offset, hash value) tuples
+        """
+        return [(offset, value) for offset, value in enumerate(values)
+                if value % block_size == block_size - 1]
+
+
+class NumpyRollingHash(object):
+    """
+    The NumpyRollingHash class computes the same rolling hash as
+    RollingHash with vectorized window sums over each chunk
+    """
+    __slots__ = ('history',)
 
-        # Calculate R1
-        rh['r1'] += nb
-        rh['r1'] -= rh['rw'][rh['rn'] % CONTEXT_WINDOW]
+    def __init__(self):
+        # Bytes before the start of the file count as zeros
+        self.history = bytes(CONTEXT_WINDOW - 1)
 
-        # Update RW and RN
-        rh['rw'][rh['rn'] % CONTEXT_WINDOW] = nb
-        rh['rn'] += 1
+    def update_block(self, data):
+        """
+        Update the rolling hash value with every byte of a chunk
+        :param data (bytes): chunk as read from file
+        :return (numpy.ndarray): computed hash value after each byte
+        """
+        data = self.history + data
+        self.history = data[-(CONTEXT_WINDOW - 1):]
+        window = numpy.frombuffer(data, dtype=numpy.uint8).astype(
+            numpy.int64)
+        size = len(data) - (CONTEXT_WINDOW - 1)
+        r1 = numpy.zeros(size, dtype=numpy.int64)
+        r2 = numpy.zeros(size, dtype=numpy.int64)
+        r3 = numpy.zeros(size, dtype=numpy.int64)
+        for age in range(CONTEXT_WINDOW):
+            # The bytes read age positions before each byte
+            previous = window[CONTEXT_WINDOW - 1 - age:
+                              len(window) - age]
+            r1 += previous
+            r2 += (CONTEXT_WINDOW - age) * previous
+            r3 ^= (previous << (5 * age)) & 0xFFFFFFFF
+        return (r1 + r2 + r3) & 0xFFFFFFFF
+
+    @staticmethod
+    def reset_points(values, block_size):
+        """
+        Find where the rolling hash reaches a reset point
+        :param values (numpy.ndarray): hash values from update_block
+        :param block_size (int): block size to find reset points of
+        :return (list): (offset, hash value) tuples
+        """
+        offsets = numpy.flatnonzero(values % block_size == block_size - 1)
+        return list(zip(offsets.tolist(), values[offsets].tolist()))
 
-        # Calculate R3
-        rh['r3'] = (rh['r3'] << 5) & 0xFFFFFFFF
-        rh['r3'] = rh['r3'] ^ nb
 
-        # Return the sum of R1 + R2 + R3
-        return rh['r1'] + rh['r2'] + rh['r3']
+def fuzz_file(file_path, use_numpy=False):
+    """
+    The fuzz_file function creates a fuzzy hash of a file
+    :param file_path (str): file to read.
+    :param use_numpy (bool): find reset points with NumPy
+    :return (str): spamsum hash
+    """
 
     # Open file and get size for reset point calculation
     fsize = os.stat(file_path).st_size
     if fsize == 0:
-        logger.warning("File is 0-bytes. Skipping...")
-        return ""
+        logger.warning("File is 0-bytes")
+        return "{}::".format(MIN_BLOCK_SIZE)
     open_file = open(file_path, 'rb')
 
-    # Calculate a reset point
-    reset_point = 3
+    # Calculate the largest candidate reset point
+    reset_point = MIN_BLOCK_SIZE
     while reset_point * 64 < fsize:
         reset_point *= 2
 
-    # Setup our while loop for signature generation
-    complete_file = bytearray(open_file.read())
-    done = False
-    while not done:
-        # Initialize our hashes and signature variables
-        rolling_hash = {
-            'r1': 0,
-            'r2': 0,
-            'r3': 0,
-            'rn': 0,
-            'rw': [0 for _ in range(CONTEXT_WINDOW)]
-        }
-        trad_hash1 = HASH_INIT
-        trad_hash2 = HASH_INIT
-        sig1 = ""
-        sig2 = ""
-
-        # Start iteration over the bytearray of the file
-        for new_byte in complete_file:
-            # Calculate our rolling hash
-            rh = update_rolling_hash(new_byte, rolling_hash)
-
-            # Update our traditional hash using FNV
-            trad_hash1 = (trad_hash1 * FNV_PRIME) ^ new_byte
-            trad_hash2 = (trad_hash2 * FNV_PRIME) ^ new_byte
-
-            # Check if our rolling hash reaches a reset point
-            # If so, update sig and reset trad_hash
-            if (rh % reset_point == reset_point - 1
-                    and len(sig1) < SIGNATURE_LEN - 1):
-                sig1 += ALPHABET[trad_hash1 % 64]
-                trad_hash1 = HASH_INIT
-            if (rh % (reset_point * 2) == (reset_point * 2) - 1
-                    and len(sig2) < (SIGNATURE_LEN / 2) - 1):
-                sig2 += ALPHABET[trad_hash2 % 64]
-                trad_hash2 = HASH_INIT
-
-        # If sig1 is too short, change block size and recalculate
-        if len(sig1) < SIGNATURE_LEN / 2 and reset_point > 3:
-            reset_point = reset_point // 2
-            logger.debug("Shortening block size to {}".format(
-                reset_point))
-        else:
-            done = True
-
-        # Add any values from the tail to our hash
-        if rh != 0:
-            sig1 += ALPHABET[trad_hash1 % 64]
-            sig2 += ALPHABET[trad_hash2 % 64]
+    # Track every candidate block size, from 3 up to the reset
+    # point, so the signatures are built in a single pass
+    block_sizes = [MIN_BLOCK_SIZE]
+    while block_sizes[-1] < reset_point:
+        block_sizes.append(block_sizes[-1] * 2)
+    levels = len(block_sizes)
+    trad_hash1 = [FNV_INIT] * levels
+    trad_hash2 = [FNV_INIT] * levels
+    sig1 = [""] * levels
+    sig2 = [""] * levels
+    # Last character of each signature once it is full
+    tail1 = [""] * levels
+    tail2 = [""] * levels
+    # Smallest block size that may still be selected
+    low = 0
+
+    if use_numpy and numpy is not None:
+        rolling_hash = NumpyRollingHash()
+    else:
+        rolling_hash = RollingHash()
+
+    # Read the file in fixed-size chunks, carrying the hash state
+    # across chunk boundaries so memory use does not grow with the
+    # size of the file
+    rh = 0
+    for chunk in iter(lambda: open_file.read(READ_SIZE), b''):
+        # Calculate our rolling hash for every byte of the chunk
+        values = rolling_hash.update_block(chunk)
+        rh = int(values[-1])
+
+        # A reset point of a block size is also one of every
+        # smaller block size, so each block size only searches
+        # the reset points of the one below it
+        reset_points = rolling_hash.reset_points(
+            values, block_sizes[low])
+        offsets = {}
+        for block_size in block_sizes[low:] + [block_sizes[-1] * 2]:
+            reset_points = [(offset, value)
+                            for offset, value in reset_points
+                            if value % block_size == block_size - 1]
+            offsets[block_size] = [offset for offset, _ in reset_points]
+
+        # Work down from the largest block size, as a long enough
+        # signature rules out the smaller block sizes
+        for i in range(levels - 1, low - 1, -1):
+            block_size = block_sizes[i]
+            sig1[i], trad_hash1[i], tail1[i] = update_signature(
+                sig1[i], trad_hash1[i], tail1[i], chunk,
+                offsets[block_size], SIGNATURE_LEN - 1)
+            sig2[i], trad_hash2[i], tail2[i] = update_signature(
+                sig2[i], trad_hash2[i], tail2[i], chunk,
+                offsets[block_size * 2], (SIGNATURE_LEN // 2) - 1)
+            if len(sig1[i]) >= SIGNATURE_LEN / 2:
+                low = i
+                break
+
+    # Use the largest block size with a long enough signature
+    selected = levels - 1
+    while len(sig1[selected]) < SIGNATURE_LEN / 2 and selected > low:
+        selected -= 1
+    reset_point = block_sizes[selected]
+    logger.debug("Selected block size {}".format(reset_point))
+
+    # Add any values from the tail to our hash. When the rolling
+    # hash ends at 0, ssdeep only adds the character of a full
+    # signature's last reset point
+    sig1 = sig1[selected]
+    sig2 = sig2[selected]
+    if rh != 0:
+        sig1 += ALPHABET[trad_hash1[selected] >> 8]
+        sig2 += ALPHABET[trad_hash2[selected] >> 8]
+    else:
+        sig1 += tail1[selected]
+        sig2 += tail2[selected]
 
     # Close the file and return our new signature
     open_file.close()
     return "{}:{}:{}".format(reset_point, sig1, sig2)
 
 
+def update_signature(sig, trad_hash, tail, data, offsets, limit):
+    """
+    The update_signature function hashes the pieces of a chunk
+    between reset points with FNV, adding a character to the
+    signature at each reset point. Once the signature is full the
+    rest of the file is hashed as a single piece
+    :param sig (str): signature so far
+    :param trad_hash (int): FNV_TABLE state carried from the
+        previous chunk
+    :param tail (str): character of the last reset point since the
+        signature was full
+    :param data (bytes): chunk as read from file
+    :param offsets (list): offsets of the reset points in the chunk
+    :param limit (int): length after which the signature is full
+    :return (tuple): updated signature, FNV_TABLE state and tail
+    """
+    table = FNV_TABLE
+    start = 0
+    for offset in offsets:
+        if len(sig) >= limit:
+            # Only the last reset point of a full signature matters
+            for new_byte in data[start:offsets[-1] + 1]:
+                trad_hash = table[trad_hash | new_byte]
+            tail = ALPHABET[trad_hash >> 8]
+            start = offsets[-1] + 1
+            break
+        for new_byte in data[start:offset + 1]:
+            trad_hash = table[trad_hash | new_byte]
+        sig += ALPHABET[trad_hash >> 8]
+        trad_hash = FNV_INIT
+        start = offset + 1
+
+    # Carry the hash of the rest of the chunk to the next one
+    for new_byte in data[start:]:
+        trad_hash = table[trad_hash | new_byte]
+    return sig, trad_hash, tail
+
+
+def hash_from_file(file_path):
+    """
+    The hash_from_file function hashes a file under the name used
+    by the ssdeep module, so this module can stand in for it
+    :param file_path (str): file to read.
+    :return (str): ssdeep hash
+    """
+    return fuzz_file(file_path)
+
+
+class Signature(object):
+    """
+    The Signature class holds a parsed ssdeep hash with everything
+    compare needs precomputed: its block size, its two parts with
+    runs of identical characters cut down to 3, the set of
+    CONTEXT_WINDOW character substrings of each part and the
+    positions of each character in each part as bit masks
+    """
+    __slots__ = ('block_size', 'parts', 'ngrams', 'masks')
+
+    def __init__(self, sigval):
+        """
+        Parse an ssdeep hash
+        :param sigval (str): ssdeep hash, optionally followed by a
+            comma and a file name as in ssdeep -l output
+        """
+        try:
+            block_size, part1, part2 = sigval.split(':', 2)
+            self.block_size = int(block_size)
+        except ValueError:
+            raise ValueError("Invalid ssdeep hash: {}".format(sigval))
+        part2 = part2.split(',', 1)[0]
+        if len(part1) > SIGNATURE_LEN or len(part2) > SIGNATURE_LEN:
+            raise ValueError("Invalid ssdeep hash: {}".format(sigval))
+
+        self.parts = (eliminate_sequences(part1),
+                      eliminate_sequences(part2))
+        self.ngrams = tuple(
+            frozenset(part[i:i + CONTEXT_WINDOW]
+                      for i in range(len(part) - CONTEXT_WINDOW + 1))
+            for part in self.parts)
+        self.masks = tuple(match_masks(part) for part in self.parts)
+
+
+def eliminate_sequences(part):
+    """
+    The eliminate_sequences function cuts runs of more than 3
+    identical characters down to 3, as they carry little
+    information about the file
+    :param part (str): signature part
+    :return (str): signature part without long runs
+    """
+    result = part[:3]
+    for i in range(3, len(part)):
+        if part[i] != part[i - 1] or part[i] != part[i - 2] or \
+                part[i] != part[i - 3]:
+            result += part[i]
+    return result
+
+
+def match_masks(part):
+    """
+    The match_masks function maps each character of a signature
+    part to a bit mask of the positions it appears at
+    :param part (str): signature part
+    :return (dict): character to bit mask
+    """
+    masks = {}
+    for position, char in enumerate(part):
+        masks[char] = masks.get(char, 0) | (1 << position)
+    return masks
+
+
+@functools.lru_cache(maxsize=SIGNATURE_CACHE_SIZE)
+def parse_signature(sigval):
+    """
+    The parse_signature function parses a hash once for every
+    comparison it takes part in
+    :param sigval (str): ssdeep hash
+    :return (Signature): parsed hash
+    """
+    return Signature(sigval)
+
+
+def compare(sigval1, sigval2):
+    """
+    The compare function scores the similarity of two hashes like
+    ssdeep.compare
+    :param sigval1 (str): ssdeep hash
+    :param sigval2 (str): ssdeep hash
+    :return (int): similarity from 0 to 100
+    """
+    # Hashes of unrelated block sizes are not worth parsing
+    block_size1 = sigval1.split(':', 1)[0]
+    block_size2 = sigval2.split(':', 1)[0]
+    if block_size1 != block_size2 and block_size1.isdigit() and \
+            block_size2.isdigit():
+        block_size1 = int(block_size1)
+        block_size2 = int(block_size2)
+        if block_size1 != block_size2 * 2 and \
+                block_size2 != block_size1 * 2:
+            return 0
+    return compare_signatures(parse_signature(sigval1),
+                              parse_signature(sigval2))
+
+
+def compare_signatures(sig1, sig2):
+    """
+    The compare_signatures function scores the similarity of two
+    parsed hashes. Only parts of the same block size can be
+    compared, so the hashes must have the same block size or one
+    must be twice the other
+    :param sig1 (Signature): parsed hash
+    :param sig2 (Signature): parsed hash
+    :return (int): similarity from 0 to 100
+    """
+    if sig1.block_size == sig2.block_size:
+        if sig1.parts == sig2.parts:
+            return 100
+        return max(score_parts(sig1, 0, sig2, 0, sig1.block_size),
+                   score_parts(sig1, 1, sig2, 1, sig1.block_size * 2))
+    elif sig1.block_size == sig2.block_size * 2:
+        return score_parts(sig1, 0, sig2, 1, sig1.block_size)
+    elif sig2.block_size == sig1.block_size * 2:
+        return score_parts(sig1, 1, sig2, 0, sig2.block_size)
+    return 0
+
+
+def score_parts(sig1, part1, sig2, part2, block_size):
+    """
+    The score_parts function scores a part of each hash by their
+    edit distance, where changing a character costs as much as
+    removing it and inserting another. Parts are only scored when
+    they share a CONTEXT_WINDOW character substring
+    :param sig1 (Signature): parsed hash
+    :param part1 (int): index of the part of sig1 to score
+    :param sig2 (Signature): parsed hash
+    :param part2 (int): index of the part of sig2 to score
+    :param block_size (int): block size of the two parts
+    :return (int): similarity from 0 to 100
+    """
+    if sig1.ngrams[part1].isdisjoint(sig2.ngrams[part2]):
+        return 0
+    len1 = len(sig1.parts[part1])
+    len2 = len(sig2.parts[part2])
+
+    # Bit-parallel longest common subsequence over the positions of
+    # each character in the first part. Bits left at zero in the
+    # row mark the length of the subsequence
+    full = (1 << len1) - 1
+    masks = sig1.masks[part1]
+    row = full
+    for char in sig2.parts[part2]:
+        matches = row & masks.get(char, 0)
+        row = ((row + matches) | (row - matches)) & full
+    common = len1 - bin(row).count('1')
+    distance = len1 + len2 - 2 * common
+
+    # Scale the distance by the length of the parts and rescale it
+    # from a 0 to 100 distance into a 0 to 100 similarity
+    score = (distance * SIGNATURE_LEN) // (len1 + len2)
+    score = 100 - (100 * score) // SIGNATURE_LEN
+    if block_size >= CAP_BLOCK_SIZE:
+        return score
+    return min(score, block_size // MIN_BLOCK_SIZE * min(len1, len2))
+
+
 def output(sigval, filename, output_type='txt'):
     """Write the output of the script in the specified format
     :param sigval (str): Calculated hash
@@ -216,6 +694,17 @@ if __name__ == '__main__':
         default="txt")
     parser.add_argument('-l', help='specify log file path',
         default="./")
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+        help='Number of processes used to hash a directory.')
+    parser.add_argument('--unordered', action='store_true',
+        help='Print directory results as they complete rather '
+             'than in walk order.')
+    parser.add_argument('--numpy', action='store_true',
+        help='Find reset points with NumPy, when it is installed.')
+    parser.add_argument('--cache', nargs='?',
+        const=signature_cache.CACHE_FILE,
+        help='SQLite file to cache signatures in. Unchanged files '
+             'are not hashed again.')
 
     args = parser.parse_args()
 
@@ -241,5 +730,6 @@ if __name__ == '__main__':
     logger.debug('Version ' + sys.version.replace("\n", " "))
 
     logger.info('Script Starting')
-    main(args.PATH, args.output_type)
+    main(args.PATH, args.output_type, args.jobs, not args.unordered,
+         args.numpy, args.cache)
     logger.info('Script Completed')
@@ -0,0 +1,154 @@
+"""Persistent cache of fuzzy hash signatures."""
+import os
+import sqlite3
+import time
+
+"""
+MIT License
+Copyright (c) 2018 Chapin Bryce, Preston Miller
+Please share comments and questions at:
+  https://github.com/PythonForensics/Learning-Python-for-Forensics
+  or email pyforcookbook@gmail.com
+
+Permission is hereby granted, free of charge, to any person
+obtaining a copy of this software and associated documentation
+files (the "Software"), to deal in the Software without
+restriction, including without limitation the rights to use,
+copy, modify, merge, publish, distribute, sublicense, and/or
+sell copies of the Software, and to permit persons to whom the
+Software is furnished to do so, subject to the following
+conditions:
+
+The above copyright notice and this permission notice shall be
+included in all copies or substantial portions of the Software.
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+OTHER DEALINGS IN THE SOFTWARE.
+"""
+
+__authors__ = ["Chapin Bryce", "Preston Miller"]
+__date__ = 20181027
+__description__ = '''Cache file signatures in SQLite so unchanged
+    files are not hashed again.'''
+
+# Default cache file, used when --cache is given without a path
+CACHE_FILE = 'signature_cache.sqlite'
+
+# Eviction limits: the most recently used entries are kept, and
+# entries not used for this many seconds are dropped
+MAX_ENTRIES = 1000000
+MAX_AGE = 90 * 24 * 60 * 60
+
+# Number of new signatures stored between commits
+COMMIT_INTERVAL = 1000
+
+
+class SignatureCache(object):
+    """
+    The SignatureCache class stores the signature of each file
+    along with its device, inode, size and modification time. A
+    cached signature is only returned while all of them still
+    match the file on disk.
+    """
+
+    def __init__(self, cache_path, algorithm, max_entries=MAX_ENTRIES,
+                 max_age=MAX_AGE):
+        """
+        Open, and if needed create, the cache database
+        :param cache_path (str): path to the SQLite cache file
+        :param algorithm (str): name of the signature algorithm, so
+            one cache file can hold signatures of several tools
+        :param max_entries (int): number of entries kept on close
+        :param max_age (int): seconds an unused entry is kept
+        """
+        self.algorithm = algorithm
+        self.max_entries = max_entries
+        self.max_age = max_age
+        self.pending = 0
+        self.conn = sqlite3.connect(cache_path, timeout=30)
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS signatures ('
+            'algorithm TEXT NOT NULL, path TEXT NOT NULL, '
+            'device INTEGER, inode INTEGER, size INTEGER, '
+            'mtime_ns INTEGER, signature TEXT NOT NULL, '
+            'accessed REAL NOT NULL, PRIMARY KEY (algorithm, path))')
+        self.conn.execute(
+            'CREATE INDEX IF NOT EXISTS signatures_accessed '
+            'ON signatures (accessed)')
+        self.conn.commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    @staticmethod
+    def key(file_path):
+        """
+        Build the cache key of a file. The key should be taken
+        before the file is hashed, so a change made while hashing
+        invalidates the entry
+        :param file_path (str): path of the file
+        :return (tuple): path, device, inode, size and mtime_ns
+        """
+        file_stat = os.stat(file_path)
+        mtime_ns = getattr(file_stat, 'st_mtime_ns',
+                           int(file_stat.st_mtime * 1e9))
+        return (os.path.abspath(file_path), file_stat.st_dev,
+                file_stat.st_ino, file_stat.st_size, mtime_ns)
+
+    def get(self, key):
+        """
+        Look up the signature of a file
+        :param key (tuple): cache key from SignatureCache.key
+        :return (str): cached signature, or None if the file is not
+            cached or has changed since
+        """
+        row = self.conn.execute(
+            'SELECT signature FROM signatures WHERE algorithm = ? '
+            'AND path = ? AND device = ? AND inode = ? AND size = ? '
+            'AND mtime_ns = ?', (self.algorithm,) + key).fetchone()
+        if row is None:
+            return None
+        self.conn.execute(
+            'UPDATE signatures SET accessed = ? WHERE algorithm = ? '
+            'AND path = ?', (time.time(), self.algorithm, key[0]))
+        return row[0]
+
+    def put(self, key, signature):
+        """
+        Store the signature of a file, replacing any older entry
+        for the same path
+        :param key (tuple): cache key from SignatureCache.key
+        :param signature (str): signature of the file
+        :return: None
+        """
+        self.conn.execute(
+            'INSERT OR REPLACE INTO signatures VALUES '
+            '(?, ?, ?, ?, ?, ?, ?, ?)',
+            (self.algorithm,) + key + (signature, time.time()))
+        self.pending += 1
+        if self.pending >= COMMIT_INTERVAL:
+            self.conn.commit()
+            self.pending = 0
+
+    def close(self):
+        """
+        Evict entries older than max_age or beyond max_entries,
+        least recently used first, and close the cache
+        :return: None
+        """
+        self.conn.execute('DELETE FROM signatures WHERE accessed < ?',
+                          (time.time() - self.max_age,))
+        self.conn.execute(
+            'DELETE FROM signatures WHERE rowid IN (SELECT rowid '
+            'FROM signatures ORDER BY accessed DESC LIMIT -1 '
+            'OFFSET ?)', (self.max_entries,))
+        self.conn.commit()
+        self.conn.close()
@@ -0,0 +1,373 @@
+"""Inverted n-gram index of ssdeep signatures."""
+import argparse
+import csv
+import logging
+import os
+import re
+import sqlite3
+import sys
+
+# Fall back to the pure Python engine of fuzzy_hasher when the
+# ssdeep C extension is not installed
+try:
+    import ssdeep
+except ImportError:
+    import fuzzy_hasher as ssdeep
+
+"""
+MIT License
+Copyright (c) 2018 Chapin Bryce, Preston Miller
+Please share comments and questions at:
+  https://github.com/PythonForensics/Learning-Python-for-Forensics
+  or email pyforcookbook@gmail.com
+
+Permission is hereby granted, free of charge, to any person
+obtaining a copy of this software and associated documentation
+files (the "Software"), to deal in the Software without
+restriction, including without limitation the rights to use,
+copy, modify, merge, publish, distribute, sublicense, and/or
+sell copies of the Software, and to permit persons to whom the
+Software is furnished to do so, subject to the following
+conditions:
+
+The above copyright notice and this permission notice shall be
+included in all copies or substantial portions of the Software.
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+OTHER DEALINGS IN THE SOFTWARE.
+"""
+
+__authors__ = ["Chapin Bryce", "Preston Miller"]
+__date__ = 20181027
+__description__ = '''Build an inverted index of the 7 character
+    substrings of ssdeep signatures, and query it for similar
+    files.'''
+
+# Argument handling constants
+OUTPUT_OPTS = ['txt', 'json', 'csv']
+
+# ssdeep only scores two signature parts sharing a substring of
+# this many characters, after runs of more than 3 identical
+# characters are cut down to 3
+NGRAM_LEN = 7
+SEQUENCES = re.compile(r'(.)\1{3,}')
+
+# Number of signatures inserted per transaction while building
+BATCH_SIZE = 10000
+logger = logging.getLogger(__file__)
+
+
+def main(command, index_path, source, output_type='txt',
+         signature_list=False, threshold=0):
+    """
+    The main function builds or queries an index
+    :param command: 'build' or 'query'
+    :param index_path: path to the SQLite index file
+    :param source: path to the files to index or look up
+    :param output_type: type of output to provide for queries
+    :param signature_list: source is a signature list file rather
+        than files to hash
+    :param threshold: similarity a match must exceed
+    :return: None
+    """
+
+    # Check output formats
+    if output_type not in OUTPUT_OPTS:
+        logger.error(
+            "Unsupported output format '{}' selected. Please "
+            "use one of {}".format(
+                output_type, ", ".join(OUTPUT_OPTS)))
+        sys.exit(2)
+
+    source = os.path.abspath(source)
+    if not os.path.exists(source):
+        logger.error("Error - path {} not found".format(source))
+        sys.exit(1)
+    if signature_list:
+        signatures = read_signatures(source)
+    else:
+        signatures = hash_files(source)
+
+    index = SignatureIndex(index_path)
+    try:
+        if command == 'build':
+            count = index.add(signatures)
+            logger.info("Indexed {} signatures".format(count))
+            return
+
+        if output_type == 'csv':
+            # Special handling for CSV headers
+            print('"similarity","file","hash",'
+                  '"indexed_file","indexed_hash"')
+        for file_entry, file_hash in signatures:
+            for match, match_hash, comp_val in index.search(
+                    file_hash, threshold):
+                output(file_entry, file_hash, match, match_hash,
+                       comp_val, output_type)
+    finally:
+        index.close()
+
+
+class SignatureIndex(object):
+    """
+    The SignatureIndex class stores ssdeep signatures in SQLite,
+    along with an inverted index of the n-grams of their two parts.
+    The first part of a signature is indexed under its block size
+    and the second part under twice its block size, so a lookup
+    only returns signatures whose block sizes ssdeep can compare.
+    """
+
+    def __init__(self, index_path):
+        """
+        Open, and if needed create, an index
+        :param index_path (str): path to the SQLite index file, or
+            ':memory:' for an index that is not kept
+        """
+        self.conn = sqlite3.connect(index_path)
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS signatures ('
+            'id INTEGER PRIMARY KEY, file TEXT, hash TEXT NOT NULL)')
+        self.conn.execute(
+            'CREATE INDEX IF NOT EXISTS signatures_hash '
+            'ON signatures (hash)')
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS ngrams (key INTEGER, '
+            'id INTEGER, PRIMARY KEY (key, id)) WITHOUT ROWID')
+        self.conn.commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def add(self, signatures):
+        """
+        Add signatures to the index
+        :param signatures (iterable): (file path, ssdeep hash) tuples
+        :return (int): number of signatures added
+        """
+        count = 0
+        batch = []
+        for signature in signatures:
+            batch.append(signature)
+            if len(batch) == BATCH_SIZE:
+                count += self._add_batch(batch)
+                batch = []
+        count += self._add_batch(batch)
+        return count
+
+    def _add_batch(self, batch):
+        """
+        Add a batch of signatures in a single transaction
+        :param batch (list): (file path, ssdeep hash) tuples
+        :return (int): number of signatures added
+        """
+        with self.conn:
+            for file_entry, file_hash in batch:
+                row_id = self.conn.execute(
+                    'INSERT INTO signatures (file, hash) VALUES (?, ?)',
+                    (file_entry, file_hash)).lastrowid
+                self.conn.executemany(
+                    'INSERT OR IGNORE INTO ngrams VALUES (?, ?)',
+                    ((key, row_id) for key in ngram_keys(file_hash)))
+        return len(batch)
+
+    def candidates(self, file_hash):
+        """
+        Find the indexed signatures that ssdeep may score above 0
+        against a hash: those sharing an n-gram with it, and those
+        identical to it
+        :param file_hash (str): ssdeep hash to look up
+        :return (list): (file path, ssdeep hash) tuples
+        """
+        ids = set(row[0] for row in self.conn.execute(
+            'SELECT id FROM signatures WHERE hash = ?', (file_hash,)))
+        for chunk in self._chunks(ngram_keys(file_hash)):
+            ids.update(row[0] for row in self.conn.execute(
+                'SELECT id FROM ngrams WHERE key IN ({})'.format(
+                    ', '.join('?' * len(chunk))), chunk))
+
+        results = []
+        for chunk in self._chunks(ids):
+            results.extend(self.conn.execute(
+                'SELECT file, hash FROM signatures WHERE id IN ({}) '
+                'ORDER BY id'.format(', '.join('?' * len(chunk))),
+                chunk))
+        return results
+
+    @staticmethod
+    def _chunks(values, size=500):
+        """
+        Split query parameters into lists that stay below the SQLite
+        limit on the number of parameters of a query
+        :param values (iterable): parameters
+        :param size (int): parameters per list
+        :return: generator of lists
+        """
+        values = sorted(values)
+        for start in range(0, len(values), size):
+            yield values[start:start + size]
+
+    def search(self, file_hash, threshold=0):
+        """
+        Score a hash against its candidates
+        :param file_hash (str): ssdeep hash to look up
+        :param threshold (int): similarity a match must exceed
+        :return (list): (file path, ssdeep hash, similarity) tuples
+        """
+        matches = []
+        for file_entry, indexed_hash in self.candidates(file_hash):
+            comp_val = ssdeep.compare(file_hash, indexed_hash)
+            if comp_val > threshold:
+                matches.append((file_entry, indexed_hash, comp_val))
+        return matches
+
+    def close(self):
+        """
+        Close the index
+        :return: None
+        """
+        self.conn.close()
+
+
+def ngram_keys(file_hash):
+    """
+    The ngram_keys function lists the index keys of a hash. Each key
+    packs the bit length of the block size a part is indexed under,
+    which is unique to each ssdeep block size, above the 7 bytes of
+    an n-gram of the part
+    :param file_hash (str): ssdeep hash
+    :return (set): integer keys
+    """
+    block_size, part1, part2 = file_hash.split(':', 2)
+    block_size = int(block_size)
+    keys = set()
+    for size, part in ((block_size, part1), (block_size * 2, part2)):
+        part = SEQUENCES.sub(r'\1\1\1', part).encode('ascii')
+        bucket = size.bit_length() << (8 * NGRAM_LEN)
+        for start in range(len(part) - NGRAM_LEN + 1):
+            keys.add(bucket | int.from_bytes(
+                part[start:start + NGRAM_LEN], 'big'))
+    return keys
+
+
+def hash_files(file_path):
+    """
+    The hash_files function hashes a file, or every file in a folder
+    and its sub folders
+    :param file_path (str): path to a file or folder
+    :return: generator of (file path, ssdeep hash) tuples
+    """
+    if os.path.isfile(file_path):
+        yield file_path, ssdeep.hash_from_file(file_path)
+    else:
+        for root, _, files in os.walk(file_path):
+            for f in files:
+                file_entry = os.path.join(root, f)
+                yield file_entry, ssdeep.hash_from_file(file_entry)
+
+
+def read_signatures(list_path):
+    """
+    The read_signatures function reads a signature list in the CSV
+    format written by `ssdeep -l` or by fuzzy_hasher.py -o csv
+    :param list_path (str): path to the signature list
+    :return: generator of (file path, ssdeep hash) tuples
+    """
+    with open(list_path, newline='') as list_file:
+        for row in csv.reader(list_file):
+            if not row or row[0] == 'ssdeep':
+                # Skip blank lines and the ssdeep header
+                continue
+            if row[0].count(':') != 2 or len(row) < 2:
+                logger.warning("Skipping invalid signature of {}".format(
+                    row[-1]))
+                continue
+            yield row[1], row[0]
+
+
+def output(file_entry, file_hash, match, match_hash, comp_val,
+           output_type='txt'):
+    """Write a match in the specified format
+    :param file_entry (str): name of the file looked up
+    :param file_hash (str): hash of the file looked up
+    :param match (str): name of the indexed file
+    :param match_hash (str): hash of the indexed file
+    :param comp_val (int): similarity of the two hashes
+    :param output_type (str): Formatter to use for output
+    """
+    if output_type == 'txt':
+        msg = "{similarity} - {file_entry} {file_hash} | "
+        msg += "{match} {match_hash}"
+    elif output_type == 'json':
+        msg = '{{"similarity": {similarity}, "file": "{file_entry}", '
+        msg += '"hash": "{file_hash}", "indexed_file": "{match}", '
+        msg += '"indexed_hash": "{match_hash}"}}'
+    elif output_type == 'csv':
+        msg = '"{similarity}","{file_entry}","{file_hash}",'
+        msg += '"{match}","{match_hash}"'
+    else:
+        raise NotImplementedError(
+            "Unsupported output type: {}".format(output_type))
+
+    print(msg.format(similarity=comp_val, file_entry=file_entry,
+                     file_hash=file_hash, match=match,
+                     match_hash=match_hash))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description=__description__,
+        epilog='Built by {}. Version {}'.format(
+            ", ".join(__authors__), __date__),
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+    parser.add_argument('COMMAND', choices=['build', 'query'],
+        help='Add signatures to the index, or look them up in it')
+    parser.add_argument('INDEX', help='Path to the SQLite index file')
+    parser.add_argument('SOURCE',
+        help='Path to file or directory to hash. Will recurse '
+             'through all sub directories')
+    parser.add_argument('-s', '--signatures', action='store_true',
+        help='SOURCE is a signature list written by ssdeep -l or '
+             'fuzzy_hasher.py -o csv')
+    parser.add_argument('-t', '--threshold', type=int, default=0,
+        help='Similarity a match must exceed')
+    parser.add_argument('-o', '--output-type',
+        help='Format of output.', choices=OUTPUT_OPTS,
+        default="txt")
+    parser.add_argument('-l', help='specify log file path',
+        default="./")
+
+    args = parser.parse_args()
+
+    if args.l:
+        if not os.path.exists(args.l):
+            os.makedirs(args.l)
+        log_path = os.path.join(args.l, 'ssdeep_index.log')
+    else:
+        log_path = 'ssdeep_index.log'
+
+    logger.setLevel(logging.DEBUG)
+    msg_fmt = logging.Formatter("%(asctime)-15s %(funcName)-20s"
+                                "%(levelname)-8s %(message)s")
+    strhndl = logging.StreamHandler(sys.stderr)  # Set to stderr
+    strhndl.setFormatter(fmt=msg_fmt)
+    fhndl = logging.FileHandler(log_path, mode='a')
+    fhndl.setFormatter(fmt=msg_fmt)
+    logger.addHandler(strhndl)
+    logger.addHandler(fhndl)
+
+    logger.info('Starting SSDeep Index v. {}'.format(__date__))
+    logger.debug('System ' + sys.platform)
+    logger.debug('Version ' + sys.version.replace("\n", " "))
+
+    logger.info('Script Starting')
+    main(args.COMMAND, args.INDEX, args.SOURCE, args.output_type,
+         args.signatures, args.threshold)
+    logger.info('Script Completed')
@@ -0,0 +1,184 @@
+"""Benchmark lookups in the ssdeep n-gram index."""
+import argparse
+import os
+import random
+import shutil
+import tempfile
+import timeit
+
+# Fall back to the pure Python engine of fuzzy_hasher when the
+# ssdeep C extension is not installed
+try:
+    import ssdeep
+except ImportError:
+    import fuzzy_hasher as ssdeep
+
+import ssdeep_index
+
+"""
+MIT License
+Copyright (c) 2018 Chapin Bryce, Preston Miller
+Please share comments and questions at:
+  https://github.com/PythonForensics/Learning-Python-for-Forensics
+  or email pyforcookbook@gmail.com
+
+Permission is hereby granted, free of charge, to any person
+obtaining a copy of this software and associated documentation
+files (the "Software"), to deal in the Software without
+restriction, including without limitation the rights to use,
+copy, modify, merge, publish, distribute, sublicense, and/or
+sell copies of the Software, and to permit persons to whom the
+Software is furnished to do so, subject to the following
+conditions:
+
+The above copyright notice and this permission notice shall be
+included in all copies or substantial portions of the Software.
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+OTHER DEALINGS IN THE SOFTWARE.
+"""
+
+__authors__ = ["Chapin Bryce", "Preston Miller"]
+__date__ = 20181027
+__description__ = '''Measure how many queries per second the ssdeep
+    n-gram index answers over a synthetic signature set, compared
+    to calling ssdeep.compare on every signature.'''
+
+# Base64 Alphabet used by ssdeep signatures
+ALPHABET = 'ABCDEFGHIJKLMNOPQRSTUVWXYZ'
+ALPHABET += 'abcdefghijklmnopqrstuvwxyz0123456789+/'
+
+# Number of related signatures generated from each random one
+FAMILY_SIZE = 10
+
+
+def main(count, queries, brute_queries, index_path=None, seed=0):
+    """
+    The main function builds an index of synthetic signatures and
+    times queries against it and against a linear scan
+    :param count: number of signatures to index
+    :param queries: number of queries to time against the index
+    :param brute_queries: number of queries to time with a linear
+        scan
+    :param index_path: keep the index at this path
+    :param seed: seed for the random number generator
+    :return: None
+    """
+    rand = random.Random(seed)
+    signatures = list(generate_signatures(rand, count))
+    probes = [mutate(rand, signatures[rand.randrange(count)][1])
+              for _ in range(queries)]
+
+    temp_dir = tempfile.mkdtemp()
+    try:
+        path = os.path.join(temp_dir, 'benchmark_index.sqlite')
+        start = timeit.default_timer()
+        with ssdeep_index.SignatureIndex(path) as index:
+            index.add(signatures)
+        elapsed = timeit.default_timer() - start
+        print("Indexed {:,} signatures in {:.1f} seconds, {:.1f} "
+              "MB".format(count, elapsed,
+                          os.path.getsize(path) / 1048576.0))
+        if index_path:
+            shutil.copy(path, index_path)
+
+        with ssdeep_index.SignatureIndex(path) as index:
+            matches = 0
+            start = timeit.default_timer()
+            for probe in probes:
+                matches += len(index.search(probe))
+            elapsed_index = timeit.default_timer() - start
+            candidates = sum(len(index.candidates(probe))
+                             for probe in probes)
+    finally:
+        shutil.rmtree(temp_dir)
+
+    hashes = [file_hash for _, file_hash in signatures]
+    start = timeit.default_timer()
+    for probe in probes[:brute_queries]:
+        for file_hash in hashes:
+            ssdeep.compare(probe, file_hash)
+    elapsed_brute = timeit.default_timer() - start
+
+    print("{:<16}{:>12}{:>14}".format('Lookup', 'Queries/s',
+                                      'Compares/q'))
+    print("{:<16}{:>12,.1f}{:>14,.1f}".format(
+        'index', queries / elapsed_index, candidates / float(queries)))
+    print("{:<16}{:>12,.2f}{:>14,}".format(
+        'linear scan', min(brute_queries, queries) / elapsed_brute,
+        count))
+    print("{} matches found through the index".format(matches))
+
+
+def generate_signatures(rand, count):
+    """
+    The generate_signatures function builds synthetic ssdeep
+    signatures in families of related signatures, so queries have
+    true matches as well as unrelated signatures to skip
+    :param rand (random.Random): random number generator
+    :param count (int): number of signatures
+    :return: generator of (name, ssdeep hash) tuples
+    """
+    base = None
+    for number in range(count):
+        if number % FAMILY_SIZE == 0:
+            block_size = 3 * 2 ** rand.randint(4, 14)
+            base = "{}:{}:{}".format(
+                block_size, random_part(rand, rand.randint(20, 64)),
+                random_part(rand, rand.randint(10, 32)))
+            file_hash = base
+        else:
+            file_hash = mutate(rand, base)
+        yield "synthetic_{}".format(number), file_hash
+
+
+def random_part(rand, length):
+    """
+    Build a random signature part
+    :param rand (random.Random): random number generator
+    :param length (int): number of characters
+    :return (str): signature part
+    """
+    return ''.join(rand.choice(ALPHABET) for _ in range(length))
+
+
+def mutate(rand, file_hash):
+    """
+    Change a few characters of each part of a signature
+    :param rand (random.Random): random number generator
+    :param file_hash (str): ssdeep hash
+    :return (str): related ssdeep hash
+    """
+    block_size, part1, part2 = file_hash.split(':')
+    parts = []
+    for part in (part1, part2):
+        part = list(part)
+        for _ in range(max(1, len(part) // 8)):
+            part[rand.randrange(len(part))] = rand.choice(ALPHABET)
+        parts.append(''.join(part))
+    return "{}:{}:{}".format(block_size, parts[0], parts[1])
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description=__description__,
+        epilog='Built by {}. Version {}'.format(
+            ", ".join(__authors__), __date__),
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+    parser.add_argument('-n', '--count', type=int, default=1000000,
+        help='Number of signatures to index.')
+    parser.add_argument('-q', '--queries', type=int, default=1000,
+        help='Number of queries to time against the index.')
+    parser.add_argument('-b', '--brute-queries', type=int, default=5,
+        help='Number of queries to time with a linear scan.')
+    parser.add_argument('-k', '--keep',
+        help='Keep the generated index at this path.')
+    args = parser.parse_args()
+
+    main(args.count, args.queries, args.brute_queries, args.keep)
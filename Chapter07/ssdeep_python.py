@@ -1,10 +1,20 @@
 """Example script that uses the ssdeep python bindings."""
 import argparse
+import collections
+import itertools
 import logging
 import os
 import sys
 
-import ssdeep
+# Fall back to the pure Python engine of fuzzy_hasher when the
+# ssdeep C extension is not installed
+try:
+    import ssdeep
+except ImportError:
+    import fuzzy_hasher as ssdeep
+
+import signature_cache
+import ssdeep_index
 
 """
 MIT License
@@ -41,15 +51,25 @@ __description__ = '''Compare known file to another file or files
 
 # Argument handling constants
 OUTPUT_OPTS = ['txt', 'json', 'csv']
+
+# Similarity a pair of files must exceed to be clustered
+THRESHOLD = 0
 logger = logging.getLogger(__file__)
 
 
-def main(known_file, comparison, output_type):
+def main(known_file, comparison, output_type, cache_path=None,
+         signature_list=False, threshold=THRESHOLD):
     """
     The main function handles the main operations of the script
-    :param known_file: path to known file
+    :param known_file: path to known file, directory of known files
+        or known signature list
     :param comparison: path to look for similar files
     :param output_type: type of output to provide
+    :param cache_path: SQLite file to cache signatures in
+    :param signature_list: known_file is a signature list written by
+        ssdeep -l or fuzzy_hasher.py -o csv
+    :param threshold: similarity a match against a known directory
+        or signature list must exceed
     :return: None
     """
 
@@ -72,34 +92,189 @@ def main(known_file, comparison, output_type):
     # Generate ssdeep signature for known file
     if not os.path.exists(known_file):
         logger.error("Error - path {} not found".format(
-            comparison))
+            known_file))
         sys.exit(1)
 
-    known_hash = ssdeep.hash_from_file(known_file)
+    cache = None
+    if cache_path:
+        cache = signature_cache.SignatureCache(cache_path, 'ssdeep')
+    index = None
 
-    # Generate and test ssdeep signature for comparison file(s)
-    if os.path.isdir(comparison):
-        # Process files in folders
-        for root, _, files in os.walk(comparison):
-            for f in files:
-                file_entry = os.path.join(root, f)
-                comp_hash = ssdeep.hash_from_file(file_entry)
-                comp_val = ssdeep.compare(known_hash, comp_hash)
-                output(known_file, known_hash,
+    try:
+        if os.path.isfile(known_file) and not signature_list:
+            known_hash = hash_file(known_file, cache)
+
+            def lookup(comp_hash):
+                return [(known_file, known_hash,
+                         ssdeep.compare(known_hash, comp_hash))]
+        else:
+            # Index every known signature, so each comparison file
+            # is hashed once and only scored against known
+            # signatures sharing an n-gram with it
+            if signature_list:
+                known = ssdeep_index.read_signatures(known_file)
+            else:
+                known = ((file_entry, hash_file(file_entry, cache))
+                         for file_entry in walk_files(known_file))
+            index = ssdeep_index.SignatureIndex(':memory:')
+            logger.info("Indexed {} known signatures".format(
+                index.add(known)))
+
+            def lookup(comp_hash):
+                return index.search(comp_hash, threshold)
+
+        # Generate and test ssdeep signature for comparison file(s)
+        if not os.path.exists(comparison):
+            logger.error("Error - path {} not found".format(
+                comparison))
+            sys.exit(1)
+        for file_entry in walk_files(comparison):
+            comp_hash = hash_file(file_entry, cache)
+            for known_entry, known_hash, comp_val in lookup(comp_hash):
+                output(known_entry, known_hash,
                        file_entry, comp_hash,
                        comp_val, output_type)
+    finally:
+        if index is not None:
+            index.close()
+        if cache is not None:
+            cache.close()
 
-    elif os.path.isfile(comparison):
-        # Process a single file
-        comp_hash = ssdeep.hash_from_file(comparison)
-        comp_val = ssdeep.compare(known_hash, comp_hash)
-        output(known_file, known_hash, file_entry, comp_hash,
-               comp_val, output_type)
-    else:
-        logger.error("Error - path {} not found".format(
-            comparison))
+
+def cluster(corpus, output_type, threshold=THRESHOLD, cache_path=None):
+    """
+    The cluster function hashes every file of a corpus once, finds
+    all pairs more similar than the threshold and writes out the
+    groups of files connected by those pairs
+    :param corpus: path to the files to cluster
+    :param output_type: type of output to provide
+    :param threshold: similarity a pair must exceed
+    :param cache_path: SQLite file to cache signatures in
+    :return: None
+    """
+
+    # Check output formats
+    if output_type not in OUTPUT_OPTS:
+        logger.error(
+            "Unsupported output format '{}' selected. Please "
+            "use one of {}".format(
+                output_type, ", ".join(OUTPUT_OPTS)))
+        sys.exit(2)
+    elif output_type == 'csv':
+        # Special handling for CSV headers
+        print('"cluster","file","hash"')
+
+    corpus = os.path.abspath(corpus)
+    if not os.path.exists(corpus):
+        logger.error("Error - path {} not found".format(corpus))
         sys.exit(1)
 
+    cache = None
+    if cache_path:
+        cache = signature_cache.SignatureCache(cache_path, 'ssdeep')
+
+    try:
+        signatures = [(file_entry, hash_file(file_entry, cache))
+                      for file_entry in walk_files(corpus)]
+    finally:
+        if cache is not None:
+            cache.close()
+    logger.info("Hashed {} files".format(len(signatures)))
+
+    pairs = list(similar_pairs([h for _, h in signatures], threshold))
+    logger.info("Found {} pairs above {}".format(len(pairs), threshold))
+
+    groups = connected_components(len(signatures), pairs)
+    for number, members in enumerate(groups, 1):
+        for index in members:
+            file_entry, file_hash = signatures[index]
+            output_cluster(number, file_entry, file_hash, output_type)
+
+
+def walk_files(file_path):
+    """
+    The walk_files function lists a file, or the files in a folder
+    and all of its sub folders
+    :param file_path (str): path to a file or folder
+    :return: generator of file paths
+    """
+    if os.path.isdir(file_path):
+        for root, _, files in os.walk(file_path):
+            for f in files:
+                yield os.path.join(root, f)
+    elif os.path.isfile(file_path):
+        yield file_path
+
+
+def similar_pairs(hashes, threshold=THRESHOLD):
+    """
+    The similar_pairs function compares every pair of hashes that
+    ssdeep can score. Hashes are bucketed by block size, and only
+    hashes with equal block sizes, or block sizes a factor of 2
+    apart, are compared
+    :param hashes (list): ssdeep hashes
+    :param threshold (int): similarity a pair must exceed
+    :return: generator of (index, index, similarity) tuples
+    """
+    buckets = collections.defaultdict(list)
+    for index, file_hash in enumerate(hashes):
+        buckets[int(file_hash.split(':', 1)[0])].append(index)
+
+    for block_size, members in buckets.items():
+        larger = buckets.get(block_size * 2, [])
+        for position, i in enumerate(members):
+            for j in itertools.chain(members[position + 1:], larger):
+                comp_val = ssdeep.compare(hashes[i], hashes[j])
+                if comp_val > threshold:
+                    yield i, j, comp_val
+
+
+def connected_components(count, pairs):
+    """
+    The connected_components function groups items linked by
+    pairs, using a union-find structure
+    :param count (int): number of items
+    :param pairs (list): (index, index, similarity) tuples
+    :return (list): sorted lists of the indexes of each group of
+        two or more items, in order of their first item
+    """
+    parents = list(range(count))
+
+    def find(index):
+        while parents[index] != index:
+            parents[index] = parents[parents[index]]
+            index = parents[index]
+        return index
+
+    for i, j, _ in pairs:
+        root_i, root_j = find(i), find(j)
+        if root_i != root_j:
+            parents[max(root_i, root_j)] = min(root_i, root_j)
+
+    groups = collections.defaultdict(list)
+    for index in range(count):
+        groups[find(index)].append(index)
+    return [members for _, members in sorted(groups.items())
+            if len(members) > 1]
+
+
+def hash_file(file_path, cache=None):
+    """
+    The hash_file function returns the cached ssdeep signature of a
+    file when it has not changed, and otherwise hashes and caches it
+    :param file_path (str): file to hash
+    :param cache (SignatureCache): signature cache, or None
+    :return (str): ssdeep hash
+    """
+    if cache is None:
+        return ssdeep.hash_from_file(file_path)
+    key = cache.key(file_path)
+    file_hash = cache.get(key)
+    if file_hash is None:
+        file_hash = ssdeep.hash_from_file(file_path)
+        cache.put(key, file_hash)
+    return file_hash
+
 
 def output(known_file, known_hash, comp_file, comp_hash, comp_val,
            output_type='txt'):
@@ -118,7 +293,7 @@ def output(known_file, known_hash, comp_file, comp_hash, comp_val,
         msg += '"comparison_file": "{comp_file}", '
         msg += '"comparison_hash": "{comp_hash}"}}'
     elif output_type == 'csv':
-        msg = '"{similarity}","{known_file}","{known_hash}"'
+        msg = '"{similarity}","{known_file}","{known_hash}",'
         msg += '"{comp_file}","{comp_hash}"'
     else:
         raise NotImplementedError(
@@ -131,6 +306,27 @@ def output(known_file, known_hash, comp_file, comp_hash, comp_val,
         comp_file=comp_file,
         comp_hash=comp_hash))
 
+def output_cluster(number, file_entry, file_hash, output_type='txt'):
+    """Write a member of a cluster in the specified format
+    :param number (int): number of the cluster
+    :param file_entry (str): name of the file in the cluster
+    :param file_hash (str): ssdeep hash of the file
+    :param output_type (str): Formatter to use for output
+    """
+    if output_type == 'txt':
+        msg = "{number} - {file_entry} {file_hash}"
+    elif output_type == 'json':
+        msg = '{{"cluster": {number}, "file": "{file_entry}", '
+        msg += '"hash": "{file_hash}"}}'
+    elif output_type == 'csv':
+        msg = '"{number}","{file_entry}","{file_hash}"'
+    else:
+        raise NotImplementedError(
+            "Unsupported output type: {}".format(output_type))
+
+    print(msg.format(number=number, file_entry=file_entry,
+                     file_hash=file_hash))
+
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(
         description=__description__,
@@ -139,17 +335,37 @@ if __name__ == '__main__':
         formatter_class=argparse.ArgumentDefaultsHelpFormatter
     )
     parser.add_argument('KNOWN',
-        help='Path to known file to use to compare')
-    parser.add_argument('COMPARISON',
+        help='Path to known file or directory of known files to '
+             'use to compare, or with --cluster the file or '
+             'directory to cluster')
+    parser.add_argument('COMPARISON', nargs='?',
         help='Path to file or directory to compare to known. '
              'Will recurse through all sub directories')
+    parser.add_argument('--cluster', action='store_true',
+        help='Group the files of KNOWN by similarity instead of '
+             'comparing them to a known file')
+    parser.add_argument('-k', '--known-signatures',
+        action='store_true',
+        help='KNOWN is a signature list written by ssdeep -l or '
+             'fuzzy_hasher.py -o csv')
+    parser.add_argument('-t', '--threshold', type=int,
+        default=THRESHOLD,
+        help='Similarity a pair of files must exceed to be '
+             'clustered, or to be reported against a known '
+             'directory or signature list')
     parser.add_argument('-o', '--output-type',
         help='Format of output.', choices=OUTPUT_OPTS,
         default="txt")
     parser.add_argument('-l', help='specify log file path',
         default="./")
+    parser.add_argument('--cache', nargs='?',
+        const=signature_cache.CACHE_FILE,
+        help='SQLite file to cache signatures in. Unchanged files '
+             'are not hashed again.')
 
     args = parser.parse_args()
+    if not args.cluster and args.COMPARISON is None:
+        parser.error('COMPARISON is required unless --cluster is used')
 
     if args.l:
         if not os.path.exists(args.l):
@@ -174,5 +390,10 @@ if __name__ == '__main__':
     logger.debug('Version ' + sys.version.replace("\n", " "))
 
     logger.info('Script Starting')
-    main(args.KNOWN, args.COMPARISON, args.output_type)
+    if args.cluster:
+        cluster(args.KNOWN, args.output_type, args.threshold,
+                args.cache)
+    else:
+        main(args.KNOWN, args.COMPARISON, args.output_type,
+             args.cache, args.known_signatures, args.threshold)
     logger.info('Script Completed')
@@ -0,0 +1,516 @@
+"""Benchmark the decoding routines of the WAL crawler."""
+from __future__ import print_function
+import argparse
+import binascii
+import csv
+import multiprocessing
+import os
+import random
+import shutil
+import sqlite3
+import struct
+import sys
+import tempfile
+import timeit
+
+import wal_crawler
+
+# The resource module is only available on Unix.
+try:
+	import resource
+except ImportError:
+	resource = None
+
+"""
+MIT License
+Copyright (c) 2018 Chapin Bryce, Preston Miller
+Please share comments and questions at:
+  https://github.com/PythonForensics/Learning-Python-for-Forensics
+  or email pyforcookbook@gmail.com
+
+Permission is hereby granted, free of charge, to any person
+obtaining a copy of this software and associated documentation
+files (the "Software"), to deal in the Software without
+restriction, including without limitation the rights to use,
+copy, modify, merge, publish, distribute, sublicense, and/or
+sell copies of the Software, and to permit persons to whom the
+Software is furnished to do so, subject to the following
+conditions:
+
+The above copyright notice and this permission notice shall be
+included in all copies or substantial portions of the Software.
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+OTHER DEALINGS IN THE SOFTWARE.
+"""
+
+
+__author__ = 'Preston Miller & Chapin Bryce'
+__date__ = '20181125'
+__description__ = ('This script measures how quickly wal_crawler '
+'decodes the cells of a synthetic SQLite table leaf page, or with '
+'--suite how quickly it processes a synthetic WAL file in each of '
+'its modes.')
+
+# Modes compared by the suite, as wal_crawler.main options.
+SUITE_MODES = [('single', {}), ('mmap', {'mmap': True})]
+
+
+def main(pagesize, row_width, rowid_max, repeat):
+	"""
+	The main function builds a synthetic table leaf page and times
+	how many cells per second the cell_parser function decodes,
+	against the original single_varint, multi_varint and type_helper
+	decode as a baseline.
+	:param pagesize: The size of the synthetic page.
+	:param row_width: The length of the TEXT column in each row.
+	:param rowid_max: The largest rowid to generate.
+	:param repeat: The number of times to decode the page.
+	:return: Nothing.
+	"""
+	frame, offsets = build_leaf_page(pagesize, row_width, rowid_max)
+	print('[+] Built a {} byte page with {} cells'.format(
+	pagesize, len(offsets)))
+
+	# The original decoder sliced the frame, which was read into
+	# bytes rather than viewed through a memoryview.
+	frame_bytes = frame.tobytes()
+	decoders = [('original', lambda y, offset: original_cell_parser(
+	frame_bytes, offset)), ('cell_parser', lambda y, offset:
+	wal_crawler.cell_parser(0, y, frame, offset))]
+
+	print('{:<14}{:>10}{:>10}{:>14}'.format('Decoder', 'Cells',
+	'Seconds', 'Cells/s'))
+	rates = []
+	for name, decoder in decoders:
+		decoded = 0
+		start = timeit.default_timer()
+		for _ in range(repeat):
+			for y, offset in enumerate(offsets):
+				if decoder(y, offset):
+					decoded += 1
+		elapsed = timeit.default_timer() - start
+		rates.append(decoded / elapsed)
+		print('{:<14}{:>10}{:>10.3f}{:>14,.0f}'.format(name, decoded,
+		elapsed, rates[-1]))
+	print('[+] cell_parser is {:.1f}x the original decoder'.format(
+	rates[1] / rates[0]))
+
+
+def suite(size, pagesize, row_width, overflow_ratio, workers,
+wal_file=None):
+	"""
+	The suite function generates a WAL file with SQLite and times
+	wal_crawler.main over it in the single process, mmap and
+	multiprocess modes. Each mode runs in a fresh process, so the
+	peak resident set size is measured per mode.
+	:param size: The target size of the WAL file in megabytes.
+	:param pagesize: The page size of the database.
+	:param row_width: The maximum TEXT length of a row that does not
+	overflow.
+	:param overflow_ratio: The share of rows too large for a page.
+	:param workers: The number of processes of the multiprocess
+	mode.
+	:param wal_file: Keep the generated WAL file at this path.
+	:return: Nothing.
+	"""
+	temp_dir = tempfile.mkdtemp()
+	try:
+		wal_path = os.path.join(temp_dir, 'benchmark.wal')
+		rows = generate_wal(wal_path, size, pagesize, row_width,
+		overflow_ratio)
+		frames = int((os.path.getsize(wal_path) - 32) /
+		(pagesize + 24))
+		print('[+] Generated a {:.1f} MB WAL file with {} frames and '
+		'{} rows'.format(os.path.getsize(wal_path) / 1048576.0,
+		frames, rows))
+		if wal_file:
+			shutil.copy(wal_path, wal_file)
+
+		modes = SUITE_MODES + [('workers={}'.format(workers),
+		{'workers': workers})]
+		print('{:<12}{:>10}{:>14}{:>14}{:>12}'.format('Mode',
+		'Seconds', 'Frames/s', 'Cells/s', 'Peak MB'))
+		for name, options in modes:
+			output_dir = os.path.join(temp_dir, name)
+			os.makedirs(output_dir)
+			elapsed, peak = run_mode(wal_path, output_dir, options)
+			cells = count_cells(output_dir)
+			print('{:<12}{:>10.3f}{:>14,.0f}{:>14,.0f}{:>12}'.format(
+			name, elapsed, frames / elapsed, cells / elapsed,
+			'{:.1f}'.format(peak / 1024.0) if peak else 'n/a'))
+	finally:
+		shutil.rmtree(temp_dir)
+
+
+def generate_wal(wal_path, size, pagesize, row_width,
+overflow_ratio, seed=0):
+	"""
+	The generate_wal function inserts random rows into a SQLite
+	database in WAL mode, with automatic checkpoints disabled,
+	until the WAL reaches the target size. The WAL is copied before
+	the connection is closed, as closing checkpoints and deletes it.
+	:param wal_path: The path to copy the WAL file to.
+	:param size: The target size of the WAL file in megabytes.
+	:param pagesize: The page size of the database.
+	:param row_width: The maximum TEXT length of a row that does not
+	overflow.
+	:param overflow_ratio: The share of rows too large for a page.
+	:param seed: The seed for the random number generator.
+	:return: The number of rows inserted.
+	"""
+	rand = random.Random(seed)
+	db_path = os.path.join(os.path.dirname(wal_path), 'benchmark.db')
+	conn = sqlite3.connect(db_path)
+	try:
+		conn.execute('PRAGMA page_size = {}'.format(pagesize))
+		conn.execute('PRAGMA journal_mode = WAL')
+		conn.execute('PRAGMA wal_autocheckpoint = 0')
+		conn.execute('CREATE TABLE rows (id INTEGER PRIMARY KEY, '
+		'body TEXT, number INTEGER, real REAL, data BLOB)')
+
+		rows = 0
+		target = size * 1048576
+		while not os.path.exists(db_path + '-wal') or \
+		os.path.getsize(db_path + '-wal') < target:
+			batch = []
+			for _ in range(500):
+				if rand.random() < overflow_ratio:
+					width = rand.randint(pagesize, pagesize * 4)
+				else:
+					width = rand.randint(1, row_width)
+				batch.append(('x' * width,
+				rand.randint(-2 ** 40, 2 ** 40), rand.random(),
+				os.urandom(rand.randint(0, 16))))
+			with conn:
+				conn.executemany('INSERT INTO rows (body, number, '
+				'real, data) VALUES (?, ?, ?, ?)', batch)
+			rows += len(batch)
+
+		shutil.copy(db_path + '-wal', wal_path)
+	finally:
+		conn.close()
+	return rows
+
+
+def run_mode(wal_path, output_dir, options):
+	"""
+	The run_mode function runs wal_crawler.main in a new process.
+	:param wal_path: The path to the WAL file.
+	:param output_dir: The directory to write the CSV report to.
+	:param options: Keyword arguments for wal_crawler.main.
+	:return: A tuple of the elapsed seconds and the peak resident
+	set size in kilobytes, or None if it cannot be measured.
+	"""
+	queue = multiprocessing.Queue()
+	process = multiprocessing.Process(target=mode_worker,
+	args=(queue, wal_path, output_dir, options))
+	process.start()
+	result = queue.get()
+	process.join()
+	return result
+
+
+def mode_worker(queue, wal_path, output_dir, options):
+	"""
+	The mode_worker function times wal_crawler.main with its output
+	silenced and reports the result to the parent process. The
+	peak resident set size includes any worker processes.
+	:param queue: The queue to put the result on.
+	:param wal_path: The path to the WAL file.
+	:param output_dir: The directory to write the CSV report to.
+	:param options: Keyword arguments for wal_crawler.main.
+	:return: Nothing.
+	"""
+	sys.stdout = sys.stderr = open(os.devnull, 'w')
+	start = timeit.default_timer()
+	wal_crawler.main(wal_path, output_dir, m=False, r=None, **options)
+	elapsed = timeit.default_timer() - start
+
+	peak = None
+	if resource is not None:
+		# ru_maxrss is in kilobytes on Linux and bytes on macOS.
+		scale = 1024 if sys.platform == 'darwin' else 1
+		peak = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+		resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss) / scale
+	queue.put((elapsed, peak))
+
+
+def count_cells(output_dir):
+	"""
+	The count_cells function counts the rows of the CSV report.
+	:param output_dir: The directory of the CSV report.
+	:return: The number of cells in the report.
+	"""
+	csv.field_size_limit(sys.maxsize)
+	with open(os.path.join(output_dir, 'wal_crawler.csv'),
+	newline='', encoding='utf-8') as csvfile:
+		return sum(1 for _ in csv.reader(csvfile)) - 1
+
+
+def build_leaf_page(pagesize, row_width, rowid_max, seed=0):
+	"""
+	The build_leaf_page function packs randomly generated rows into
+	a 0x0D table leaf page, as SQLite would lay them out.
+	:param pagesize: The size of the page.
+	:param row_width: The length of the TEXT column in each row.
+	:param rowid_max: The largest rowid to generate.
+	:param seed: The seed for the random number generator.
+	:return: A memoryview of the page and a list of cell offsets.
+	"""
+	rand = random.Random(seed)
+	page = bytearray(pagesize)
+	offsets = []
+	content = pagesize
+	while True:
+		row = [None, 'x' * rand.randint(1, row_width),
+		rand.randint(-2 ** 40, 2 ** 40), rand.random(),
+		bytes(bytearray(rand.randint(0, 255)
+		for _ in range(rand.randint(0, 16))))]
+		cell = encode_cell(rand.randint(1, rowid_max), row)
+
+		# Stop once the next cell would overlap the pointer array.
+		pointers = 8 + (len(offsets) + 1) * 2
+		if content - len(cell) < pointers:
+			break
+		content -= len(cell)
+		page[content:content + len(cell)] = cell
+		offsets.append(content)
+
+	struct.pack_into('>BHHHB', page, 0, 13, 0, len(offsets),
+	content, 0)
+	for y, offset in enumerate(offsets):
+		struct.pack_into('>H', page, 8 + y * 2, offset)
+	return memoryview(bytes(page)), offsets
+
+
+def original_cell_parser(frame, cell_offset):
+	"""
+	The original_cell_parser function decodes a cell as the crawler
+	did before Varints were read in place, by slicing the frame and
+	calling original_single_varint, original_multi_varint and
+	original_type_helper. Like the original, it only reads Varints
+	of up to two bytes.
+	:param frame: The content of the page as bytes.
+	:param cell_offset: The offset of the cell within the page.
+	:return: A list of the decoded values, or None.
+	"""
+	index = 0
+	try:
+		payload_len, index_a = original_single_varint(
+		frame[cell_offset:cell_offset + 9])
+		row_id, index_b = original_single_varint(
+		frame[cell_offset + index_a: cell_offset + index_a + 9])
+	except ValueError:
+		return None
+
+	index += index_a + index_b
+	header_len = struct.unpack('>b',
+	frame[cell_offset + index: cell_offset + index + 1])[0]
+	index += 1
+	try:
+		types, index_a = original_multi_varint(
+		frame[cell_offset + index:cell_offset + index + header_len - 1])
+	except ValueError:
+		return None
+	index += index_a
+
+	diff = payload_len - header_len
+	return original_type_helper(types,
+	frame[cell_offset + index: cell_offset + index + diff])
+
+
+def original_single_varint(data, index=0):
+	"""
+	The original_single_varint function reads a Varint of one or two
+	bytes from the start of a slice.
+	:param data: The data containing the Varint.
+	:param index: The current index within the data.
+	:return: The Varint and the index following it.
+	"""
+	if ord(data[index:index + 1]) >= 128:
+		if ord(data[index + 1:index + 2]) >= 128:
+			raise ValueError
+		varint = (ord(data[index:index + 1]) - 128) * 128 + ord(
+		data[index + 1:index + 2])
+		return varint, index + 2
+	return ord(data[index:index + 1]), index + 1
+
+
+def original_multi_varint(data):
+	"""
+	The original_multi_varint function reads every Varint of a
+	slice, slicing off each one as it is read.
+	:param data: The data containing the Varints.
+	:return: A list of the Varints and their total length.
+	"""
+	varints = []
+	index = 0
+	while len(data) != 0:
+		varint, index_a = original_single_varint(data)
+		varints.append(varint)
+		index += index_a
+		data = data[index_a:]
+	return varints, index
+
+
+def original_type_helper(types, data):
+	"""
+	The original_type_helper function decodes the values of a record
+	body with an if/elif chain over the serial types.
+	:param types: The serial types of the record.
+	:param data: The record body.
+	:return: A list of the decoded values.
+	"""
+	cell_data = []
+	index = 0
+	for serial_type in types:
+		if serial_type == 0:
+			cell_data.append('NULL (RowId?)')
+		elif serial_type == 1:
+			cell_data.append(struct.unpack('>b',
+			data[index:index + 1])[0])
+			index += 1
+		elif serial_type == 2:
+			cell_data.append(struct.unpack('>h',
+			data[index:index + 2])[0])
+			index += 2
+		elif serial_type == 3:
+			cell_data.append(int(binascii.hexlify(
+			data[index:index + 3]).decode('utf-8'), 16))
+			index += 3
+		elif serial_type == 4:
+			cell_data.append(struct.unpack('>i',
+			data[index:index + 4])[0])
+			index += 4
+		elif serial_type == 5:
+			cell_data.append(int(binascii.hexlify(
+			data[index:index + 6]).decode('utf-8'), 16))
+			index += 6
+		elif serial_type == 6:
+			cell_data.append(struct.unpack('>q',
+			data[index:index + 8])[0])
+			index += 8
+		elif serial_type == 7:
+			cell_data.append(struct.unpack('>d',
+			data[index:index + 8])[0])
+			index += 8
+		elif serial_type == 8:
+			cell_data.append(0)
+		elif serial_type == 9:
+			cell_data.append(1)
+		elif serial_type > 12 and serial_type % 2 == 0:
+			b_length = int((serial_type - 12) / 2)
+			cell_data.append(data[index:index + b_length])
+			index += b_length
+		elif serial_type > 13 and serial_type % 2 == 1:
+			s_length = int((serial_type - 13) / 2)
+			cell_data.append(
+			data[index:index + s_length].decode('utf-8'))
+			index += s_length
+	return cell_data
+
+
+def encode_cell(rowid, row):
+	"""
+	The encode_cell function serialises a row into a table leaf
+	cell using the SQLite record format.
+	:param rowid: The rowid of the row.
+	:param row: A list of values for the row.
+	:return: The bytes of the cell.
+	"""
+	types = []
+	body = b''
+	for value in row:
+		if value is None:
+			types.append(0)
+		elif isinstance(value, float):
+			types.append(7)
+			body += struct.pack('>d', value)
+		elif isinstance(value, int):
+			for serial_type, width in ((1, 1), (2, 2), (3, 3),
+			(4, 4), (5, 6), (6, 8)):
+				if -(1 << (width * 8 - 1)) <= value < (
+				1 << (width * 8 - 1)):
+					break
+			types.append(serial_type)
+			body += (value & ((1 << (width * 8)) - 1)).to_bytes(
+			width, 'big')
+		elif isinstance(value, bytes):
+			types.append(12 + len(value) * 2)
+			body += value
+		else:
+			text = value.encode('utf-8')
+			types.append(13 + len(text) * 2)
+			body += text
+
+	header = b''.join(encode_varint(x) for x in types)
+	header = encode_varint(len(header) + 1) + header
+	payload = header + body
+	return encode_varint(len(payload)) + encode_varint(rowid) + payload
+
+
+def encode_varint(value):
+	"""
+	The encode_varint function encodes an integer as a SQLite
+	Varint.
+	:param value: The integer to encode.
+	:return: The bytes of the Varint.
+	"""
+	value &= 0xffffffffffffffff
+	if value >> 56:
+		# Nine byte Varints use all eight bits of the last byte.
+		data = bytearray([value & 0xff])
+		value >>= 8
+		for _ in range(8):
+			data.insert(0, (value & 0x7f) | 0x80)
+			value >>= 7
+		return bytes(data)
+
+	data = bytearray([value & 0x7f])
+	value >>= 7
+	while value:
+		data.insert(0, (value & 0x7f) | 0x80)
+		value >>= 7
+	return bytes(data)
+
+
+if __name__ == '__main__':
+
+	parser = argparse.ArgumentParser(description=__description__,
+									 epilog='Developed by ' +
+									 __author__ + ' on ' +
+									 __date__)
+	parser.add_argument('-p', '--pagesize', help='Page size',
+	type=int, default=4096)
+	parser.add_argument('-w', '--row-width', help='Maximum TEXT '
+	'length of each row', type=int, default=64)
+	parser.add_argument('--rowid-max', help='Largest rowid to '
+	'generate', type=int, default=16383)
+	parser.add_argument('-n', '--repeat', help='Number of times to '
+	'decode the page', type=int, default=2000)
+	parser.add_argument('--suite', help='Generate a WAL file with '
+	'SQLite and time each wal_crawler mode over it',
+	action='store_true')
+	parser.add_argument('-s', '--size', help='Size of the generated '
+	'WAL file in megabytes', type=float, default=16)
+	parser.add_argument('-o', '--overflow-ratio', help='Share of rows '
+	'that overflow their page', type=float, default=0.05)
+	parser.add_argument('--workers', help='Number of processes of '
+	'the multiprocess mode', type=int,
+	default=multiprocessing.cpu_count())
+	parser.add_argument('--keep', help='Keep the generated WAL file '
+	'at this path')
+	args = parser.parse_args()
+
+	if args.suite:
+		suite(args.size, args.pagesize, args.row_width,
+		args.overflow_ratio, args.workers, args.keep)
+	else:
+		main(args.pagesize, args.row_width, args.rowid_max,
+		args.repeat)
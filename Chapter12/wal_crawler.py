@@ -2,18 +2,33 @@
 from __future__ import print_function
 import argparse
 import binascii
+import bisect
+import hashlib
+import json
 import logging
+import mmap
+import multiprocessing
 import os
 import re
+import sqlite3
 import struct
 import sys
+import time
 from collections import namedtuple
 if sys.version_info[0] == 2:
 	import unicodecsv as csv
 elif sys.version_info[0] == 3:
 	import csv
 
-from tqdm import trange
+from tqdm import tqdm, trange
+
+# pyarrow is only needed for Parquet and Arrow output.
+try:
+	import pyarrow
+	import pyarrow.ipc
+	import pyarrow.parquet
+except ImportError:
+	pyarrow = None
 
 """
 MIT License
@@ -51,179 +66,1576 @@ __description__ = ('This scripts processes SQLite '
 'contain deleted records or records that have not yet been added '
 'to the main database.')
 
+# Number of frames parsed by a worker process at a time.
+FRAMES_PER_TASK = 256
+
+# Number of cells buffered before a batch is written to columnar
+# output.
+BATCH_SIZE = 65536
+
+# Precompiled structs for the fixed-width serial types.
+INT8 = struct.Struct('>b')
+INT16 = struct.Struct('>h')
+INT32 = struct.Struct('>i')
+INT64 = struct.Struct('>q')
+FLOAT64 = struct.Struct('>d')
+UINT16 = struct.Struct('>H')
+UINT32 = struct.Struct('>I')
+PAGE_HEADER = struct.Struct('>BHHHB')
+FREEBLOCK = struct.Struct('>HH')
+WAL_CHECKSUM = struct.Struct('>II')
+
+# Size of the b-tree page header of each page type. Interior pages
+# store the right-most child page number after the leaf header.
+PAGE_HEADER_SIZES = {2: 12, 5: 12, 10: 8, 13: 8}
+
+# Carving pre-filter. A record header begins with its length, so
+# only bytes that are plausible header lengths are tried as the
+# start of a deleted record. Runs of zeros and text are skipped by
+# the regular expression engine without entering Python.
+CARVE_CANDIDATES = re.compile(b'[\x02-\x3f]')
+
+# Frame lookup table shared with worker processes by the pool
+# initializer, so it is not pickled with every task.
+WORKER_INDEX = None
+
+# Name of the file recording the last frame processed by an
+# incremental run, written to the output directory.
+CHECKPOINT_FILE = 'wal_crawler_checkpoint.json'
+CHECKPOINT_VERSION = 2
+
+# Name of the schema and page ownership cache written to the output
+# directory by the database correlation mode.
+SCHEMA_CACHE = 'wal_crawler_schema.json'
+SCHEMA_CACHE_VERSION = 2
+
+# Structs for the words covered by WAL checksums, keyed by length
+# and byte order.
+CHECKSUM_STRUCTS = {}
+
+# Width and decoder of the fixed-size serial types, indexed by
+# serial type. Each decoder returns a one item tuple, as
+# Struct.unpack_from does. Struct does not support 24-bit or 48-bit
+# integers so they are read with int.from_bytes. Types 8 and 9 are
+# the constants 0 and 1 and take up no space, while 10 and 11 are
+# reserved.
+SERIAL_TYPES = [
+	(0, lambda data, index: (None,)),
+	(1, INT8.unpack_from),
+	(2, INT16.unpack_from),
+	(3, lambda data, index: (int.from_bytes(
+	data[index:index + 3], 'big', signed=True),)),
+	(4, INT32.unpack_from),
+	(6, lambda data, index: (int.from_bytes(
+	data[index:index + 6], 'big', signed=True),)),
+	(8, INT64.unpack_from),
+	(8, FLOAT64.unpack_from),
+	(0, lambda data, index: (0,)),
+	(0, lambda data, index: (1,)),
+	(0, None),
+	(0, None)]
+
 
 def main(wal_file, output_dir, **kwargs):
 	"""
-	The main function parses the header of the input file and
-	identifies the WAL file. It then splits the file into the
-	appropriate frames and send them for processing. After
-	processing, if applicable, the regular expression modules are
-	ran. Finally the raw data output is written to a CSV file.
+	The main function crawls the WAL file once or, in follow mode,
+	polls it and crawls the frames appended since the last pass
+	until interrupted. The checkpoint and frame lookup table are
+	kept between polls, so each poll only reads the new frames.
 	:param wal_file: The filepath to the WAL file to be processed
-	:param output_dir: The directory to write the CSV report to.
+	:param output_dir: The directory to write the report to.
+	:param kwargs: The crawl options, plus 'follow' to poll the WAL
+	file every 'interval' seconds.
+	:return: Nothing.
+	"""
+	if not kwargs.get('follow'):
+		crawl(wal_file, output_dir, **kwargs)
+		return
+
+	msg = 'Following {}, press Ctrl+C to stop'.format(wal_file)
+	print('[+]', msg)
+	logging.info(msg)
+	kwargs['incremental'] = True
+	kwargs['state'] = {}
+	try:
+		while True:
+			crawl(wal_file, output_dir, **kwargs)
+			time.sleep(kwargs.get('interval') or 2)
+	except KeyboardInterrupt:
+		print('[+] Stopped following', wal_file)
+
+
+def crawl(wal_file, output_dir, **kwargs):
+	"""
+	The crawl function builds a record generator over the input WAL
+	file. If applicable, the records are passed through the regular
+	expression module as they are produced. Finally the records are
+	streamed to a CSV file, or written in batches to columnar
+	output, so only a bounded number of cells is held in memory.
+	:param wal_file: The filepath to the WAL file to be processed
+	:param output_dir: The directory to write the report to.
+	:param kwargs: Options; 'mmap' memory-maps the WAL file
+	instead of reading each frame, 'workers' sets the number
+	of processes used to parse frames, 'validate' tags or skips
+	frames that fail checksum and salt validation, 'dedup'
+	limits the output to the latest or changed page versions,
+	'db' names the main database used to label records with their
+	table and column names, 'carve' recovers deleted records
+	from the free space of each page, 'format' selects csv,
+	parquet, arrow or sqlite output and 'incremental' only parses
+	the frames appended since the checkpoint of the previous run and
+	appends their records to the CSV reports. In follow mode 'state'
+	carries the checkpoint and frame lookup table between polls.
+	:return: Nothing.
+	"""
+	validate = kwargs.get('validate')
+	dedup = kwargs.get('dedup')
+	carve = kwargs.get('carve', True)
+	incremental = kwargs.get('incremental', False)
+	start = 0
+	end = None
+	index = None
+	if incremental:
+		state = kwargs.get('state')
+		if state is None:
+			state = {}
+		checkpoint = state.get('checkpoint')
+		if checkpoint is None:
+			checkpoint = load_checkpoint(wal_file, output_dir)
+		start, end, checkpoint = resume_checkpoint(wal_file,
+		checkpoint)
+
+		# The lookup table of the previous poll is extended from the
+		# first frame to parse, which is 0 if the WAL was restarted.
+		index = state.get('index')
+		if index is None:
+			index = state['index'] = {'pages': {}, 'commit_end': [],
+			'reserved': 0}
+		if start >= end:
+			logging.debug('No new frames after frame {}'.format(end))
+			save_checkpoint(output_dir, checkpoint)
+			state['checkpoint'] = checkpoint
+			return
+
+	records = iter_wal_records(wal_file, kwargs.get('mmap', False),
+	kwargs.get('workers', 1), validate, dedup, carve, start, end,
+	index)
+
+	# Map each page to the table that owns it in the main database.
+	tables = None
+	if kwargs.get('db'):
+		schema = schema_index(kwargs['db'], wal_file, output_dir)
+		tables = schema['tables']
+		records = correlate_records(records, schema)
+
+	# Run regular expression functions inline on the record stream.
+	if kwargs['m'] or kwargs['r']:
+		records = regular_search(records, kwargs, output_dir, tables,
+		incremental)
+
+	# Write WAL data to CSV file or columnar output.
+	extra_columns = []
+	if carve:
+		extra_columns.append(('Carved', 'carved'))
+	if validate == 'tag':
+		extra_columns.append(('Status', 'status'))
+	if dedup == 'diff':
+		extra_columns.append(('Change', 'change'))
+	output_format = kwargs.get('format') or 'csv'
+	if output_format == 'csv':
+		csv_writer(records, output_dir, extra_columns, tables,
+		incremental)
+	else:
+		columnar_writer(records, output_dir, extra_columns, tables,
+		output_format)
+
+	# The checkpoint is only saved once every record is written.
+	if incremental:
+		save_checkpoint(output_dir, checkpoint)
+		state['checkpoint'] = checkpoint
+
+
+def load_checkpoint(wal_file, output_dir):
+	"""
+	The load_checkpoint function reads the checkpoint of the last
+	incremental run of the WAL file.
+	:param wal_file: The filepath to the WAL file to be processed
+	:param output_dir: The directory of the checkpoint file.
+	:return: The checkpoint dictionary or None.
+	"""
+	checkpoint_file = os.path.join(output_dir, CHECKPOINT_FILE)
+	if not os.path.exists(checkpoint_file):
+		return None
+	try:
+		with open(checkpoint_file) as checkpoint_json:
+			checkpoint = json.load(checkpoint_json)
+	except ValueError:
+		logging.warning('Ignoring unreadable checkpoint file')
+		return None
+
+	if checkpoint.get('wal') != os.path.abspath(wal_file) or \
+	checkpoint.get('version') != CHECKPOINT_VERSION:
+		return None
+	return checkpoint
+
+
+def save_checkpoint(output_dir, checkpoint):
+	"""
+	The save_checkpoint function writes the checkpoint returned by
+	resume_checkpoint.
+	:param output_dir: The directory of the checkpoint file.
+	:param checkpoint: The checkpoint dictionary.
 	:return: Nothing.
 	"""
+	with open(os.path.join(output_dir, CHECKPOINT_FILE),
+	'w') as checkpoint_json:
+		json.dump(checkpoint, checkpoint_json)
+
+
+def resume_checkpoint(wal_file, checkpoint):
+	"""
+	The resume_checkpoint function decides which frames an
+	incremental run parses. SQLite restarts the WAL at frame 0 with
+	new salts without truncating the file, so the checkpoint is the
+	end of the current generation: the frames with the salts of the
+	header and an unbroken checksum chain. A run resumes after the
+	checkpoint frame if it still holds the same salts and cumulative
+	checksum, and checksums only the frames after it. Otherwise the
+	WAL was restarted and the current generation is parsed from
+	frame 0. Frames beyond the generation were parsed by the run
+	that wrote them, except on the first run, which parses every
+	frame in the file.
+	:param wal_file: The filepath to the WAL file to be processed
+	:param checkpoint: The checkpoint of the previous run or None.
+	:return: The first frame to parse, the number of frames to
+	consider and the new checkpoint.
+	"""
+	with open(wal_file, 'rb') as wal:
+		header = wal.read(32)
+		pagesize = header_parser(header)['pagesize']
+		frames = int((os.path.getsize(wal_file) - 32) / (pagesize + 24))
+		salts = binascii.hexlify(header[16:24]).decode('utf-8')
+		big_endian = UINT32.unpack_from(header)[0] & 1
+
+		# SQLite ignores every frame of a WAL with an invalid header
+		# checksum, so the current generation is empty.
+		start = 0
+		running = WAL_CHECKSUM.unpack_from(header, 24)
+		chain = frames
+		if wal_checksum(checksum_struct(24, big_endian), header,
+		(0, 0)) != running:
+			chain = 0
+		if checkpoint is not None:
+			last = checkpoint['frames'] - 1
+			resumed = checkpoint['salts'] == salts
+			if resumed and last >= 0:
+				wal.seek(32 + last * (pagesize + 24) + 8)
+				frame_header = wal.read(16)
+				resumed = len(frame_header) == 16 and \
+				frame_header[:8] == header[16:24] and list(
+				WAL_CHECKSUM.unpack_from(frame_header, 8)) == \
+				checkpoint['checksum']
+			if resumed:
+				start = last + 1
+				running = tuple(checkpoint['checksum'])
+			else:
+				msg = ('WAL file was reset since the last run, parsing '
+				'the current generation from frame 0')
+				print('[+]', msg)
+				logging.info(msg)
+
+		# Extend the checksum chain over the frames after the
+		# checkpoint.
+		page_words = checksum_struct(pagesize, big_endian)
+		frame_words = checksum_struct(8, big_endian)
+		end = start
+		wal.seek(32 + start * (pagesize + 24))
+		for x in range(start, chain):
+			frame_header = wal.read(24)
+			frame = wal.read(pagesize)
+			if frame_header[8:16] != header[16:24]:
+				break
+			checksum = wal_checksum(page_words, frame,
+			wal_checksum(frame_words, frame_header, running))
+			if checksum != WAL_CHECKSUM.unpack_from(frame_header, 16):
+				break
+			running = checksum
+			end = x + 1
+
+	new_checkpoint = {'version': CHECKPOINT_VERSION,
+	'wal': os.path.abspath(wal_file), 'salts': salts, 'frames': end,
+	'checksum': list(running)}
+	if checkpoint is None:
+		return start, frames, new_checkpoint
+	return start, end, new_checkpoint
+
+
+def iter_wal_records(wal_file, use_mmap=False, workers=1,
+validate=None, dedup=None, carve=True, start=0, end=None,
+index=None):
+	"""
+	The iter_wal_records function parses the header of the input
+	file and identifies the WAL file. It then splits the file into
+	the appropriate frames and yields one flat record for every
+	recovered cell, without retaining earlier frames.
+	:param wal_file: The filepath to the WAL file to be processed
+	:param use_mmap: Memory-map the WAL file instead of reading
+	each frame.
+	:param workers: The number of processes used to parse frames.
+	:param validate: None to parse every frame, 'tag' to add the
+	checksum status of the frame to each record, or 'skip' to only
+	parse valid, committed frames.
+	:param dedup: None to parse every version of a page, 'latest'
+	to only parse the latest committed version of each page in a
+	checkpoint generation, or 'diff' to only emit cells that were
+	added, modified or removed since the previous version.
+	:param carve: Recover deleted records from the freeblocks and
+	unallocated space of table leaf pages.
+	:param start: The first frame to parse.
+	:param end: The number of frames to consider, by default every
+	complete frame in the file.
+	:param index: A frame lookup table from an earlier pass, which
+	is extended from the start frame instead of being rebuilt.
+	:return: A generator of dictionaries containing the frame,
+	page, salt-1, salt-2, frame_offset, cell, cell_offset, rowid
+	and data of each cell.
+	"""
 	msg = 'Identifying and parsing file header'
 	print('[+]', msg)
 	logging.info(msg)
 
-	wal_attributes = {'size': os.path.getsize(wal_file),
-	'header': {}, 'frames': {}}
+	size = os.path.getsize(wal_file)
 	with open(wal_file, 'rb') as wal:
 
 		# Parse 32-byte WAL header.
-		header = wal.read(32)
+		header = header_parser(wal.read(32))
+
+	logging.info('File signature matched.')
+	logging.info('Processing WAL file.')
+
+	# Calculate number of frames.
+	pagesize = header['pagesize']
+	frames = int((size - 32) / (pagesize + 24))
+	if end is not None:
+		frames = min(frames, end)
+	print('[+] Identified', frames, 'Frames.')
+
+	frame_numbers = range(start, frames)
+	if start:
+		print('[+] Resuming at frame', start)
+	statuses = None
+	if validate:
+		msg = 'Verifying frame checksums'
+		print('[+]', msg)
+		logging.info(msg)
+		statuses, commits = checksum_index(wal_file, pagesize, frames)
+		print('[+] Identified', len(commits), 'valid commit frames.')
+		if validate == 'skip':
+			frame_numbers = [x for x in frame_numbers
+			if statuses[x] == 'valid']
+
+	if dedup:
+		msg = 'Indexing page versions'
+		print('[+]', msg)
+		logging.info(msg)
+		pages = page_index(wal_file, pagesize, frames, statuses)
+		if dedup == 'latest':
+			selected = set(pages['latest'])
+		else:
+			selected = set(pages['changed'])
+		frame_numbers = [x for x in frame_numbers if x in selected]
+		print('[+] Selected', len(frame_numbers), 'of', frames,
+		'frames.')
+
+	# Overflow pages are looked up by page number in a table built
+	# from the frame headers.
+	index = frame_index(wal_file, pagesize, frames, start, index)
+
+	print('[+] Processing frames...')
+	records = parse_frames(wal_file, pagesize, frame_numbers,
+	use_mmap, workers, index, carve)
+	if dedup == 'diff':
+		records = diff_records(records, frame_numbers,
+		pages['keys'])
+
+	for record in records:
+		if statuses is not None:
+			record['status'] = statuses[record['frame']]
+		yield record
+
+
+def parse_frames(wal_file, pagesize, frame_numbers, use_mmap=False,
+workers=1, index=None, carve=True):
+	"""
+	The parse_frames function parses the requested frames. Frames
+	have a fixed size, so with more than one worker the frames are
+	split into slices that are parsed by a process pool and merged
+	back in frame order.
+	:param wal_file: The filepath to the WAL file to be processed
+	:param pagesize: The page size from the WAL header.
+	:param frame_numbers: A list or range of the frames to parse.
+	:param use_mmap: Memory-map the WAL file instead of reading
+	each frame.
+	:param workers: The number of processes used to parse frames.
+	:param index: The frame lookup table from frame_index, used to
+	follow overflow chains.
+	:param carve: Recover deleted records from free space.
+	:return: A generator of cell records.
+	"""
+	if workers > 1:
+		# Each task opens the WAL itself and parses one slice of
+		# frames. Pool.imap returns the slices in submission order.
+		tasks = [(wal_file, pagesize,
+		frame_numbers[start:start + FRAMES_PER_TASK], use_mmap, carve)
+		for start in range(0, len(frame_numbers), FRAMES_PER_TASK)]
+		pool = multiprocessing.Pool(workers, initializer=worker_init,
+		initargs=(index,))
+		try:
+			for records in tqdm(pool.imap(frame_range_worker, tasks),
+			total=len(tasks)):
+				for record in records:
+					yield record
+		finally:
+			pool.terminate()
+			pool.join()
+
+	else:
+		for record in frame_range_parser(wal_file, pagesize,
+		tqdm(frame_numbers), use_mmap, index, carve):
+			yield record
+
+
+def frame_index(wal_file, pagesize, frames, start=0, index=None):
+	"""
+	The frame_index function builds a lookup table of the frames
+	holding each page, keyed by the salts of the checkpoint
+	generation and the page number. A page referenced by a frame is
+	read from the latest version of it written up to the end of the
+	frame's transaction. An existing table is updated in place,
+	re-reading the frames from the start frame on, as they may have
+	been overwritten since.
+	:param wal_file: The filepath to the WAL file to be processed
+	:param pagesize: The page size from the WAL header.
+	:param frames: The number of frames in the WAL file.
+	:param start: The first frame that may have changed.
+	:param index: The lookup table to update, or None.
+	:return: A dictionary with the frames of each page ('pages'),
+	the last frame of the transaction of each frame ('commit_end')
+	and the number of reserved bytes at the end of each page
+	('reserved').
+	"""
+	if index is None:
+		index = {'pages': {}, 'commit_end': [], 'reserved': 0}
+	pages = index['pages']
+	reserved = index['reserved']
+
+	# Frames are appended in order, so the entries of the frames
+	# being re-read are at the end of each list.
+	if start < len(index['commit_end']):
+		for key in list(pages):
+			versions = pages[key]
+			del versions[bisect.bisect_left(versions, start):]
+			if not versions:
+				del pages[key]
+	start = min(start, len(index['commit_end']))
+
+	commits = []
+	with open(wal_file, 'rb') as wal:
+		for x in range(start, frames):
+			frame_offset = 32 + (x * (pagesize + 24))
+			wal.seek(frame_offset)
+			frame_header = wal.read(24)
+			pagenumber, commit = WAL_CHECKSUM.unpack_from(frame_header)
+			pages.setdefault((frame_header[8:16], pagenumber),
+			[]).append(x)
+			commits.append(commit)
+
+			# The reserved space size is stored in the database
+			# header on page 1.
+			if pagenumber == 1:
+				wal.seek(frame_offset + 24 + 20)
+				reserved = bytearray(wal.read(1) or b'\0')[0]
+
+	commit_end = index['commit_end']
+	del commit_end[start:]
+	commit_end.extend([0] * (frames - start))
+	end = frames - 1
+	for x in range(frames - 1, start - 1, -1):
+		if commits[x - start]:
+			end = x
+		commit_end[x] = end
+
+	index['reserved'] = reserved
+	return index
+
+
+def page_index(wal_file, pagesize, frames, statuses=None):
+	"""
+	The page_index function indexes the frames holding each version
+	of a database page. Pages are keyed by their page number and
+	the salts of the checkpoint generation they were written in.
+	:param wal_file: The filepath to the WAL file to be processed
+	:param pagesize: The page size from the WAL header.
+	:param frames: The number of frames in the WAL file.
+	:param statuses: The frame statuses from checksum_index, used
+	to decide which frames are committed when available.
+	:return: A dictionary with the page key of each frame ('keys'),
+	the latest committed frame of each page ('latest') and the
+	frames whose content differs from the previous version of the
+	page ('changed').
+	"""
+	keys = []
+	digests = {}
+	changed = []
+	last_commit = {}
+	with open(wal_file, 'rb') as wal:
+		wal.seek(32)
+		for x in range(frames):
+			frame_header = wal.read(24)
+			frame = wal.read(pagesize)
+			pagenumber, commit = WAL_CHECKSUM.unpack_from(frame_header)
+			key = (pagenumber, frame_header[8:16])
+			keys.append(key)
+			if commit:
+				last_commit[key[1]] = x
+
+			# Identical copies of a page do not need to be parsed
+			# again.
+			digest = hashlib.sha1(frame).digest()
+			if digests.get(key) != digest:
+				changed.append(x)
+				digests[key] = digest
+
+	# Without checksum statuses a frame is committed when a commit
+	# frame from the same generation follows it.
+	latest = {}
+	for x, key in enumerate(keys):
+		if statuses is not None:
+			committed = statuses[x] == 'valid'
+		else:
+			committed = x <= last_commit.get(key[1], -1)
+		if committed:
+			latest[key] = x
+
+	return {'keys': keys, 'latest': sorted(latest.values()),
+	'changed': changed}
 
-		# If file is less than 32 bytes long: exit wal_crawler.
+
+def diff_records(records, frame_numbers, keys):
+	"""
+	The diff_records function compares the cells of each page
+	version with the previous version of the same page and emits
+	only the differences. Records are tagged as 'added', 'modified'
+	or 'removed', with removed records taken from the previous
+	version. Carved records are keyed by their offset on the page
+	so a deleted copy never stands in for the live record.
+	:param records: The records of the frames, in frame order.
+	:param frame_numbers: The frames that were parsed.
+	:param keys: The page key of each frame from page_index.
+	:return: A generator of the changed records.
+	"""
+	previous = {}
+	records = iter(records)
+	pending = next(records, None)
+	for x in frame_numbers:
+		# Collect the cells of this frame, keyed by rowid. Index
+		# cells have no rowid and are keyed by their content.
+		current = {}
+		while pending is not None and pending['frame'] == x:
+			key = pending['rowid']
+			if pending['carved']:
+				key = ('carved', pending['cell_offset'] -
+				pending['frame_offset'])
+			elif key is None:
+				key = tuple(pending['data'])
+			current[key] = pending
+			pending = next(records, None)
+
+		before = previous.get(keys[x], {})
+		for rowid, record in current.items():
+			if rowid not in before:
+				record['change'] = 'added'
+				yield record
+			elif before[rowid]['data'] != record['data']:
+				record['change'] = 'modified'
+				yield record
+		for rowid, record in before.items():
+			if rowid not in current:
+				removed = dict(record)
+				removed['change'] = 'removed'
+				yield removed
+		previous[keys[x]] = current
+
+
+def schema_index(db_file, wal_file, output_dir):
+	"""
+	The schema_index function reads the schema of the main database
+	and maps every page of its b-trees to the table or index that
+	owns it. Pages, including those of sqlite_master, are read from
+	the current generation of the WAL when it holds a newer copy
+	than the database, so objects created since the last checkpoint
+	are found. The database file is only read, never opened with
+	SQLite. The result is
+	cached in the output directory and reused while neither the
+	database nor the WAL file changes.
+	:param db_file: The filepath to the main database file.
+	:param wal_file: The filepath to the WAL file to be processed
+	:param output_dir: The directory to write the cache to.
+	:return: A dictionary with the column names and rowid alias
+	column of each table and index ('tables') and the owner of each
+	page number ('pages').
+	"""
+	db_stat = os.stat(db_file)
+	wal_stat = os.stat(wal_file)
+	key = [SCHEMA_CACHE_VERSION, os.path.abspath(db_file),
+	db_stat.st_size, db_stat.st_mtime_ns, os.path.abspath(wal_file),
+	wal_stat.st_size, wal_stat.st_mtime_ns]
+
+	cache_file = os.path.join(output_dir, SCHEMA_CACHE)
+	if os.path.exists(cache_file):
 		try:
-			wal_attributes['header'] = dict_helper(header,'>4s7i',
-			namedtuple('struct',
-			'magic format pagesize checkpoint '
-			'salt1 salt2 checksum1 checksum2'))
-		except struct.error as e:
-			logging.error('STRUCT ERROR:', e.message)
-			print('[-]', e.message + '. Exiting..')
-			sys.exit(2)
-
-		# Do not proceed in the program if the input file is not a
-		# WAL file.
-		magic_hex = binascii.hexlify(
-		wal_attributes['header']['magic']).decode('utf-8')
-		if magic_hex != "377f0682" and magic_hex != "377f0683":
-			logging.error(('Magic mismatch, expected 0x377f0682 '
-			'or 0x377f0683 | received {}'.format(magic_hex)))
-			print(('[-] File does not have appropriate signature '
-			'for WAL file. Exiting...'))
-			sys.exit(3)
-
-		logging.info('File signature matched.')
-		logging.info('Processing WAL file.')
-
-		# Calculate number of frames.
-		frames = int((
-		wal_attributes['size'] - 32) / (
-		wal_attributes['header']['pagesize'] + 24))
-		print('[+] Identified', frames, 'Frames.')
-
-		# Parse frames in WAL file. Create progress bar using
-		# trange(frames) which is an alias for tqdm(xrange(frames)).
-		print('[+] Processing frames...')
-		for x in trange(frames):
-
-			# Parse 24-byte WAL frame header.
-			wal_attributes['frames'][x] = {}
+			with open(cache_file) as cache:
+				cached = json.load(cache)
+		except ValueError:
+			cached = {}
+		if cached.get('key') == key:
+			msg = 'Loaded database schema from {}'.format(cache_file)
+			print('[+]', msg)
+			logging.info(msg)
+			return {'tables': cached['tables'],
+			'pages': {int(page): name
+			for page, name in cached['pages'].items()}}
+
+	msg = 'Reading database schema and page ownership'
+	print('[+]', msg)
+	logging.info(msg)
+
+	# sqlite_master is replayed from the latest copies of its pages,
+	# so tables and indexes created since the last checkpoint are
+	# labelled too. Its SQL is then loaded into an in-memory
+	# database to look up the columns of each table and index.
+	with open(wal_file, 'rb') as wal, open(db_file, 'rb') as db:
+		if db.read(16) not in (b'SQLite format 3\0', b''):
+			logging.error('Could not read database schema: {} is '
+			'not a SQLite database'.format(db_file))
+			print('[-] Could not read database schema: not a SQLite '
+			'database')
+			sys.exit(4)
+		read_page, usable = page_reader(db, wal)
+		master = master_rows(read_page, usable)
+		roots = [('sqlite_master', 1)] + [(name, rootpage)
+		for obj_type, name, rootpage, sql in master]
+		pages = btree_pages(read_page, roots)
+
+	tables = {'sqlite_master': {'columns': ['type', 'name',
+	'tbl_name', 'rootpage', 'sql'], 'rowid_column': None}}
+	conn = sqlite3.connect(':memory:')
+	try:
+		for kind in ('table', 'index'):
+			for obj_type, name, rootpage, sql in master:
+				if obj_type != kind:
+					continue
+				try:
+					# Automatic indexes have no SQL and are created
+					# along with their table.
+					if sql:
+						conn.execute(sql)
+					if kind == 'table':
+						tables[name] = table_columns(conn, name)
+					else:
+						tables[name] = index_columns(conn, name)
+				except sqlite3.Error as e:
+					logging.warning('Could not read the columns of '
+					'{}: {}'.format(name, e))
+	finally:
+		conn.close()
+
+	print('[+] Mapped', len(pages), 'pages to', len(roots),
+	'tables and indexes.')
+
+	with open(cache_file, 'w') as cache:
+		json.dump({'key': key, 'tables': tables, 'pages': pages},
+		cache)
+	return {'tables': tables, 'pages': pages}
+
+
+def page_reader(db, wal):
+	"""
+	The page_reader function builds a function reading the latest
+	copy of a database page. Pages are read from the latest frame of
+	the current WAL generation holding them, and otherwise from the
+	database file. Frames with other salts are stale.
+	:param db: The open main database file.
+	:param wal: The open WAL file.
+	:return: A tuple of the page reading function, which returns
+	None for pages that do not exist, and the usable page size.
+	"""
+	wal.seek(0)
+	header = header_parser(wal.read(32))
+	pagesize = header['pagesize']
+	salts = WAL_CHECKSUM.pack(header['salt1'] & 0xffffffff,
+	header['salt2'] & 0xffffffff)
+
+	wal_pages = {}
+	frames = int((os.fstat(wal.fileno()).st_size - 32) /
+	(pagesize + 24))
+	for x in range(frames):
+		frame_offset = 32 + (x * (pagesize + 24))
+		wal.seek(frame_offset)
+		frame_header = wal.read(24)
+		if frame_header[8:16] == salts:
+			wal_pages[UINT32.unpack_from(frame_header)[0]] = (
+			frame_offset + 24)
+	db_pages = int(os.fstat(db.fileno()).st_size / pagesize)
+
+	def read_page(page_number):
+		if page_number in wal_pages:
+			wal.seek(wal_pages[page_number])
+			return wal.read(pagesize)
+		elif 0 < page_number <= db_pages:
+			db.seek((page_number - 1) * pagesize)
+			return db.read(pagesize)
+		return None
+
+	# The reserved space size is stored in the database header.
+	first = read_page(1)
+	reserved = bytearray(first[20:21] or b'\0')[0] if first else 0
+	return read_page, pagesize - reserved
+
+
+def master_rows(read_page, usable):
+	"""
+	The master_rows function reads the sqlite_master table by
+	walking its b-tree from page 1.
+	:param read_page: A function returning the content of a page by
+	page number.
+	:param usable: The usable page size.
+	:return: A list of (type, name, root page, sql) tuples of the
+	tables and indexes that own a b-tree.
+	"""
+	rows = []
+	stack = [1]
+	seen = set()
+	while stack:
+		page_number = stack.pop()
+		page = read_page(page_number)
+		if page_number in seen or page is None:
+			continue
+		seen.add(page_number)
+		stack.extend(child_pages(page, page_number))
+		for y, cell in frame_parser(0, page, page_number, usable,
+		read_page):
+			data = cell['data']
+			if len(data) == 5 and data[0] in ('table', 'index') and \
+			isinstance(data[3], int) and data[3] > 0:
+				rows.append((data[0], data[1], data[3], data[4]
+				if isinstance(data[4], str) else None))
+	return rows
+
+
+def table_columns(conn, table):
+	"""
+	The table_columns function looks up the column names of a
+	table. A lone INTEGER PRIMARY KEY column is an alias for the
+	rowid and is stored as NULL in the record.
+	:param conn: A connection to a database holding the schema.
+	:param table: The name of the table.
+	:return: A dictionary with the column names ('columns') and the
+	index of the rowid alias column or None ('rowid_column').
+	"""
+	info = conn.execute('PRAGMA table_info("{}")'.format(
+	table.replace('"', '""'))).fetchall()
+	columns = [row[1] for row in info]
+	keys = [row for row in info if row[5]]
+	rowid_column = None
+	if len(keys) == 1 and keys[0][2].upper() == 'INTEGER':
+		rowid_column = keys[0][0]
+	return {'columns': columns, 'rowid_column': rowid_column}
+
+
+def index_columns(conn, index):
+	"""
+	The index_columns function looks up the column names of an
+	index. Index records hold the indexed columns followed by the
+	rowid, or by the primary key of a WITHOUT ROWID table.
+	:param conn: A connection to a database holding the schema.
+	:param index: The name of the index.
+	:return: A dictionary with the column names ('columns') and no
+	rowid alias column ('rowid_column').
+	"""
+	info = conn.execute('PRAGMA index_xinfo("{}")'.format(
+	index.replace('"', '""'))).fetchall()
+	columns = []
+	for row in info:
+		if row[2] is not None:
+			columns.append(row[2])
+		elif row[1] == -1:
+			columns.append('rowid')
+		else:
+			columns.append('expression')
+	return {'columns': columns, 'rowid_column': None}
+
+
+def btree_pages(read_page, roots):
+	"""
+	The btree_pages function walks each b-tree from its root page
+	and records the owner of every interior and leaf page.
+	:param read_page: A function returning the content of a page by
+	page number, from page_reader.
+	:param roots: A list of (name, root page) tuples.
+	:return: A dictionary of page numbers and owner names.
+	"""
+	pages = {}
+	for name, root in roots:
+		stack = [root]
+		while stack:
+			page_number = stack.pop()
+			if page_number in pages:
+				continue
+			page = read_page(page_number)
+			if page is None:
+				continue
+			pages[page_number] = name
+			stack.extend(child_pages(page, page_number))
+	return pages
+
+
+def child_pages(page, page_number):
+	"""
+	The child_pages function lists the child pages referenced by
+	an interior b-tree page. Interior table (0x05) and index (0x02)
+	pages begin each cell with a 4-byte child page number and store
+	the right-most child in the page header.
+	:param page: The content of the page.
+	:param page_number: The page number, as page 1 begins with the
+	100-byte database header.
+	:return: A list of child page numbers.
+	"""
+	start = 100 if page_number == 1 else 0
+	if page[start] not in (2, 5):
+		return []
+	cells = UINT16.unpack_from(page, start + 3)[0]
+	children = [UINT32.unpack_from(page, start + 8)[0]]
+	for y in range(cells):
+		cell_offset = UINT16.unpack_from(page, start + 12 + (y * 2))[0]
+		if cell_offset + 4 <= len(page):
+			children.append(UINT32.unpack_from(page, cell_offset)[0])
+	return children
+
+
+def correlate_records(records, schema):
+	"""
+	The correlate_records function labels each record with the
+	table that owns its page and restores the value of a rowid
+	alias column, which the record stores as NULL.
+	:param records: An iterable of cell records.
+	:param schema: The schema dictionary from schema_index.
+	:return: A generator of the records.
+	"""
+	tables = schema['tables']
+	pages = schema['pages']
+	for record in records:
+		table = pages.get(record['page'])
+		if table in tables:
+			record['table'] = table
+			alias = tables[table]['rowid_column']
+			if alias is not None and record['rowid'] is not None and \
+			alias < len(record['data']) and \
+			record['data'][alias] is None:
+				record['data'][alias] = record['rowid']
+		yield record
+
+
+def checksum_index(wal_file, pagesize, frames):
+	"""
+	The checksum_index function verifies the WAL header and frame
+	checksums as SQLite does when recovering a WAL. The checksum of
+	each frame is cumulative and is seeded by the checksum of the
+	frame before it, starting from the header checksum. Frames
+	whose salts differ from the header were written before the
+	last checkpoint.
+	:param wal_file: The filepath to the WAL file to be processed
+	:param pagesize: The page size from the WAL header.
+	:param frames: The number of frames in the WAL file.
+	:return: A list with the status of each frame, either 'valid',
+	'uncommitted', 'stale' or 'invalid', and a list of the valid
+	commit frames.
+	"""
+	statuses = []
+	commits = []
+	with open(wal_file, 'rb') as wal:
+		header = wal.read(32)
+		magic, salts, checksum = (UINT32.unpack_from(header)[0],
+		header[16:24], WAL_CHECKSUM.unpack_from(header, 24))
+
+		# The least significant bit of the magic number sets the
+		# byte order of the checksum.
+		big_endian = magic & 1
+		page_words = checksum_struct(pagesize, big_endian)
+		frame_words = checksum_struct(8, big_endian)
+		valid = wal_checksum(checksum_struct(24, big_endian),
+		header, (0, 0)) == checksum
+		if not valid:
+			logging.warning('WAL header checksum mismatch')
+		running = checksum
+
+		for x in range(frames):
 			frame_header = wal.read(24)
-			wal_attributes['frames'][x]['header'] = dict_helper(
-			frame_header, '>6i', namedtuple('struct',
-			'pagenumber commit salt1'
-			' salt2 checksum1'
-			' checksum2'))
-			# Parse pagesize WAL frame.
-			frame = wal.read(wal_attributes['header']['pagesize'])
-			frame_parser(wal_attributes, x, frame)
+			frame = wal.read(pagesize)
+			if frame_header[8:16] != salts:
+				statuses.append('stale')
+				continue
+			if valid:
+				# The frame checksum covers the first 8 bytes of the
+				# frame header and the page content.
+				running = wal_checksum(page_words, frame,
+				wal_checksum(frame_words, frame_header, running))
+				valid = running == WAL_CHECKSUM.unpack_from(
+				frame_header, 16)
+			if not valid:
+				# SQLite ignores every frame after the first frame
+				# that fails its checksum.
+				statuses.append('invalid')
+				continue
+
+			statuses.append('uncommitted')
+			if UINT32.unpack_from(frame_header, 4)[0]:
+				commits.append(x)
+
+	# Frames are only valid when they are followed by a commit
+	# frame within the same unbroken checksum chain.
+	last_commit = commits[-1] if commits else -1
+	for x in range(last_commit + 1):
+		if statuses[x] == 'uncommitted':
+			statuses[x] = 'valid'
+	return statuses, commits
+
+
+def checksum_struct(length, big_endian):
+	"""
+	The checksum_struct function returns a cached struct for
+	reading the 32-bit words checksummed in a block of data.
+	:param length: The length of the block in bytes.
+	:param big_endian: Whether the words are big-endian.
+	:return: A struct.Struct unpacking the words of the block.
+	"""
+	key = (length, big_endian)
+	if key not in CHECKSUM_STRUCTS:
+		CHECKSUM_STRUCTS[key] = struct.Struct('{}{}I'.format(
+		'>' if big_endian else '<', length // 4))
+	return CHECKSUM_STRUCTS[key]
 
-		# Run regular expression functions.
-		if kwargs['m'] or kwargs['r']:
-			regular_search(wal_attributes, kwargs)
 
-		# Write WAL data to CSV file.
-		csv_writer(wal_attributes, output_dir)
+def wal_checksum(words_struct, data, seed):
+	"""
+	The wal_checksum function continues the WAL checksum over a
+	block of data.
+	:param words_struct: The struct returned by checksum_struct.
+	:param data: The data to checksum.
+	:param seed: The (s0, s1) checksum of the preceding data.
+	:return: The (s0, s1) checksum including the data.
+	"""
+	s0, s1 = seed
+	words = words_struct.unpack_from(data)
+	for i in range(0, len(words), 2):
+		s0 = (s0 + words[i] + s1) & 0xffffffff
+		s1 = (s1 + words[i + 1] + s0) & 0xffffffff
+	return s0, s1
 
 
-def frame_parser(wal_dict, x, frame):
+def worker_init(index):
 	"""
-	The frame_parser function processes WAL frames.
-	:param wal_dict: The dictionary containing parsed WAL objects.
-	:param x: An integer specifying the current frame.
-	:param frame: The content within the frame read from the WAL
-	file.
+	The worker_init function stores the frame lookup table in a
+	worker process.
+	:param index: The frame lookup table from frame_index.
 	:return: Nothing.
 	"""
+	global WORKER_INDEX
+	WORKER_INDEX = index
 
-	# Parse 8-byte WAL page header
-	page_header = frame[0:8]
-	wal_dict['frames'][x]['page_header'] = dict_helper(
-	page_header, '>b3hb', namedtuple('struct',
-	'type freeblocks cells offset'
-	' fragments'))
-	# Only want to parse 0x0D B-Tree Leaf Cells
-	if wal_dict['frames'][x]['page_header']['type'] != 13:
-		logging.info(('Found a non-Leaf Cell in frame {}. Popping '
-		'frame from dictionary').format(x))
-		wal_dict['frames'].pop(x)
-		return
-	# Parse offsets for "X" cells
-	cells = wal_dict['frames'][x]['page_header']['cells']
-	wal_dict['frames'][x]['cells'] = {}
-	print('[+] Identified', cells, 'cells in frame', x)
-	print('[+] Processing cells...')
 
-	for y in range(cells):
-		start = 8 + (y * 2)
-		wal_dict['frames'][x]['cells'][y] = {}
+def frame_range_worker(task):
+	"""
+	The frame_range_worker function parses a slice of frames in a
+	worker process.
+	:param task: A tuple of the WAL file, page size, frame numbers,
+	mmap and carve arguments of frame_range_parser.
+	:return: A list of the records found in the slice.
+	"""
+	wal_file, pagesize, frame_numbers, use_mmap, carve = task
+	return list(frame_range_parser(wal_file, pagesize, frame_numbers,
+	use_mmap, WORKER_INDEX, carve))
+
+
+def frame_range_parser(wal_file, pagesize, frame_numbers,
+use_mmap=False, index=None, carve=True):
+	"""
+	The frame_range_parser function opens the WAL file and parses
+	the requested frames.
+	:param wal_file: The filepath to the WAL file to be processed
+	:param pagesize: The page size from the WAL header.
+	:param frame_numbers: An iterable of the frames to parse.
+	:param use_mmap: Memory-map the WAL file instead of reading
+	each frame.
+	:param index: The frame lookup table from frame_index, used to
+	follow overflow chains. Cells that overflow are skipped without
+	it.
+	:param carve: Recover deleted records from free space.
+	:return: A generator of cell records.
+	"""
+	with open(wal_file, 'rb') as wal:
 
-		wal_dict['frames'][x]['cells'][y] = dict_helper(
-		frame[start: start + 2], '>h', namedtuple(
-		'struct', 'offset'))
+		# In mmap mode the WAL is mapped into memory and each frame
+		# is handed to the parsers as a zero-copy memoryview slice
+		# of the mapping rather than read into a new buffer.
+		wal_map = wal_view = None
+		frame_header = frame = None
+		if use_mmap:
+			wal_map = mmap.mmap(wal.fileno(), 0,
+			access=mmap.ACCESS_READ)
+			wal_view = memoryview(wal_map)
+
+		usable = pagesize
+		read_page = None
+		if index is not None:
+			usable -= index['reserved']
+
+			# Overflow pages are read from the latest frame of the
+			# same generation written by the end of the transaction
+			# of the frame being parsed.
+			def read_page(pagenumber):
+				versions = index['pages'].get((salts, pagenumber))
+				i = bisect.bisect_right(versions or (), end) - 1
+				if i < 0:
+					return None
+				return frame_reader(wal, wal_view, pagesize,
+				versions[i])[1]
 
-		# Parse cell content
-		cell_parser(wal_dict, x, y, frame)
+		try:
+			for x in frame_numbers:
+				frame_offset = 32 + (x * (pagesize + 24))
+				frame_header, frame = frame_reader(wal, wal_view,
+				pagesize, x)
+				if index is not None:
+					salts = bytes(frame_header[8:16])
+					end = index['commit_end'][x]
+
+				# Parse 24-byte WAL frame header.
+				frame_dict = dict_helper(frame_header, '>6i',
+				namedtuple('struct', 'pagenumber commit salt1'
+				' salt2 checksum1 checksum2'))
+
+				# Parse pagesize WAL frame and emit its cells.
+				for y, cell in frame_parser(x, frame,
+				frame_dict['pagenumber'], usable, read_page, carve):
+					yield {'frame': x,
+					'page': frame_dict['pagenumber'],
+					'salt1': frame_dict['salt1'],
+					'salt2': frame_dict['salt2'],
+					'frame_offset': frame_offset,
+					'cell': y,
+					'cell_offset': frame_offset + 24 + cell['offset'],
+					'rowid': cell['rowid'],
+					'data': cell['data'],
+					'carved': cell.get('carved')}
+
+		finally:
+			# All views into the mapping must be released before
+			# it can be closed. If a traceback still references a
+			# view, the mapping is closed when it is collected.
+			frame_header = frame = None
+			if wal_map is not None:
+				wal_view.release()
+				try:
+					wal_map.close()
+				except BufferError:
+					pass
+
+
+def frame_reader(wal, wal_view, pagesize, x):
+	"""
+	The frame_reader function reads the header and page of a frame,
+	either as slices of the memory-mapped WAL or from the file.
+	:param wal: The open WAL file.
+	:param wal_view: A memoryview of the mapped WAL file, or None.
+	:param pagesize: The page size from the WAL header.
+	:param x: The frame number.
+	:return: A tuple of the 24-byte frame header and a memoryview
+	of the page.
+	"""
+	frame_offset = 32 + (x * (pagesize + 24))
+	if wal_view is not None:
+		return (wal_view[frame_offset:frame_offset + 24],
+		wal_view[frame_offset + 24:frame_offset + 24 + pagesize])
+	wal.seek(frame_offset)
+	return wal.read(24), memoryview(wal.read(pagesize))
 
 
-def cell_parser(wal_dict, x, y, frame):
+def header_parser(header):
+	"""
+	The header_parser function parses and validates the 32-byte
+	WAL file header.
+	:param header: The first 32 bytes of the WAL file.
+	:return: A dictionary of the WAL header values.
+	"""
+	# If file is less than 32 bytes long: exit wal_crawler.
+	try:
+		wal_header = dict_helper(header, '>4s7i',
+		namedtuple('struct',
+		'magic format pagesize checkpoint '
+		'salt1 salt2 checksum1 checksum2'))
+	except struct.error as e:
+		logging.error('STRUCT ERROR: {}'.format(e))
+		print('[-]', str(e) + '. Exiting..')
+		sys.exit(2)
+
+	# Do not proceed in the program if the input file is not a
+	# WAL file.
+	magic_hex = binascii.hexlify(wal_header['magic']).decode('utf-8')
+	if magic_hex != "377f0682" and magic_hex != "377f0683":
+		logging.error(('Magic mismatch, expected 0x377f0682 '
+		'or 0x377f0683 | received {}'.format(magic_hex)))
+		print(('[-] File does not have appropriate signature '
+		'for WAL file. Exiting...'))
+		sys.exit(3)
+
+	return wal_header
+
+
+def frame_parser(x, frame, pagenumber=None, usable=None,
+read_page=None, carve=False):
+	"""
+	The frame_parser function processes WAL frames. Cells are
+	parsed from table leaf (0x0D), index leaf (0x0A) and index
+	interior (0x02) pages. Table interior (0x05) pages only hold
+	child pointers and rowids, so they have no records to recover.
+	:param x: An integer specifying the current frame.
+	:param frame: A memoryview of the content within the frame
+	read from the WAL file.
+	:param pagenumber: The database page number of the frame. Page
+	1 begins with the 100-byte database header.
+	:param usable: The usable size of the page, used to size the
+	local part of overflowing payloads. Defaults to the frame size.
+	:param read_page: A function returning the content of a page by
+	page number, used to follow overflow chains.
+	:param carve: Also recover deleted records from the freeblocks
+	and unallocated space of table leaf pages. Carved cells have no
+	cell number.
+	:return: A generator of (cell number, cell dictionary) tuples
+	for each cell that contains data.
+	"""
+	start = 100 if pagenumber == 1 else 0
+	if usable is None:
+		usable = len(frame)
+
+	# Parse 8-byte or 12-byte b-tree page header
+	page_type, freeblocks, cells, offset, fragments = \
+	PAGE_HEADER.unpack_from(frame, start)
+	if page_type not in PAGE_HEADER_SIZES:
+		logging.info(('Found a non b-tree page in frame {}. '
+		'Skipping frame').format(x))
+		return
+	if page_type == 5:
+		logging.debug(('Found a table interior page in frame {}. '
+		'Skipping frame').format(x))
+		return
+
+	# Parse offsets for "X" cells
+	logging.debug('Identified {} cells in frame {}'.format(cells, x))
+	pointers = start + PAGE_HEADER_SIZES[page_type]
+	columns = {}
+	for y in range(cells):
+		try:
+			cell_offset = UINT16.unpack_from(frame,
+			pointers + (y * 2))[0]
+		except struct.error:
+			break
+
+		# Parse cell content. Only yield cells that have data.
+		cell = cell_parser(x, y, frame, cell_offset, page_type,
+		usable, read_page)
+		if cell is not None and len(cell['data']) > 0:
+			columns[len(cell['types'])] = columns.get(
+			len(cell['types']), 0) + 1
+			yield y, cell
+
+	# Deleted records usually have as many columns as most of the
+	# live records on the page.
+	if carve and page_type == 13:
+		hint = max(columns, key=columns.get) if columns else None
+		for region_start, region_end, source in free_regions(frame,
+		pointers + (cells * 2), offset, freeblocks):
+			for cell in carve_parser(frame, region_start, region_end,
+			source == 'freeblock', hint):
+				cell['carved'] = source
+				yield None, cell
+
+
+def cell_parser(x, y, frame, cell_offset, page_type=13, usable=None,
+read_page=None):
 	"""
 	The cell_parser function processes WAL cells.
-	:param wal_dict: The dictionary containing parsed WAL objects.
 	:param x: An integer specifying the current frame.
 	:param y: An integer specifying the current cell.
-	:param frame: The content within the frame read from the WAL
-	file.
-	:return: Nothing.
+	:param frame: A memoryview of the content within the frame
+	read from the WAL file. Slicing it does not copy the data.
+	:param cell_offset: The offset of the cell within the frame.
+	:param page_type: The b-tree page type. Index cells have no
+	rowid and index interior cells begin with a child page number.
+	:param usable: The usable size of the page. Defaults to the
+	frame size.
+	:param read_page: A function returning the content of a page by
+	page number, used to follow overflow chains.
+	:return: A dictionary of the parsed cell or None if it could
+	not be parsed.
 	"""
-	index = 0
-	# Create alias to cell_root to shorten navigating the WAL
-	# dictionary structure.
-	cell_root = wal_dict['frames'][x]['cells'][y]
-	cell_offset = cell_root['offset']
+	cell_root = {'offset': cell_offset, 'rowid': None}
+	if usable is None:
+		usable = len(frame)
+
+	# Parse the payload length and rowID Varints. Each Varint is
+	# read in place and returns the offset of the following field.
+	# Following the payload length and rowID is the record header,
+	# which begins with its own length as a Varint.
+	index = cell_offset
+	if page_type == 2:
+		index += 4
+	try:
+		payload_len, index = single_varint(frame, index)
+		if page_type == 13:
+			cell_root['rowid'], index = single_varint(frame, index)
+	except ValueError:
+		logging.warning(('Found a malformed varint in cell {} from '
+		'frame {}').format(y, x))
+		return None
+	cell_root['payloadlength'] = payload_len
+
+	# A payload that does not fit on the page continues in a chain
+	# of overflow pages, and the record is decoded from the payload
+	# reassembled from the chain.
+	payload = frame
+	local = local_payload(payload_len, usable, page_type)
+	if local < payload_len:
+		payload = None
+		if read_page is not None and index + local + 4 <= len(frame):
+			payload = overflow_payload(frame, index, local,
+			payload_len, usable, read_page)
+		if payload is None:
+			logging.warning(('Cannot follow the overflow chain of '
+			'cell {} from frame {}').format(y, x))
+			return None
+		index = 0
 
-	# Parse the payload length and rowID Varints.
 	try:
-		payload_len, index_a = single_varint(
-		frame[cell_offset:cell_offset + 9])
-		row_id, index_b = single_varint(
-		frame[cell_offset + index_a: cell_offset + index_a + 9])
+		header_start = index
+		header_len, index = single_varint(payload, index)
 	except ValueError:
-		logging.warn(('Found a potential three-byte or greater '
-		'varint in cell {} from frame {}').format(y, x))
-		return
+		logging.warning(('Found a malformed varint in cell {} from '
+		'frame {}').format(y, x))
+		return None
+	cell_root['headerlength'] = header_len
 
-	# Update the index. Following the payload length and rowID is
-	# the 1-byte header length.
-	cell_root['payloadlength'] = payload_len
-	cell_root['rowid'] = row_id
-	index += index_a + index_b
-	cell_root['headerlength'] = struct.unpack('>b',
-	frame[cell_offset + index: cell_offset + index + 1])[0]
-
-	# Update the index with the 1-byte header length. Next process
-	# each Varint in "headerlength" - 1 bytes.
-	index += 1
+	# The serial type Varints in the rest of the record header and
+	# the data they describe are decoded together.
 	try:
-		types, index_a = multi_varint(
-		frame[cell_offset + index:cell_offset+index+cell_root['headerlength']-1])
+		cell_root['types'], cell_root['data'] = record_parser(payload,
+		index, header_start + header_len, header_start + payload_len)
 	except ValueError:
-		logging.warn(('Found a potential three-byte or greater '
-		'varint in cell {} from frame {}').format(y, x))
-		return
-	cell_root['types'] = types
-	index += index_a
+		logging.warning(('Cell {} from frame {} is malformed or '
+		'truncated').format(y, x))
+		return None
+	return cell_root
+
+
+def free_regions(frame, unallocated, content, freeblocks):
+	"""
+	The free_regions function lists the areas of a page that are
+	not used by live cells. The unallocated space lies between the
+	cell pointer array and the cell content area. Freeblocks form
+	a chain, each beginning with the offset of the next freeblock
+	and its own size, which overwrite the start of the deleted cell.
+	:param frame: The content of the page.
+	:param unallocated: The offset of the end of the cell pointers.
+	:param content: The offset of the cell content area, where 0
+	stands for 65536.
+	:param freeblocks: The offset of the first freeblock or 0.
+	:return: A list of (start, end, source) tuples.
+	"""
+	regions = []
+	content = min(content or 65536, len(frame))
+	if unallocated < content:
+		regions.append((unallocated, content, 'unallocated'))
+
+	seen = set()
+	while freeblocks and freeblocks not in seen and \
+	freeblocks + 4 <= len(frame):
+		seen.add(freeblocks)
+		next_block, size = FREEBLOCK.unpack_from(frame, freeblocks)
+		if size > 4:
+			regions.append((freeblocks + 4,
+			min(freeblocks + size, len(frame)), 'freeblock'))
+		freeblocks = next_block
+	return regions
+
+
+def carve_parser(frame, start, end, freeblock=False, columns=None):
+	"""
+	The carve_parser function searches a free region of a page for
+	deleted records. Candidate header lengths are found with a
+	regular expression and only those positions are decoded.
+	:param frame: The content of the page.
+	:param start: The offset of the start of the region.
+	:param end: The offset of the end of the region.
+	:param freeblock: The region follows a 4-byte freeblock header,
+	which overwrote the start of the first deleted cell. SQLite
+	merges adjacent deleted cells into one freeblock, so the cells
+	following the first one are carved in turn.
+	:param columns: The expected number of columns, if known.
+	:return: A generator of carved cell dictionaries.
+	"""
+	if freeblock:
+		cell = carve_freeblock(frame, start - 4, end, columns)
+		while cell is not None:
+			yield cell
+			start = cell['end']
+			cell = next_record(frame, start, end, columns)
+
+	index = start
+	while True:
+		match = CARVE_CANDIDATES.search(frame, index, end)
+		if match is None:
+			return
+		cell = carve_record(frame, match.start(), start, end)
+		if cell is None:
+			index = match.start() + 1
+		else:
+			index = cell['end']
+			yield cell
 
-	# Immediately following the end of the Varint headers begins
-	# the actual data described by the headers. Process them using
-	# the typeHelper function.
-	diff = cell_root['payloadlength'] - cell_root['headerlength']
-	cell_root['data'] = type_helper(cell_root['types'],
-	frame[cell_offset + index: cell_offset + index + diff])
+
+def next_record(frame, start, end, columns=None, check=True):
+	"""
+	The next_record function carves the deleted record that directly
+	follows another one in a freeblock, allowing for the up to 3
+	fragment bytes SQLite merges into a freeblock. The record is
+	either intact or begins with the stale header of the freeblock
+	it was part of before the merge.
+	:param frame: The content of the page.
+	:param start: The offset where the previous record ended.
+	:param end: The offset of the end of the freeblock.
+	:param columns: The expected number of columns, if known.
+	:param check: Passed on to carve_freeblock.
+	:return: A carved cell dictionary or None.
+	"""
+	for match in CARVE_CANDIDATES.finditer(frame, start,
+	min(end, start + 16)):
+		cell = carve_record(frame, match.start(), start, end)
+		if cell is not None and cell['offset'] <= start + 3:
+			return cell
+	for block in range(start, min(start + 4, end - 4)):
+		# A stale header still points past the end of its own
+		# freeblock, as freeblocks are kept in ascending order.
+		next_block, size = FREEBLOCK.unpack_from(frame, block)
+		if size < 4 or block + size > end or \
+		(next_block and not block + size < next_block < len(frame)):
+			continue
+		cell = carve_freeblock(frame, block, end, columns, check)
+		if cell is not None:
+			return cell
+	return None
+
+
+def carve_header(frame, index, header_end, end):
+	"""
+	The carve_header function checks that a candidate record header
+	consists of valid serial types ending exactly at its stated
+	length, that it describes at least one value other than NULL, 0
+	or 1 and that the values fit in the region.
+	:param frame: The content of the page.
+	:param index: The offset of the first serial type Varint.
+	:param header_end: The offset where the record body begins.
+	:param end: The offset of the end of the region.
+	:return: A tuple of the serial types and the length of the
+	record body, or None.
+	"""
+	if header_end > end:
+		return None
+	types = []
+	body_len = 0
+	has_value = False
+	try:
+		while index < header_end:
+			serial_type, index = single_varint(frame, index)
+			if serial_type >= 12:
+				body_len += (serial_type - 12) >> 1
+				has_value = True
+			elif 0 <= serial_type < 10:
+				body_len += SERIAL_TYPES[serial_type][0]
+				has_value = has_value or 0 < serial_type < 8
+			else:
+				return None
+			types.append(serial_type)
+	except ValueError:
+		return None
+	if index != header_end or not has_value or \
+	header_end + body_len > end:
+		return None
+	return types, body_len
+
+
+def carve_record(frame, header_start, start, end):
+	"""
+	The carve_record function decodes a record at a candidate
+	header position. Besides a valid header, the payload length and
+	rowid Varints of the cell must precede it intact, which rules
+	out most false positives.
+	:param frame: The content of the page.
+	:param header_start: The offset of the candidate record header.
+	:param start: The offset of the start of the region.
+	:param end: The offset of the end of the region.
+	:return: A carved cell dictionary or None.
+	"""
+	header_end = header_start + frame[header_start]
+	record = carve_header(frame, header_start + 1, header_end, end)
+	if record is None:
+		return None
+	types, body_len = record
+	stop = header_end + body_len
+
+	# Look for a rowid Varint ending at the header, preceded by a
+	# payload length Varint matching the carved record.
+	for rowid_start in range(header_start - 1,
+	max(start, header_start - 9) - 1, -1):
+		try:
+			rowid, index = single_varint(frame, rowid_start)
+		except ValueError:
+			continue
+		if index != header_start:
+			continue
+		for cell_start in range(rowid_start - 1,
+		max(start, rowid_start - 3) - 1, -1):
+			try:
+				length, index = single_varint(frame, cell_start)
+			except ValueError:
+				continue
+			if index == rowid_start and length == stop - header_start:
+				return {'offset': cell_start, 'rowid': rowid,
+				'types': types,
+				'data': type_helper(types, frame[header_end:stop]),
+				'end': stop}
+	return None
+
+
+def carve_freeblock(frame, block, end, columns=None, check=True):
+	"""
+	The carve_freeblock function recovers the deleted record at the
+	start of a freeblock. The 4-byte freeblock header overwrites the
+	payload length and rowid Varints and the record header length,
+	and with a 1-byte payload length and rowid also the first serial
+	type. The value of a lost first serial type is returned as None.
+	Its width is unknown, so each fixed width is tried. A freeblock
+	may hold several merged cells, so a layout is only accepted when
+	the record ends at the end of the freeblock or is followed by
+	another deleted record. When several layouts fit, the shortest
+	one with the expected number of columns wins, as a longer one
+	may span several merged cells.
+	:param frame: The content of the page.
+	:param block: The offset of the freeblock.
+	:param end: The offset of the end of the freeblock.
+	:param columns: The expected number of columns, if known.
+	:param check: Require a record to be followed by another one.
+	When False, any layout that fits is accepted, which is
+	how the following record is checked.
+	:return: A carved cell dictionary or None.
+	"""
+	carved = None
+	# The prefix is the length of the payload length and rowid
+	# Varints, which ends at the lost header length.
+	for prefix in (3, 2):
+		lost = 3 - prefix
+		for header_len in range(2 + lost, 64):
+			header_end = block + prefix + header_len
+			if header_end > end:
+				break
+			record = carve_header(frame, block + 4, header_end, end)
+			if record is None:
+				continue
+			types, body_len = record
+			for width in (0, 1, 2, 3, 4, 6, 8) if lost else (0,):
+				stop = header_end + width + body_len
+				if stop > end:
+					break
+				try:
+					data = type_helper(types,
+					frame[header_end + width:stop])
+				except ValueError:
+					continue
+				if check and stop != end and next_record(frame, stop,
+				end, columns, False) is None:
+					continue
+				cell = {'offset': block, 'rowid': None,
+				'types': [None] * lost + types,
+				'data': [None] * lost + data, 'end': stop}
+				rank = (columns is not None and
+				len(cell['types']) != columns, stop)
+				if carved is None or rank < carved[0]:
+					carved = (rank, cell)
+	return carved[1] if carved else None
+
+
+def local_payload(payload_len, usable, page_type=13):
+	"""
+	The local_payload function calculates how many bytes of a
+	payload are stored on the b-tree page itself, following the
+	SQLite file format.
+	:param payload_len: The total length of the payload.
+	:param usable: The usable size of the page.
+	:param page_type: The b-tree page type.
+	:return: The number of payload bytes stored on the page.
+	"""
+	if page_type == 13:
+		max_local = usable - 35
+	else:
+		max_local = ((usable - 12) * 64 // 255) - 23
+	if payload_len <= max_local:
+		return payload_len
+
+	min_local = ((usable - 12) * 32 // 255) - 23
+	local = min_local + ((payload_len - min_local) % (usable - 4))
+	if local > max_local:
+		local = min_local
+	return local
+
+
+def overflow_payload(frame, index, local, payload_len, usable,
+read_page):
+	"""
+	The overflow_payload function reassembles a payload from its
+	local part and its chain of overflow pages. Each overflow page
+	begins with the page number of the next page in the chain.
+	:param frame: The content of the page holding the cell.
+	:param index: The offset of the payload within the page.
+	:param local: The number of payload bytes on the page.
+	:param payload_len: The total length of the payload.
+	:param usable: The usable size of the page.
+	:param read_page: A function returning the content of a page by
+	page number.
+	:return: The payload as bytes, or None if the chain is broken.
+	"""
+	payload = bytearray(frame[index:index + local])
+	pagenumber = UINT32.unpack_from(frame, index + local)[0]
+	seen = set()
+	while len(payload) < payload_len:
+		if pagenumber == 0 or pagenumber in seen:
+			return None
+		seen.add(pagenumber)
+		page = read_page(pagenumber)
+		if page is None:
+			return None
+		remaining = payload_len - len(payload)
+		payload += page[4:4 + min(remaining, usable - 4)]
+		pagenumber = UINT32.unpack_from(page, 0)[0]
+	return bytes(payload)
 
 
 def dict_helper(data, format, keys):
@@ -242,57 +1654,93 @@ def dict_helper(data, format, keys):
 
 def single_varint(data, index=0):
 	"""
-	The single_varint function processes a Varint and returns the
-	length of that Varint.
-	:param data: The data containing the Varint (maximum of 9
-	bytes in length as that is the maximum size of a Varint).
-	:param index: The current index within the data.
+	The single_varint function processes a Varint at an offset
+	within the data, without slicing it. Varints are between 1
+	and 9 bytes long. The first eight bytes contribute their low
+	seven bits while their high bit is set, and a ninth byte
+	contributes all eight bits.
+	:param data: The data containing the Varint.
+	:param index: The offset of the Varint within the data.
 	:return: varint, the processed varint value,
-	and index which is used to identify how long the Varint was.
-	"""
-
-	# If the decimal value is => 128 -- then first bit is set and
-	# need to process next byte.
-	if ord(data[index:index+1]) >= 128:
-		# Check if there is a three or more byte varint
-		if ord(data[index + 1: index + 2]) >= 128:
-			raise ValueError
-		varint = (ord(data[index:index+1]) - 128) * 128 + ord(
-		data[index + 1: index + 2])
-		index += 2
-		return varint, index
-
-	# If the decimal value is < 128 -- then first bit is not set 
-	# and is the only byte of the Varint.
-	else:
-		varint = ord(data[index:index+1])
-		index += 1
-		return varint, index
-
-
-def multi_varint(data):
+	and index which is the offset following the Varint.
 	"""
-	The multi_varint function is similar to the single_varint
-	function. The difference is that it takes a range of data
-	and finds all Varints within it.
-	:param data: The data containing the Varints.
-	:return: varints, a list containing the processed varint
-	values, and index which is used to identify how long the
-	Varints were.
+	try:
+		byte = data[index]
+		# If the decimal value is < 128 -- then first bit is not
+		# set and is the only byte of the Varint.
+		if byte < 128:
+			return byte, index + 1
+
+		# If the decimal value is => 128 -- then first bit is set
+		# and need to process the following bytes.
+		varint = byte & 0x7f
+		for i in range(index + 1, index + 8):
+			byte = data[i]
+			varint = (varint << 7) | (byte & 0x7f)
+			if byte < 128:
+				return varint, i + 1
+		varint = (varint << 8) | data[index + 8]
+	except IndexError:
+		raise ValueError('Varint at offset {} is truncated'.format(
+		index))
+
+	# Nine byte Varints are 64-bit two's complement integers.
+	if varint & 0x8000000000000000:
+		varint -= 0x10000000000000000
+	return varint, index + 9
+
+
+def record_parser(data, index, header_end, end):
 	"""
-	varints = []
-	index = 0
-
-	# Loop forever until all Varints are found by repeatedly
-	# calling singleVarint.
-	while len(data) != 0:
-		varint, index_a = single_varint(data)
-		varints.append(varint)
-		index += index_a
-		# Shorten data to exclude the most recent Varint.
-		data = data[index_a:]
+	The record_parser function decodes a record in one pass. Each
+	serial type Varint in the record header is read and the value
+	it describes is immediately decoded from the record body.
+	:param data: The data containing the record.
+	:param index: The offset of the first serial type Varint.
+	:param header_end: The offset where the record body begins.
+	:param end: The offset where the record ends.
+	:return: types, a list of the serial types, and cell_data, a
+	list of the processed data.
+	"""
+	types = []
+	cell_data = []
+	body = header_end
+	# Overflowing records are cut off at the end of the page.
+	if end > len(data):
+		end = len(data)
+
+	while index < header_end:
+		# Nearly all serial types fit in a single byte.
+		serial_type = data[index]
+		if serial_type < 128:
+			index += 1
+		else:
+			serial_type, index = single_varint(data, index)
+		types.append(serial_type)
+
+		if serial_type < 12:
+			width, decoder = SERIAL_TYPES[serial_type]
+			if decoder is None:
+				logging.error('Unexpected serial type: {}'.format(
+				serial_type))
+				continue
+			if body + width > end:
+				raise ValueError('Record is truncated')
+			cell_data.extend(decoder(data, body))
+			body += width
+		else:
+			# Even types >= 12 are BLOBs and odd types >= 13 are
+			# TEXT, in both cases (type - 12) / 2 bytes long.
+			stop = body + ((serial_type - 12) >> 1)
+			if serial_type & 1:
+				cell_data.append(str(data[body:stop if stop < end
+				else end], 'utf-8', 'replace'))
+			else:
+				cell_data.append(bytes(data[body:stop if stop < end
+				else end]))
+			body = stop
 
-	return varints, index
+	return types, cell_data
 
 
 def type_helper(types, data):
@@ -306,135 +1754,335 @@ def type_helper(types, data):
 	"""
 	cell_data = []
 	index = 0
-
-	# Value of type dictates how the data should be processed. 
-	# See serial type table in chapter for list of possible
-	# values.
-	for type in types:
-
-		if type == 0:
-			cell_data.append('NULL (RowId?)')
-		elif type == 1:
-			cell_data.append(struct.unpack('>b',
-			data[index:index + 1])[0])
-			index += 1
-		elif type == 2:
-			cell_data.append(struct.unpack('>h',
-			data[index:index + 2])[0])
-			index += 2
-		elif type == 3:
-			# Struct does not support 24-bit integer
-			cell_data.append(int(binascii.hexlify(
-			data[index:index + 3]).decode('utf-8'), 16))
-			index += 3
-		elif type == 4:
-			cell_data.append(struct.unpack(
-			'>i', data[index:index + 4])[0])
-			index += 4
-		elif type == 5:
-			# Struct does not support 48-bit integer
-			cell_data.append(int(binascii.hexlify(
-			data[index:index + 6]).decode('utf-8'), 16))
-			index += 6
-		elif type == 6:
-			cell_data.append(struct.unpack(
-			'>q', data[index:index + 8])[0])
-			index += 8
-		elif type == 7:
-			cell_data.append(struct.unpack(
-			'>d', data[index:index + 8])[0])
-			index += 8
-		# Type 8 == Constant 0 and Type 9 == Constant 1. Neither of these take up space in the actual data.
-		elif type == 8:
-			cell_data.append(0)
-		elif type == 9:
-			cell_data.append(1)
-		# Types 10 and 11 are reserved and currently not implemented.
-		elif type > 12 and type % 2 == 0:
-			b_length = int((type - 12) / 2)
-			cell_data.append(data[index:index + b_length])
-			index += b_length
-		elif type > 13 and type % 2 == 1:
-			s_length = int((type - 13) / 2)
-			cell_data.append(
-			data[index:index + s_length].decode('utf-8'))
-			index += s_length
-
+	end = len(data)
+
+	# Value of type dictates how the data should be processed. The
+	# SERIAL_TYPES table gives the width and decoder of each fixed
+	# size type. See serial type table in chapter for list of
+	# possible values.
+	for serial_type in types:
+		if serial_type < 12:
+			width, decoder = SERIAL_TYPES[serial_type]
+			if decoder is None:
+				logging.error('Unexpected serial type: {}'.format(
+				serial_type))
+				continue
+			if index + width > end:
+				raise ValueError('Record is truncated')
+			cell_data.extend(decoder(data, index))
+			index += width
 		else:
-			msg = 'Unexpected serial type: {}'.format(type)
-			print('[-]', msg)
-			logging.error(msg)
+			stop = index + ((serial_type - 12) >> 1)
+			if serial_type & 1:
+				cell_data.append(str(data[index:stop], 'utf-8',
+				'replace'))
+			else:
+				cell_data.append(bytes(data[index:stop]))
+			index = stop
 
 	return cell_data
 
 
-def csv_writer(data, output_dir):
+def csv_writer(records, output_dir, extra_columns=(), tables=None,
+append=False):
 	"""
 	The csv_writer function writes frame, cell, and data to a CSV
-	output file.
-	:param data: The dictionary containing the parsed WAL file.
+	output file. When the records are labelled with their table,
+	each table is written to its own CSV file with the column names
+	of the table as headers.
+	:param records: An iterable of cell records, such as the
+	generator returned by iter_wal_records.
 	:param output_dir: The directory to write the CSV report to.
+	:param extra_columns: A list of (header, record key) tuples
+	written between the cell identifiers and the data.
+	:param tables: The tables dictionary from schema_index, or None.
+	:param append: Append to existing CSV files.
 	:return: Nothing.
 	"""
 	headers = ['Frame', 'Salt-1', 'Salt-2', 'Frame Offset',
-	'Cell', 'Cell Offset', 'ROWID', 'Data']
+	'Cell', 'Cell Offset', 'ROWID']
+	headers += [column[0] for column in extra_columns]
 
-	out_file = os.path.join(output_dir, 'wal_crawler.csv')
-	
+	csvfiles = []
+	writers = {}
+	try:
+		writer = csv_file_writer(
+		os.path.join(output_dir, 'wal_crawler.csv'),
+		headers + ['Data'], csvfiles, append)
+
+		for record in records:
+			# Cell identifiers include the frame #, salt-1, salt-2,
+			# frame offset, cell #, cell offset, and cell rowID.
+			cell_identifiers = [record['frame'], record['salt1'],
+			record['salt2'], record['frame_offset'],
+			record['cell'], record['cell_offset'],
+			record['rowid']]
+			cell_identifiers += [record.get(column[1], '')
+			for column in extra_columns]
+
+			# Write the cell_identifiers and actual data
+			# within the cell. NULL values may be a rowid alias.
+			data = ['NULL (RowId?)' if datum is None else datum
+			for datum in record['data']]
+			table = record.get('table')
+			if table is None:
+				writer.writerow(cell_identifiers + data)
+				continue
+
+			if table not in writers:
+				writers[table] = csv_file_writer(os.path.join(
+				output_dir, 'wal_crawler_{}.csv'.format(
+				re.sub(r'[^\w.-]', '_', table))),
+				headers + tables[table]['columns'], csvfiles, append)
+			writers[table].writerow(cell_identifiers + data)
+
+	finally:
+		for csvfile in csvfiles:
+			csvfile.close()
+
+
+def csv_file_writer(out_file, headers, csvfiles, append=False):
+	"""
+	The csv_file_writer function opens a CSV file and writes its
+	headers, unless it is appending to an existing file.
+	:param out_file: The filepath of the CSV file.
+	:param headers: The header row.
+	:param csvfiles: A list the open file is appended to, so the
+	caller can close it.
+	:param append: Append to the file if it exists.
+	:return: A csv writer.
+	"""
+	append = append and os.path.exists(out_file) and \
+	os.path.getsize(out_file) > 0
+	mode = 'a' if append else 'w'
 	if sys.version_info[0] == 2:
-		csvfile = open(out_file, "wb")
+		csvfile = open(out_file, mode + 'b')
 	elif sys.version_info[0] == 3:
-		csvfile = open(out_file, "w", newline='',
+		csvfile = open(out_file, mode, newline='',
 		encoding='utf-8')
-		
-	with csvfile:
-		writer = csv.writer(csvfile)
+	csvfiles.append(csvfile)
+
+	writer = csv.writer(csvfile)
+	if not append:
 		writer.writerow(headers)
+	return writer
 
-		for frame in data['frames']:
-
-			for cell in data['frames'][frame]['cells']:
-
-				# Only write entries for cells that have data.
-				if ('data' in data['frames'][frame]['cells'][cell].keys() and
-				len(data['frames'][frame]['cells'][cell]['data']) > 0):
-					# Convert relative frame and cell offsets to
-					# file offsets.
-					frame_offset = 32 + (
-					frame * data['header']['pagesize']) + (
-					frame * 24)
-					cell_offset = frame_offset + 24 + data['frames'][frame]['cells'][cell]['offset']
-
-					# Cell identifiers include the frame #, 
-					# salt-1, salt-2, frame offset,
-					# cell #, cell offset, and cell rowID.
-					cell_identifiers = [frame, data['frames'][frame]['header']['salt1'],
-										data['frames'][frame]['header']['salt2'],
-										frame_offset, cell, cell_offset,
-										data['frames'][frame]['cells'][cell]['rowid']]
-
-					# Write the cell_identifiers and actual data
-					# within the cell
-					writer.writerow(
-					cell_identifiers + data['frames'][frame]['cells'][cell]['data'])
 
-				else:
-					continue
+def columnar_writer(records, output_dir, extra_columns=(),
+tables=None, output_format='parquet'):
+	"""
+	The columnar_writer function writes the records in batches to
+	two tables. The cells table holds one typed row per cell and
+	the cell_values table one row per value, linked by cell_id.
+	Parquet and Arrow output require pyarrow. Without it, or when
+	requested, the tables are bulk inserted into a SQLite database.
+	:param records: An iterable of cell records.
+	:param output_dir: The directory to write the output to.
+	:param extra_columns: A list of (header, record key) tuples
+	added to the cells table as text columns.
+	:param tables: The tables dictionary from schema_index, used
+	to name the values, or None.
+	:param output_format: 'parquet', 'arrow' or 'sqlite'.
+	:return: Nothing.
+	"""
+	if output_format != 'sqlite' and pyarrow is None:
+		msg = ('pyarrow is not installed, writing SQLite output '
+		'instead of {}').format(output_format)
+		print('[-]', msg)
+		logging.warning(msg)
+		output_format = 'sqlite'
+
+	batches = record_batches(records, [column[1]
+	for column in extra_columns], tables or {})
+	if output_format == 'sqlite':
+		out_file = sqlite_writer(batches, output_dir,
+		[column[1] for column in extra_columns])
+	else:
+		out_file = arrow_writer(batches, output_dir,
+		[column[1] for column in extra_columns], output_format)
 
-		csvfile.flush()
-		csvfile.close()
+	msg = 'Recovered cells written to {}'.format(out_file)
+	print('[+]', msg)
+	logging.info(msg)
 
 
-def regular_search(data, options):
+def record_batches(records, extra_keys, tables):
+	"""
+	The record_batches function splits records into batches of
+	columns. Values are split by storage class into integer, real,
+	text and blob columns, of which one is set on each row and none
+	for a NULL.
+	:param records: An iterable of cell records.
+	:param extra_keys: The record keys of the extra columns.
+	:param tables: The tables dictionary from schema_index.
+	:return: A generator of (cells, values) tuples, each a
+	dictionary of column names and lists.
+	"""
+	cell_keys = ['cell_id', 'frame', 'page', 'salt1', 'salt2',
+	'frame_offset', 'cell', 'cell_offset', 'rowid', 'table_name']
+	value_keys = ['cell_id', 'column', 'name', 'integer', 'real',
+	'text', 'blob']
+	cells = {key: [] for key in cell_keys + extra_keys}
+	values = {key: [] for key in value_keys}
+
+	for cell_id, record in enumerate(records):
+		table = record.get('table')
+		cells['cell_id'].append(cell_id)
+		for key in cell_keys[1:9]:
+			cells[key].append(record[key])
+		cells['table_name'].append(table)
+		for key in extra_keys:
+			cells[key].append(record.get(key))
+
+		columns = tables.get(table, {}).get('columns', ())
+		for column, datum in enumerate(record['data']):
+			values['cell_id'].append(cell_id)
+			values['column'].append(column)
+			values['name'].append(columns[column]
+			if column < len(columns) else None)
+			storage = [None, None, None, None]
+			if datum is None:
+				pass
+			elif isinstance(datum, int):
+				storage[0] = datum
+			elif isinstance(datum, float):
+				storage[1] = datum
+			elif isinstance(datum, bytes):
+				storage[3] = datum
+			else:
+				storage[2] = datum
+			for key, item in zip(value_keys[3:], storage):
+				values[key].append(item)
+
+		if len(cells['cell_id']) >= BATCH_SIZE:
+			yield cells, values
+			cells = {key: [] for key in cells}
+			values = {key: [] for key in values}
+
+	if cells['cell_id']:
+		yield cells, values
+
+
+def arrow_writer(batches, output_dir, extra_keys,
+output_format='parquet'):
+	"""
+	The arrow_writer function writes batches to Parquet files or
+	Arrow IPC files with pyarrow.
+	:param batches: A generator of batches from record_batches.
+	:param output_dir: The directory to write the files to.
+	:param extra_keys: The record keys of the extra columns.
+	:param output_format: 'parquet' or 'arrow'.
+	:return: A description of the files written.
+	"""
+	int64 = pyarrow.int64()
+	string = pyarrow.string()
+	schemas = {'cells': pyarrow.schema(
+	[(key, int64) for key in ('cell_id', 'frame', 'page', 'salt1',
+	'salt2', 'frame_offset', 'cell', 'cell_offset', 'rowid')] +
+	[('table_name', string)] + [(key, string) for key in extra_keys]),
+	'cell_values': pyarrow.schema([('cell_id', int64),
+	('column', pyarrow.int32()), ('name', string), ('integer', int64),
+	('real', pyarrow.float64()), ('text', string),
+	('blob', pyarrow.binary())])}
+
+	extension = '.parquet' if output_format == 'parquet' else '.arrow'
+	out_files = {name: os.path.join(output_dir,
+	'wal_crawler_{}{}'.format(name, extension)) for name in schemas}
+	writers = {}
+	try:
+		for name in schemas:
+			if output_format == 'parquet':
+				writers[name] = pyarrow.parquet.ParquetWriter(
+				out_files[name], schemas[name])
+			else:
+				writers[name] = pyarrow.ipc.new_file(out_files[name],
+				schemas[name])
+
+		for batch in batches:
+			for name, columns in zip(('cells', 'cell_values'), batch):
+				writers[name].write_table(pyarrow.Table.from_pydict(
+				columns, schema=schemas[name]))
+	finally:
+		for writer in writers.values():
+			writer.close()
+
+	return ' and '.join(sorted(out_files.values()))
+
+
+def sqlite_writer(batches, output_dir, extra_keys):
+	"""
+	The sqlite_writer function bulk inserts batches into a SQLite
+	database. SQLite keeps the storage class of each value, so the
+	cell_values table holds a single value column.
+	:param batches: A generator of batches from record_batches.
+	:param output_dir: The directory to write the database to.
+	:param extra_keys: The record keys of the extra columns.
+	:return: The filepath of the database.
+	"""
+	out_file = os.path.join(output_dir, 'wal_crawler.sqlite')
+	if os.path.exists(out_file):
+		os.remove(out_file)
+
+	cell_columns = ['cell_id INTEGER PRIMARY KEY', 'frame INTEGER',
+	'page INTEGER', 'salt1 INTEGER', 'salt2 INTEGER',
+	'frame_offset INTEGER', 'cell INTEGER', 'cell_offset INTEGER',
+	'rowid INTEGER', 'table_name TEXT'] + ['{} TEXT'.format(key)
+	for key in extra_keys]
+	cell_insert = 'INSERT INTO cells VALUES ({})'.format(
+	', '.join('?' * len(cell_columns)))
+
+	conn = sqlite3.connect(out_file)
+	try:
+		# The database is rebuilt from scratch if interrupted, so
+		# journaling and syncing are not needed.
+		conn.execute('PRAGMA journal_mode = OFF')
+		conn.execute('PRAGMA synchronous = OFF')
+		conn.execute('CREATE TABLE cells ({})'.format(
+		', '.join(cell_columns)))
+		conn.execute('CREATE TABLE cell_values (cell_id INTEGER, '
+		'"column" INTEGER, name TEXT, value)')
+
+		for cells, values in batches:
+			# One value column replaces the storage class columns.
+			merged = [item[0] if item[0] is not None else
+			item[1] if item[1] is not None else
+			item[2] if item[2] is not None else item[3]
+			for item in zip(values['integer'], values['real'],
+			values['text'], values['blob'])]
+			with conn:
+				conn.executemany(cell_insert, zip(*cells.values()))
+				conn.executemany('INSERT INTO cell_values VALUES '
+				'(?, ?, ?, ?)', zip(values['cell_id'],
+				values['column'], values['name'], merged))
+
+		# Indexes are built once the data is loaded.
+		with conn:
+			conn.execute('CREATE INDEX cell_values_cell_id ON '
+			'cell_values (cell_id)')
+	finally:
+		conn.close()
+	return out_file
+
+
+def regular_search(records, options, output_dir, tables=None,
+append=False):
 	"""
 	The regular_search function performs either default regular
 	expression searches for personal information or custom
-	searches based on a supplied regular expression string.
-	:param data: The dictionary containing the parsed WAL file.
+	searches based on a supplied regular expression string. It
+	wraps a record generator and scans the TEXT and BLOB values of
+	each record as it passes through, writing any matches to a CSV
+	file.
+	:param records: An iterable of cell records.
 	:param options: The options dictionary contains custom or
 	pre-determined regular expression searching
-	:return: Nothing.
+	:param output_dir: The directory to write the matches CSV to.
+	:param tables: The tables dictionary from schema_index, used to
+	report column names rather than numbers.
+	:param append: Append to an existing matches CSV file.
+	:return: A generator yielding the unmodified records.
 	"""
+	tables = tables or {}
 	msg = 'Initializing regular expression module.'
 	print('\n{}\n[+]'.format('='*20), msg)
 	logging.info(msg)
@@ -442,42 +2090,115 @@ def regular_search(data, options):
 		regexp = {'Custom': options['r']}
 	else:
 		# Default regular expression modules include: Credit card
-		# numbers, SSNs, Phone numbers, URLs, IP Addresses.
-		regexp = {'Visa Credit Card': r'^4\d{3}([\	\-]?)\d{4}\1\d{4}\1\d{4}$',
+		# numbers, SSNs, Phone numbers, URLs, IP Addresses. Named
+		# backreferences are used so the expressions can be
+		# combined into one.
+		regexp = {'Visa Credit Card': r'^4\d{3}(?P<visa_sep>[\	\-]?)\d{4}(?P=visa_sep)\d{4}(?P=visa_sep)\d{4}$',
 				  'SSN': r'^\d{3}-\d{2}-\d{4}$',
-				  'Phone Number': r'^\d{3}([\ \. \-]?)\d{3}\1\d{4}$',
+				  'Phone Number': r'^\d{3}(?P<phone_sep>[\ \. \-]?)\d{3}(?P=phone_sep)\d{4}$',
 				  'URL': r"(http[s]?://)|(www.)(?:[a-zA-Z]|[0-9]|[$-_@.&+]|[!*\(\),]|(?:%[0-9a-fA-F][0-9a-fA-F]))+",
 				  'IP Address': r'^\d{1,3}.\d{1,3}.\d{1,3}.\d{1,3}$'}
 
 		if options['r']:
 			regexp['Custom'] = options['r']
 
-	# Must compile each regular expression before seeing if any
-	# data "matches" it.
-	for exp in regexp.keys():
-		reg_exp = re.compile(regexp[exp])
-
-		for frame in data['frames']:
-
-			for cell in data['frames'][frame]['cells']:
+	scanners = regex_scanners(regexp)
+
+	headers = ['Frame', 'Frame Offset', 'Cell', 'Cell Offset',
+	'ROWID', 'Column', 'Expression', 'Value']
+	out_file = os.path.join(output_dir, 'wal_crawler_matches.csv')
+	csvfiles = []
+	writer = csv_file_writer(out_file, headers, csvfiles, append)
+
+	matches = 0
+	with csvfiles[0]:
+
+		for record in records:
+			columns = tables.get(record.get('table'), {}).get(
+			'columns', ())
+			for column, datum in enumerate(record['data']):
+				# Only TEXT and BLOB values are scanned.
+				if isinstance(datum, bytes):
+					index = 1
+				elif isinstance(datum, str):
+					index = 0
+				else:
+					continue
 
-				for datum in range(len(
-				data['frames'][frame]['cells'][cell]['data'])):
-					# TypeError will occur for non-string objects
-					# such as integers.
-					try:
-						match = reg_exp.match(
-						data['frames'][frame]['cells'][cell]['data'][datum])
-					except TypeError:
+				# The combined expression rejects most values in one
+				# pass. Values it matches are checked against each
+				# expression so that every matching one is reported.
+				for scanner in scanners:
+					if (scanner[index] is None or
+					not scanner[index].match(datum)):
 						continue
-					# Print any successful match to user.
-					if match:
-						msg = '{}: {}'.format(exp,
-						data['frames'][frame]['cells'][cell]['data'][datum])
-						print('[*]', msg)
+					for exp, member in scanner[2]:
+						if member[index] and member[index].match(datum):
+							matches += 1
+							writer.writerow([record['frame'],
+							record['frame_offset'], record['cell'],
+							record['cell_offset'], record['rowid'],
+							columns[column] if column < len(columns)
+							else column, exp, datum])
+			yield record
+
+	msg = '{} regular expression matches written to {}'.format(
+	matches, out_file)
+	print('[*]', msg)
+	logging.info(msg)
 	print('='*20)
 
 
+def regex_scanners(regexp):
+	"""
+	The regex_scanners function combines the regular expressions
+	into one alternation of named groups, so each value is scanned
+	once no matter how many expressions are searched for.
+	Expressions with numbered backreferences, or that cannot be
+	combined, are scanned on their own.
+	:param regexp: A dictionary of expression names and patterns.
+	:return: A list of (text regex, bytes regex, members) tuples,
+	where members lists the (name, (text regex, bytes regex)) of
+	each expression in the scanner.
+	"""
+	scanners = []
+	combined = []
+	members = []
+	for i, exp in enumerate(sorted(regexp)):
+		member = (exp, regex_pair(regexp[exp]))
+		# Wrapping an expression in a group renumbers its groups,
+		# breaking any numbered backreferences.
+		if re.search(r'\\[1-9]', regexp[exp]):
+			scanners.append(member[1] + ([member],))
+		else:
+			combined.append('(?P<exp{}>{})'.format(i, regexp[exp]))
+			members.append(member)
+
+	if combined:
+		try:
+			scanners.insert(0, regex_pair('|'.join(combined)) + (
+			members,))
+		except re.error:
+			scanners.extend(member[1] + ([member],)
+			for member in members)
+	return scanners
+
+
+def regex_pair(pattern):
+	"""
+	The regex_pair function compiles a pattern for TEXT values and
+	its equivalent for BLOB values.
+	:param pattern: The regular expression.
+	:return: A (text regex, bytes regex) tuple. The bytes regex is
+	None if the pattern cannot be applied to bytes.
+	"""
+	try:
+		bytes_regex = re.compile(pattern.encode('utf-8'))
+	except re.error:
+		bytes_regex = None
+	return re.compile(pattern), bytes_regex
+
+
 if __name__ == '__main__':
 
 	parser = argparse.ArgumentParser(description=__description__,
@@ -491,8 +2212,43 @@ if __name__ == '__main__':
 	parser.add_argument('-m', help='Run regular expression module',
 	action='store_true')
 	parser.add_argument('-l', help='File path of log file')
+	parser.add_argument('--mmap', help='Memory-map the WAL file and '
+	'parse frames without copying them', action='store_true')
+	parser.add_argument('--workers', help='Number of processes used '
+	'to parse frames', type=int, default=1)
+	parser.add_argument('--validate', help='Verify frame checksums '
+	'and salts, then tag each record with its frame status or skip '
+	'frames that are not valid and committed', choices=['tag', 'skip'])
+	parser.add_argument('--dedup', help='Only parse the latest '
+	'committed version of each page, or only report cells that '
+	'changed from the previous version of their page',
+	choices=['latest', 'diff'])
+	parser.add_argument('--no-carve', help='Do not carve deleted '
+	'records from freeblocks and unallocated page space',
+	dest='carve', action='store_false')
+	parser.add_argument('--db', help='Main database of the WAL '
+	'file, read to label records with their table or index and '
+	'column names. The schema is replayed from the WAL, so objects '
+	'created since the last checkpoint are labelled too')
+	parser.add_argument('--format', help='Write recovered cells to '
+	'CSV, or to columnar Parquet, Arrow or SQLite tables. Parquet '
+	'and Arrow require pyarrow and fall back to SQLite without it',
+	choices=['csv', 'parquet', 'arrow', 'sqlite'], default='csv')
+	parser.add_argument('--incremental', help='Only parse the frames '
+	'appended since the previous run into OUTPUT_DIR and append '
+	'their records to the CSV reports', action='store_true')
+	parser.add_argument('--follow', help='Keep polling the WAL file '
+	'and append the records of new frames as they arrive',
+	action='store_true')
+	parser.add_argument('--interval', help='Seconds between polls in '
+	'follow mode', type=float, default=2)
 	args = parser.parse_args()
 
+	if (args.incremental or args.follow) and (args.dedup or
+	args.validate or args.format != 'csv'):
+		parser.error('--incremental and --follow need CSV output and '
+		'cannot be combined with --dedup or --validate')
+
 	if args.l:
 		if not os.path.exists(args.l):
 			os.makedirs(args.l)
@@ -511,7 +2267,12 @@ if __name__ == '__main__':
 		os.makedirs(args.OUTPUT_DIR)
 
 	if os.path.exists(args.WAL) and os.path.isfile(args.WAL):
-		main(args.WAL, args.OUTPUT_DIR, r=args.r, m=args.m)
+		main(args.WAL, args.OUTPUT_DIR, r=args.r, m=args.m,
+		mmap=args.mmap, workers=args.workers,
+		validate=args.validate, dedup=args.dedup, db=args.db,
+		carve=args.carve, format=args.format,
+		incremental=args.incremental, follow=args.follow,
+		interval=args.interval)
 	else:
 		msg = 'Supplied WAL file does not exist or is not a file'
 		print('[-]', msg)
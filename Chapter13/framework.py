@@ -2,8 +2,13 @@
 from __future__ import print_function
 import os
 import sys
+import time
+import types
+import struct
 import logging
 import argparse
+import itertools
+import multiprocessing
 import plugins
 import writers
 import colorama
@@ -45,6 +50,36 @@ __date__ = '20181202'
 __description__ = ('This script is our framework controller '
     'and handles each plugin')
 
+# Plugins raise TypeError for files they cannot process, while a
+# malformed file may raise one of the others part way through.
+PLUGIN_ERRORS = (TypeError, ValueError, IndexError, struct.error)
+
+
+def plugin_worker(task):
+    """
+    The plugin_worker function runs a plugin over one file in a
+    worker process. Plugins may return generators, which cannot be
+    sent between processes, so the results are collected in a list.
+    As in the serial path, results parsed before an error are kept.
+    :param task: A tuple of the plugin function and the file path.
+    :return: A tuple of the file path, the list of results or None
+    if the file could not be processed, the headers, the elapsed
+    seconds and whether the file failed part way through.
+    """
+    function, file_path = task
+    start = time.time()
+    try:
+        data, headers = function(file_path)
+    except PLUGIN_ERRORS:
+        return file_path, None, None, time.time() - start, True
+    results = []
+    try:
+        for result in data:
+            results.append(result)
+    except PLUGIN_ERRORS:
+        return file_path, results, headers, time.time() - start, True
+    return file_path, results, headers, time.time() - start, False
+
 
 class Framework(object):
 
@@ -118,11 +153,22 @@ class Framework(object):
             wal_plugin = Framework.Plugin('wal_crawler',
             self.wal_files, self.log)
             wal_output = os.path.join(self.output, 'wal')
-            wal_plugin.run(plugins.wal_crawler.main)
-            if self.kwargs['excel'] is True:
-                wal_plugin.write(wal_output, recursion=1, excel=1)
+            jobs = self.kwargs.get('jobs', 1)
+            if jobs > 1:
+                # Parse WAL files in parallel and write the results
+                # of each file as soon as it completes.
+                if self.kwargs['excel'] is True:
+                    wal_plugin.stream(plugins.wal_crawler.main,
+                    jobs, wal_output, recursion=1, excel=1)
+                else:
+                    wal_plugin.stream(plugins.wal_crawler.main,
+                    jobs, wal_output, recursion=1)
             else:
-                wal_plugin.write(wal_output, recursion=1)
+                wal_plugin.run(plugins.wal_crawler.main)
+                if self.kwargs['excel'] is True:
+                    wal_plugin.write(wal_output, recursion=1, excel=1)
+                else:
+                    wal_plugin.write(wal_output, recursion=1)
 
         # Run Setupapi Parser
         if len(self.setupapi_files) > 0:
@@ -218,19 +264,88 @@ class Framework(object):
             self.log.info(msg)
 
             for f in self.files:
+                start = time.time()
                 try:
                     data, headers = function(f)
-                    self.results['data'].append(data)
-                    self.results['headers'] = headers
-
-                except TypeError:
-                    self.log.error(('Issue processing {}. '
-                    'Skipping...').format(f))
+                except PLUGIN_ERRORS:
+                    self._log_issue(f)
                     continue
 
-            msg = 'Plugin {} completed at {}'.format(self.plugin,
-            datetime.now().strftime('%m/%d/%Y %H:%M:%S'))
-            print(colorama.Fore.GREEN + '[*]', msg)
+                # Generators are parsed as the writer consumes them,
+                # so they are timed and checked for errors then and
+                # the plugin completes once they are written.
+                if isinstance(data, types.GeneratorType):
+                    data = self._guard_results(f, data)
+                else:
+                    self._log_elapsed(f, time.time() - start,
+                    len(data))
+                self.results['data'].append(data)
+                self.results['headers'] = headers
+
+        def stream(self, function, jobs, output, **kwargs):
+            msg = 'Executing {} plugin with {} processes'.format(
+            self.plugin, jobs)
+            print(colorama.Fore.RESET + '[+]', msg)
+            self.log.info(msg)
+
+            # The writer needs the headers before it consumes the
+            # data, so wait for the first file to complete.
+            results = self._pool_results(function, jobs)
+            first = next(results, None)
+            if first is not None:
+                self.results['headers'] = first[1]
+                self.results['data'] = itertools.chain([first[0]],
+                (data for data, headers in results))
+                self.write(output, **kwargs)
+            else:
+                self._log_completed()
+
+        def _pool_results(self, function, jobs):
+            pool = multiprocessing.Pool(jobs)
+            try:
+                tasks = [(function, f) for f in self.files]
+                for f, data, headers, elapsed, failed in \
+                pool.imap_unordered(plugin_worker, tasks):
+                    if data is None:
+                        self._log_issue(f)
+                        continue
+                    if failed:
+                        self._log_issue(f, len(data))
+                    else:
+                        self._log_elapsed(f, elapsed, len(data))
+                    yield data, headers
+                pool.close()
+            finally:
+                pool.terminate()
+                pool.join()
+
+        def _guard_results(self, f, data):
+            # Results parsed before an error are kept and the rest
+            # of the file is skipped. The file is timed from when
+            # the writer starts to consume it.
+            start = time.time()
+            count = 0
+            try:
+                for result in data:
+                    count += 1
+                    yield result
+            except PLUGIN_ERRORS:
+                self._log_issue(f, count)
+                return
+            self._log_elapsed(f, time.time() - start, count)
+
+        def _log_issue(self, f, count=None):
+            if count is None:
+                msg = 'Issue processing {}. Skipping...'.format(f)
+            else:
+                msg = ('Issue processing {} after {} results. '
+                'Skipping the rest...').format(f, count)
+            self.log.error(msg)
+
+        def _log_elapsed(self, f, elapsed, count):
+            msg = ('Processed {} in {:.2f} seconds '
+            '({} results)').format(f, elapsed, count)
+            print(colorama.Fore.RESET + '[+]', msg)
             self.log.info(msg)
 
         def write(self, output, **kwargs):
@@ -254,6 +369,13 @@ class Framework(object):
                 Framework.Writer(writers.kml_writer.writer,
                 output, '', self.plugin + '.kml',
                 self.results['data'])
+            self._log_completed()
+
+        def _log_completed(self):
+            msg = 'Plugin {} completed at {}'.format(self.plugin,
+            datetime.now().strftime('%m/%d/%Y %H:%M:%S'))
+            print(colorama.Fore.GREEN + '[*]', msg)
+            self.log.info(msg)
 
     class Writer(object):
 
@@ -289,6 +411,8 @@ if __name__ == '__main__':
     action='store_true')
     parser.add_argument('-l',
     help='File path and name of log file.')
+    parser.add_argument('-j', '--jobs', help='Number of processes '
+    'used to parse WAL files (Default 1)', type=int, default=1)
     args = parser.parse_args()
 
     if(os.path.isfile(args.INPUT_DIR) or
@@ -305,5 +429,5 @@ if __name__ == '__main__':
         log_path = 'framework.log'
 
     framework = Framework(args.INPUT_DIR, args.OUTPUT_DIR,
-    log_path, excel=args.x)
+    log_path, excel=args.x, jobs=args.jobs)
     framework.run()
@@ -36,180 +36,210 @@ FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
 OTHER DEALINGS IN THE SOFTWARE.
 """
 
+# Precompiled structs for the fixed-width serial types.
+INT8 = struct.Struct('>b')
+INT16 = struct.Struct('>h')
+INT32 = struct.Struct('>i')
+INT64 = struct.Struct('>q')
+FLOAT64 = struct.Struct('>d')
+
+# Width and decoder of the fixed-size serial types, indexed by
+# serial type. Each decoder returns a one item tuple, as
+# Struct.unpack_from does. Struct does not support 24-bit or 48-bit
+# integers so they are read with int.from_bytes. Types 8 and 9 are
+# the constants 0 and 1 and take up no space, while 10 and 11 are
+# reserved.
+SERIAL_TYPES = [
+    (0, lambda data, index: ('NULL (RowId?)',)),
+    (1, INT8.unpack_from),
+    (2, INT16.unpack_from),
+    (3, lambda data, index: (int.from_bytes(
+    data[index:index + 3], 'big', signed=True),)),
+    (4, INT32.unpack_from),
+    (6, lambda data, index: (int.from_bytes(
+    data[index:index + 6], 'big', signed=True),)),
+    (8, INT64.unpack_from),
+    (8, FLOAT64.unpack_from),
+    (0, lambda data, index: (0,)),
+    (0, lambda data, index: (1,)),
+    (0, None),
+    (0, None)]
+
 
 def main(wal_file, **kwargs):
     """
-    The main function parses the header of the input file and
-    identifies the WAL file. It then splits the file into the
-    appropriate frames and send them for processing. After
-    processing, if applicable, the regular expression modules are
-    ran. Finally the raw data output is written to a CSV file.
+    The main function validates the header of the input file and
+    returns a generator of results for the WAL file so that the
+    writer can consume one cell at a time instead of the plugin
+    holding every cell in memory.
     :param wal_file: The filepath to the WAL file to be processed
-    :return: Nothing.
+    :return: A generator of result dictionaries and a list of
+    headers.
     """
-    wal_attributes = {'size': os.path.getsize(wal_file),
-    'header': {}, 'frames': {}}
+    headers = ['File', 'Frame', 'Salt-1', 'Salt-2',
+    'Frame Offset', 'Cell', 'Cell Offset', 'ROWID', 'Data']
+
+    # Validate the 32-byte WAL header now so that invalid files are
+    # reported by the framework rather than while writing.
     with open(wal_file, 'rb') as wal:
+        header_parser(wal.read(32))
+
+    results = ({'File': wal_file,
+               'Frame': record['frame'],
+               'Salt-1': record['salt1'],
+               'Salt-2': record['salt2'],
+               'Frame Offset': record['frame_offset'],
+               'Cell': record['cell'],
+               'Cell Offset': record['cell_offset'],
+               'ROWID': record['rowid'],
+               'Data': record['data']}
+               for record in iter_wal_records(wal_file))
 
-        # Parse 32-byte WAL header.
-        header = wal.read(32)
-
-        # If file is less than 32 bytes long: exit wal_crawler.
-        try:
-            wal_attributes['header'] = dict_helper(header,'>4s7i',
-            namedtuple('struct',
-            'magic format pagesize checkpoint '
-            'salt1 salt2 checksum1 checksum2'))
-        except struct.error as e:
-            logging.error('[-]', e.message + '. Exiting..')
-            raise TypeError
-
-        # Do not proceed in the program if the input file is not a
-        # WAL file.
-        magic_hex = binascii.hexlify(
-        wal_attributes['header']['magic']).decode('utf-8')
-        if magic_hex != "377f0682" and magic_hex != "377f0683":
-            logging.error(('[-] File does not have appropriate signature '
-            'for WAL file. Exiting...'))
-            raise TypeError
+    return results, headers
+
+
+def iter_wal_records(wal_file):
+    """
+    The iter_wal_records function parses the header of the input
+    file and identifies the WAL file. It then splits the file into
+    the appropriate frames and yields one flat record for every
+    recovered cell, without retaining earlier frames.
+    :param wal_file: The filepath to the WAL file to be processed
+    :return: A generator of dictionaries containing the frame,
+    salt-1, salt-2, frame_offset, cell, cell_offset, rowid and data
+    of each cell.
+    """
+    size = os.path.getsize(wal_file)
+    with open(wal_file, 'rb') as wal:
 
+        # Parse 32-byte WAL header.
+        header = header_parser(wal.read(32))
 
         # Calculate number of frames.
-        frames = int((
-        wal_attributes['size'] - 32) / (
-        wal_attributes['header']['pagesize'] + 24))
+        pagesize = header['pagesize']
+        frames = int((size - 32) / (pagesize + 24))
 
         # Parse frames in WAL file.
         for x in range(frames):
+            frame_offset = 32 + (x * (pagesize + 24))
 
             # Parse 24-byte WAL frame header.
-            wal_attributes['frames'][x] = {}
-            frame_header = wal.read(24)
-            wal_attributes['frames'][x]['header'] = dict_helper(
-            frame_header, '>6i', namedtuple('struct',
-            'pagenumber commit salt1'
-            ' salt2 checksum1'
-            ' checksum2'))
-
-            # Parse pagesize WAL frame
-            frame = wal.read(wal_attributes['header']['pagesize'])
-            frame_parser(wal_attributes, x, frame)
-
-    # Write WAL data to CSV file.
-    headers = ['File', 'Frame', 'Salt-1', 'Salt-2',
-    'Frame Offset', 'Cell', 'Cell Offset', 'ROWID', 'Data']
-    results = []
-    for frame in wal_attributes['frames']:
-        if wal_attributes['frames'][frame]['cells'] is not None:
-            for cell in wal_attributes['frames'][frame]['cells']:
-                if ('data' in wal_attributes['frames'][frame]['cells'][cell].keys() and
-                len(wal_attributes['frames'][frame]['cells'][cell]['data']) > 0):
-                    frame_offset = 32 + (frame * wal_attributes['header']['pagesize']) + (frame * 24)
-                    cell_offset = frame_offset + 24 + wal_attributes['frames'][frame]['cells'][cell]['offset']
-                    results.append({'File': wal_file,
-                    'Frame': frame,
-                    'Salt-1': wal_attributes['frames'][frame]['header']['salt1'],
-                    'Salt-2': wal_attributes['frames'][frame]['header']['salt2'],
-                    'Frame Offset': frame_offset,
-                    'Cell': cell, 'Cell Offset': cell_offset,
-                    'ROWID': wal_attributes['frames'][frame]['cells'][cell]['rowid'],
-                    'Data': wal_attributes['frames'][frame]['cells'][cell]['data']})
-
-    return results, headers
-
-
-def frame_parser(wal_dict, x, frame):
+            frame_dict = dict_helper(wal.read(24), '>6i',
+            namedtuple('struct', 'pagenumber commit salt1'
+            ' salt2 checksum1 checksum2'))
+
+            # Parse pagesize WAL frame and emit its cells.
+            frame = memoryview(wal.read(pagesize))
+            for y, cell in frame_parser(x, frame):
+                yield {'frame': x,
+                'salt1': frame_dict['salt1'],
+                'salt2': frame_dict['salt2'],
+                'frame_offset': frame_offset,
+                'cell': y,
+                'cell_offset': frame_offset + 24 + cell['offset'],
+                'rowid': cell['rowid'],
+                'data': cell['data']}
+
+
+def header_parser(header):
+    """
+    The header_parser function parses and validates the 32-byte
+    WAL file header.
+    :param header: The first 32 bytes of the WAL file.
+    :return: A dictionary of the WAL header values.
+    """
+    # If file is less than 32 bytes long: exit wal_crawler.
+    try:
+        wal_header = dict_helper(header, '>4s7i',
+        namedtuple('struct',
+        'magic format pagesize checkpoint '
+        'salt1 salt2 checksum1 checksum2'))
+    except struct.error as e:
+        logging.error('[-] {}. Exiting..'.format(e))
+        raise TypeError
+
+    # Do not proceed in the program if the input file is not a
+    # WAL file.
+    magic_hex = binascii.hexlify(wal_header['magic']).decode('utf-8')
+    if magic_hex != "377f0682" and magic_hex != "377f0683":
+        logging.error(('[-] File does not have appropriate signature '
+        'for WAL file. Exiting...'))
+        raise TypeError
+
+    return wal_header
+
+
+def frame_parser(x, frame):
     """
     The frame_parser function processes WAL frames.
-    :param wal_dict: The dictionary containing parsed WAL objects.
     :param x: An integer specifying the current frame.
-    :param frame: The content within the frame read from the WAL
-    file.
-    :return: Nothing.
+    :param frame: A memoryview of the content within the frame
+    read from the WAL file.
+    :return: A generator of (cell number, cell dictionary) tuples
+    for each cell that contains data.
     """
 
     # Parse 8-byte WAL page header
-    page_header = frame[0:8]
-    wal_dict['frames'][x]['page_header'] = dict_helper(
-    page_header, '>b3hb', namedtuple('struct',
-    'type freeblocks cells offset'
+    page_header = dict_helper(frame[0:8], '>b3hb',
+    namedtuple('struct', 'type freeblocks cells offset'
     ' fragments'))
     # Only want to parse 0x0D B-Tree Leaf Cells
-    if wal_dict['frames'][x]['page_header']['type'] != 13:
-        logging.info(('Found a non-Leaf Cell in frame {}. Popping '
-        'frame from dictionary').format(x))
-        wal_dict['frames'].pop(x)
+    if page_header['type'] != 13:
+        logging.info(('Found a non-Leaf Cell in frame {}. '
+        'Skipping frame').format(x))
         return
-    # Parse offsets for "X" cells
-    cells = wal_dict['frames'][x]['page_header']['cells']
-    wal_dict['frames'][x]['cells'] = {}
 
-    for y in range(cells):
+    # Parse offsets for "X" cells
+    for y in range(page_header['cells']):
         start = 8 + (y * 2)
-        wal_dict['frames'][x]['cells'][y] = {}
-
-        wal_dict['frames'][x]['cells'][y] = dict_helper(
-        frame[start: start + 2], '>h', namedtuple(
-        'struct', 'offset'))
+        cell_offset = struct.unpack('>h', frame[start: start + 2])[0]
 
-        # Parse cell content
-        cell_parser(wal_dict, x, y, frame)
+        # Parse cell content. Only yield cells that have data.
+        cell = cell_parser(x, y, frame, cell_offset)
+        if cell is not None and len(cell['data']) > 0:
+            yield y, cell
 
 
-def cell_parser(wal_dict, x, y, frame):
+def cell_parser(x, y, frame, cell_offset):
     """
     The cell_parser function processes WAL cells.
-    :param wal_dict: The dictionary containing parsed WAL objects.
     :param x: An integer specifying the current frame.
     :param y: An integer specifying the current cell.
-    :param frame: The content within the frame read from the WAL
-    file.
-    :return: Nothing.
+    :param frame: A memoryview of the content within the frame
+    read from the WAL file. Slicing it does not copy the data.
+    :param cell_offset: The offset of the cell within the frame.
+    :return: A dictionary of the parsed cell or None if it could
+    not be parsed.
     """
-    index = 0
-    # Create alias to cell_root to shorten navigating the WAL
-    # dictionary structure.
-    cell_root = wal_dict['frames'][x]['cells'][y]
-    cell_offset = cell_root['offset']
+    cell_root = {'offset': cell_offset}
 
-    # Parse the payload length and rowID Varints.
+    # Parse the payload length and rowID Varints. Each Varint is
+    # read in place and returns the offset of the following field.
+    # Following the payload length and rowID is the record header,
+    # which begins with its own length as a Varint.
     try:
-        payload_len, index_a = single_varint(
-        frame[cell_offset:cell_offset + 9])
-        row_id, index_b = single_varint(
-        frame[cell_offset + index_a: cell_offset + index_a + 9])
+        payload_len, index = single_varint(frame, cell_offset)
+        row_id, index = single_varint(frame, index)
+        header_start = index
+        header_len, index = single_varint(frame, index)
     except ValueError:
-        logging.warn(('Found a potential three-byte or greater '
-        'varint in cell {} from frame {}').format(y, x))
-        return
-
-    # Update the index. Following the payload length and rowID is
-    # the 1-byte header length.
+        logging.warning(('Found a malformed varint in cell {} from '
+        'frame {}').format(y, x))
+        return None
     cell_root['payloadlength'] = payload_len
     cell_root['rowid'] = row_id
-    index += index_a + index_b
-    cell_root['headerlength'] = struct.unpack('>b',
-    frame[cell_offset + index: cell_offset + index + 1])[0]
+    cell_root['headerlength'] = header_len
 
-    # Update the index with the 1-byte header length. Next process
-    # each Varint in "headerlength" - 1 bytes.
-    index += 1
+    # The serial type Varints in the rest of the record header and
+    # the data they describe are decoded together.
     try:
-        types, index_a = multi_varint(
-        frame[cell_offset + index:cell_offset+index+cell_root['headerlength']-1])
+        cell_root['types'], cell_root['data'] = record_parser(frame,
+        index, header_start + header_len, header_start + payload_len)
     except ValueError:
-        logging.warn(('Found a potential three-byte or greater '
-        'varint in cell {} from frame {}').format(y, x))
-        return
-    cell_root['types'] = types
-    index += index_a
-
-    # Immediately following the end of the Varint headers begins
-    # the actual data described by the headers. Process them using
-    # the typeHelper function.
-    diff = cell_root['payloadlength'] - cell_root['headerlength']
-    cell_root['data'] = type_helper(cell_root['types'],
-    frame[cell_offset + index: cell_offset + index + diff])
+        logging.warning(('Cell {} from frame {} is malformed or '
+        'truncated').format(y, x))
+        return None
+    return cell_root
 
 
 def dict_helper(data, format, keys):
@@ -228,126 +258,90 @@ def dict_helper(data, format, keys):
 
 def single_varint(data, index=0):
     """
-    The single_varint function processes a Varint and returns the
-    length of that Varint.
-    :param data: The data containing the Varint (maximum of 9
-    bytes in length as that is the maximum size of a Varint).
-    :param index: The current index within the data.
+    The single_varint function processes a Varint at an offset
+    within the data, without slicing it. Varints are between 1
+    and 9 bytes long. The first eight bytes contribute their low
+    seven bits while their high bit is set, and a ninth byte
+    contributes all eight bits.
+    :param data: The data containing the Varint.
+    :param index: The offset of the Varint within the data.
     :return: varint, the processed varint value,
-    and index which is used to identify how long the Varint was.
-    """
-
-    # If the decimal value is => 128 -- then first bit is set and
-    # need to process next byte.
-    if ord(data[index:index+1]) >= 128:
-        # Check if there is a three or more byte varint
-        if ord(data[index + 1: index + 2]) >= 128:
-            raise ValueError
-        varint = (ord(data[index:index+1]) - 128) * 128 + ord(
-        data[index + 1: index + 2])
-        index += 2
-        return varint, index
-
-    # If the decimal value is < 128 -- then first bit is not set
-    # and is the only byte of the Varint.
-    else:
-        varint = ord(data[index:index+1])
-        index += 1
-        return varint, index
-
-
-def multi_varint(data):
-    """
-    The multi_varint function is similar to the single_varint
-    function. The difference is that it takes a range of data
-    and finds all Varints within it.
-    :param data: The data containing the Varints.
-    :return: varints, a list containing the processed varint
-    values, and index which is used to identify how long the
-    Varints were.
+    and index which is the offset following the Varint.
     """
-    varints = []
-    index = 0
-
-    # Loop forever until all Varints are found by repeatedly
-    # calling singleVarint.
-    while len(data) != 0:
-        varint, index_a = single_varint(data)
-        varints.append(varint)
-        index += index_a
-        # Shorten data to exclude the most recent Varint.
-        data = data[index_a:]
-
-    return varints, index
-
-
-def type_helper(types, data):
+    try:
+        byte = data[index]
+        # If the decimal value is < 128 -- then first bit is not
+        # set and is the only byte of the Varint.
+        if byte < 128:
+            return byte, index + 1
+
+        # If the decimal value is => 128 -- then first bit is set
+        # and need to process the following bytes.
+        varint = byte & 0x7f
+        for i in range(index + 1, index + 8):
+            byte = data[i]
+            varint = (varint << 7) | (byte & 0x7f)
+            if byte < 128:
+                return varint, i + 1
+        varint = (varint << 8) | data[index + 8]
+    except IndexError:
+        raise ValueError('Varint at offset {} is truncated'.format(
+        index))
+
+    # Nine byte Varints are 64-bit two's complement integers.
+    if varint & 0x8000000000000000:
+        varint -= 0x10000000000000000
+    return varint, index + 9
+
+
+def record_parser(data, index, header_end, end):
     """
-    The type_helper function decodes the serial type of the
-    Varints in the WAL file.
-    :param types: The processed values of the Varints.
-    :param data: The raw data in the cell that needs to be
-    properly decoded via its varint values.
-    :return: cell_data, a list of the processed data.
+    The record_parser function decodes a record in one pass. Each
+    serial type Varint in the record header is read and the value
+    it describes is immediately decoded from the record body.
+    :param data: The data containing the record.
+    :param index: The offset of the first serial type Varint.
+    :param header_end: The offset where the record body begins.
+    :param end: The offset where the record ends.
+    :return: types, a list of the serial types, and cell_data, a
+    list of the processed data.
     """
+    types = []
     cell_data = []
-    index = 0
-
-    # Value of type dictates how the data should be processed.
-    # See serial type table in chapter for list of possible
-    # values.
-    for type in types:
-
-        if type == 0:
-            cell_data.append('NULL (RowId?)')
-        elif type == 1:
-            cell_data.append(struct.unpack('>b',
-            data[index:index + 1])[0])
+    body = header_end
+    # Overflowing records are cut off at the end of the page.
+    if end > len(data):
+        end = len(data)
+
+    while index < header_end:
+        # Nearly all serial types fit in a single byte.
+        serial_type = data[index]
+        if serial_type < 128:
             index += 1
-        elif type == 2:
-            cell_data.append(struct.unpack('>h',
-            data[index:index + 2])[0])
-            index += 2
-        elif type == 3:
-            # Struct does not support 24-bit integer
-            cell_data.append(int(binascii.hexlify(
-            data[index:index + 3]).decode('utf-8'), 16))
-            index += 3
-        elif type == 4:
-            cell_data.append(struct.unpack(
-            '>i', data[index:index + 4])[0])
-            index += 4
-        elif type == 5:
-            # Struct does not support 48-bit integer
-            cell_data.append(int(binascii.hexlify(
-            data[index:index + 6]).decode('utf-8'), 16))
-            index += 6
-        elif type == 6:
-            cell_data.append(struct.unpack(
-            '>q', data[index:index + 8])[0])
-            index += 8
-        elif type == 7:
-            cell_data.append(struct.unpack(
-            '>d', data[index:index + 8])[0])
-            index += 8
-        # Type 8 == Constant 0 and Type 9 == Constant 1. Neither of these take up space in the actual data.
-        elif type == 8:
-            cell_data.append(0)
-        elif type == 9:
-            cell_data.append(1)
-        # Types 10 and 11 are reserved and currently not implemented.
-        elif type > 12 and type % 2 == 0:
-            b_length = int((type - 12) / 2)
-            cell_data.append(data[index:index + b_length])
-            index += b_length
-        elif type > 13 and type % 2 == 1:
-            s_length = int((type - 13) / 2)
-            cell_data.append(
-            data[index:index + s_length].decode('utf-8'))
-            index += s_length
-
         else:
-            msg = 'Unexpected serial type: {}'.format(type)
-            logging.error(msg)
-
-    return cell_data
\ No newline at end of file
+            serial_type, index = single_varint(data, index)
+        types.append(serial_type)
+
+        if serial_type < 12:
+            width, decoder = SERIAL_TYPES[serial_type]
+            if decoder is None:
+                logging.error('Unexpected serial type: {}'.format(
+                serial_type))
+                continue
+            if body + width > end:
+                raise ValueError('Record is truncated')
+            cell_data.extend(decoder(data, body))
+            body += width
+        else:
+            # Even types >= 12 are BLOBs and odd types >= 13 are
+            # TEXT, in both cases (type - 12) / 2 bytes long.
+            stop = body + ((serial_type - 12) >> 1)
+            if serial_type & 1:
+                cell_data.append(str(data[body:stop if stop < end
+                else end], 'utf-8', 'replace'))
+            else:
+                cell_data.append(bytes(data[body:stop if stop < end
+                else end]))
+            body = stop
+
+    return types, cell_data
@@ -59,6 +59,8 @@ def writer(output, headers, output_data, **kwargs):
         for i, data in enumerate(output_data):
             if i > 0:
                 ws = add_worksheet(wb, title_length)
+            # Plugins may return a generator of results
+            data = list(data)
             cell_length = len(data)
             tmp = []
             for dictionary in data: